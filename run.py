@@ -1,18 +1,25 @@
 """Main entry point for SCM analytics pipeline.
 
-Supports: --init, --once, --dry-run, --status, --unlock, --rollback N
+Supports: --init, --once, --dry-run, --status, --unlock, --rollback N, --watch, --cluster
+Options:  --ingest-workers N (parallel file preparation during ingestion)
+          --bulk-upsert (one set-based upsert per CORE table per batch)
+          --quarantine (split rows failing row-level DQ off instead of rejecting the file)
+          --ingest-prefetch N (prepare up to N files ahead of the writer on a reader thread)
+          --archive (move processed files out of inbox/ into archive/ or rejected/)
+          --watch-interval S (seconds between inbox polls in --watch mode)
 """
 import argparse
 import logging
 import os
 import sys
+import time
 from datetime import datetime, timezone
 from pathlib import Path
 
 # Ensure project root is on sys.path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from src.db import get_connection, init_db, get_row_counts, DB_PATH
+from src.db import get_connection, init_db, migrate_schema, get_row_counts, DB_PATH
 from src.config import AppConfig
 
 logging.basicConfig(
@@ -85,60 +92,40 @@ def unlock_batch(con) -> None:
     logger.info("Batch lock released.")
 
 
-def run_pipeline(con, config: AppConfig, dry_run: bool = False) -> None:
+def run_pipeline(
+    con,
+    config: AppConfig,
+    dry_run: bool = False,
+    ingest_workers: int = 1,
+    bulk_upsert: bool = False,
+    quarantine: bool = False,
+    ingest_prefetch: int = 0,
+    archive: bool = False,
+) -> None:
     """Full ETL + mart build cycle."""
     from src.ingest import ingest_all
-    from src.mart_scm import build_all_scm_marts
-    from src.mart_pnl import build_all_pnl_marts
-    from src.mart_reco import build_all_reco_marts
-    from src.mart_constraint import build_all_constraint_marts
-    from src.allocation import allocate_all_charges
-    from src.coverage import compute_coverage
+    from src.watch import build_marts
 
     batch_id = acquire_lock(con)
     logger.info(f"Pipeline started. Batch ID: {batch_id}, dry_run={dry_run}")
 
     try:
+        if not dry_run:
+            # Columns added to schema.yaml or the DDL since the last run (additive only)
+            for migration_id in migrate_schema(con, config):
+                logger.info(f"Schema migration applied: {migration_id}")
+
         # 1. Ingest files from inbox/
         logger.info("=== PHASE 1: Ingestion ===")
-        results = ingest_all(con, config, batch_id=batch_id, dry_run=dry_run)
-        success_count = sum(1 for r in results if r["status"] == "success")
-        total_rows = sum(r["rows"] for r in results)
-        logger.info(f"Ingestion complete: {success_count}/{len(results)} files, {total_rows} rows")
-
-        for r in results:
-            if r["status"] not in ("success", "skipped"):
-                logger.warning(f"  FAILED: {r['file']} - {r['error']}")
-
-        # Update batch log
-        con.execute(
-            "UPDATE raw.system_batch_log SET file_count = ?, rows_ingested = ? WHERE batch_id = ?",
-            [len(results), total_rows, batch_id]
+        results = ingest_all(
+            con, config, batch_id=batch_id, dry_run=dry_run,
+            workers=ingest_workers, bulk=bulk_upsert, quarantine=quarantine,
+            prefetch=ingest_prefetch, archive=archive,
         )
+        _record_ingest(con, batch_id, results)
 
-        # 2. Build SCM marts
-        logger.info("=== PHASE 2: SCM Marts ===")
-        build_all_scm_marts(con, config)
-
-        # 3. Run allocation
-        logger.info("=== PHASE 3: Cost Allocation ===")
-        allocate_all_charges(con, config)
-
-        # 4. Build P&L marts
-        logger.info("=== PHASE 4: P&L Marts ===")
-        build_all_pnl_marts(con, config)
-
-        # 5. Build reconciliation marts
-        logger.info("=== PHASE 5: Reconciliation Marts ===")
-        build_all_reco_marts(con, config)
-
-        # 6. Build constraint marts
-        logger.info("=== PHASE 6: Constraint Detection ===")
-        build_all_constraint_marts(con, config)
-
-        # 7. Compute coverage
-        logger.info("=== PHASE 7: Coverage Reporting ===")
-        compute_coverage(con, config)
+        # 2-7. SCM marts, allocation, P&L, reconciliation, constraints, coverage
+        build_marts(con, config)
 
         if dry_run:
             logger.info("Dry run complete. Results NOT persisted (no rollback needed for read-based marts).")
@@ -152,6 +139,109 @@ def run_pipeline(con, config: AppConfig, dry_run: bool = False) -> None:
         raise
 
 
+def _record_ingest(con, batch_id: int, results: list[dict]) -> None:
+    """Log ingestion results and store the file/row counts on the batch log."""
+    success_count = sum(1 for r in results if r["status"] == "success")
+    total_rows = sum(r["rows"] for r in results)
+    logger.info(f"Ingestion complete: {success_count}/{len(results)} files, {total_rows} rows")
+
+    for r in results:
+        if r["status"] not in ("success", "skipped"):
+            logger.warning(f"  FAILED: {r['file']} - {r['error']}")
+
+    # Update batch log
+    con.execute(
+        "UPDATE raw.system_batch_log SET file_count = ?, rows_ingested = ? WHERE batch_id = ?",
+        [len(results), total_rows, batch_id]
+    )
+
+
+def watch_pipeline(
+    con,
+    config: AppConfig,
+    inbox_dir: Path | None = None,
+    interval: float | None = None,
+    ingest_workers: int = 1,
+    bulk_upsert: bool = False,
+    quarantine: bool = False,
+    ingest_prefetch: int = 0,
+    archive: bool = False,
+    max_cycles: int | None = None,
+    sleep=time.sleep,
+) -> None:
+    """Long-running micro-batch loop (--watch) on one warm connection and config.
+
+    Each poll hands the files that have stopped changing to a micro-batch of
+    at most ingest.yaml watch.max_files_per_batch files, run under the batch
+    lock. Only the mart phases reading the CORE tables that batch loaded are
+    rebuilt, and the daily SCM marts only for the months it loaded. When more files are ready than one batch takes, the rest wait for
+    the next cycle, which starts without sleeping (backpressure). Tables whose
+    mart rebuild failed stay pending and are retried with the next batch.
+    """
+    from src.ingest import ingest_all
+    from src.periods import batch_periods
+    from src.watch import InboxTracker, affected_phases, build_marts, watch_settings
+
+    settings = watch_settings(config)
+    interval = settings["poll_seconds"] if interval is None else interval
+    max_files = max(1, settings["max_files_per_batch"])
+    tracker = InboxTracker(inbox_dir, settings["stable_polls"])
+    pending_tables: set[str] = set()
+    pending_batches: list[int] = []
+
+    for migration_id in migrate_schema(con, config):
+        logger.info(f"Schema migration applied: {migration_id}")
+    logger.info(f"Watching {tracker.inbox} every {interval:g}s (max {max_files} files per batch)")
+
+    cycles = 0
+    while max_cycles is None or cycles < max_cycles:
+        cycles += 1
+        ready = tracker.poll()
+        batch = ready[:max_files]
+        if len(ready) > max_files:
+            logger.warning(f"Watch backlog: {len(ready) - max_files} ready file(s) deferred to the next batch")
+
+        if batch or pending_tables:
+            try:
+                batch_id = acquire_lock(con)
+            except RuntimeError as e:
+                logger.warning(f"Micro-batch postponed: {e}")
+                sleep(interval)
+                continue
+
+            logger.info(f"Micro-batch {batch_id}: {len(batch)} file(s)")
+            try:
+                if batch:
+                    results = ingest_all(
+                        con, config, batch_id=batch_id, files=batch,
+                        workers=ingest_workers, bulk=bulk_upsert, quarantine=quarantine,
+                        prefetch=ingest_prefetch, archive=archive,
+                    )
+                    tracker.mark_done(batch)
+                    _record_ingest(con, batch_id, results)
+                    pending_tables |= {r["table"] for r in results if r["status"] == "success"}
+                    pending_batches.append(batch_id)
+
+                phases = affected_phases(pending_tables)
+                if phases:
+                    periods = batch_periods(con, pending_batches, updates_unknown=True)
+                    for table in pending_tables:
+                        periods.setdefault(table, None)
+                    build_marts(con, config, phases, periods=periods)
+                pending_tables.clear()
+                pending_batches.clear()
+                release_lock(con, batch_id, status="success")
+            except Exception as e:
+                logger.error(f"Micro-batch {batch_id} failed: {e}")
+                release_lock(con, batch_id, status="failed", error=str(e))
+            except BaseException:
+                release_lock(con, batch_id, status="failed", error="interrupted")
+                raise
+
+        if len(ready) <= max_files:
+            sleep(interval)
+
+
 def print_status(con, config: AppConfig) -> None:
     """Print pipeline status: last batch, table counts, DQ summary."""
     print("\n" + "=" * 60)
@@ -246,12 +336,8 @@ def print_status(con, config: AppConfig) -> None:
 
 def rollback_batches(con, config: AppConfig, n: int) -> None:
     """Rollback the last N batches."""
-    from src.mart_scm import build_all_scm_marts
-    from src.mart_pnl import build_all_pnl_marts
-    from src.mart_reco import build_all_reco_marts
-    from src.mart_constraint import build_all_constraint_marts
-    from src.allocation import allocate_all_charges
-    from src.coverage import compute_coverage
+    from src.periods import batch_periods, period_predicate
+    from src.watch import affected_phases, build_marts
 
     # Get batch IDs to rollback
     batches = con.execute(
@@ -272,13 +358,25 @@ def rollback_batches(con, config: AppConfig, n: int) -> None:
         "fact_exchange_rate", "fact_cost_structure",
     ]
 
+    # Periods the batches loaded, per table: the delete only visits those
+    # months' row groups on period-clustered tables (see src/periods.py)
+    loaded_periods = batch_periods(con, batch_ids)
+    touched = set()
+
     for tbl in core_tables:
         placeholders = ",".join(["?"] * len(batch_ids))
+        period_sql, period_params = "TRUE", []
+        if loaded_periods.get(tbl):
+            # The recorded range ignores NULL event dates: keep matching those rows
+            period_sql, period_params = period_predicate(tbl, loaded_periods[tbl], config, include_null=True)
         try:
             deleted = con.execute(
-                f"DELETE FROM core.{tbl} WHERE load_batch_id IN ({placeholders})", batch_ids
-            ).fetchone()
-            logger.info(f"  Rolled back core.{tbl}")
+                f"DELETE FROM core.{tbl} WHERE load_batch_id IN ({placeholders}) AND {period_sql}",
+                batch_ids + period_params,
+            ).fetchone()[0]
+            if deleted:
+                touched.add(tbl)
+            logger.info(f"  Rolled back core.{tbl}: {deleted} rows")
         except Exception as e:
             logger.warning(f"  Could not rollback core.{tbl}: {e}")
 
@@ -288,18 +386,31 @@ def rollback_batches(con, config: AppConfig, n: int) -> None:
             "UPDATE raw.system_batch_log SET status = 'rolled_back' WHERE batch_id = ?", [bid]
         )
 
-    # Rebuild all marts
-    logger.info("Rebuilding all marts...")
-    build_all_scm_marts(con, config)
-    allocate_all_charges(con, config)
-    build_all_pnl_marts(con, config)
-    build_all_reco_marts(con, config)
-    build_all_constraint_marts(con, config)
-    compute_coverage(con, config)
+    # Rebuild the marts reading the tables that lost rows. The daily SCM marts
+    # only rebuild the deleted months; the others are rebuilt whole because
+    # they aggregate across periods (e.g. a charge's allocation period is not
+    # its invoice_date month).
+    logger.info("Rebuilding affected marts...")
+    build_marts(
+        con, config, affected_phases(touched),
+        periods={tbl: loaded_periods.get(tbl) for tbl in touched},
+    )
 
     logger.info(f"Rollback of {len(batch_ids)} batch(es) complete.")
 
 
+def cluster_facts(con, config: AppConfig) -> None:
+    """Rewrite the period-clustered CORE facts in event-date order (maintenance)."""
+    from src.periods import cluster_core_facts
+
+    lock = con.execute("SELECT locked, pid FROM raw.system_batch_lock WHERE lock_id = 1").fetchone()
+    if lock and lock[0]:
+        raise RuntimeError(f"Pipeline is locked by PID {lock[1]}; cluster after it finishes.")
+    rewritten = cluster_core_facts(con, config)
+    if not rewritten:
+        logger.info("No tables configured under ingest.yaml storage.cluster_by_period.")
+
+
 def main():
     parser = argparse.ArgumentParser(description="SCM Analytics Pipeline")
     group = parser.add_mutually_exclusive_group(required=True)
@@ -309,6 +420,35 @@ def main():
     group.add_argument("--status", action="store_true", help="Show pipeline status")
     group.add_argument("--unlock", action="store_true", help="Force-unlock batch lock (crash recovery)")
     group.add_argument("--rollback", type=int, metavar="N", help="Rollback last N batches")
+    group.add_argument("--watch", action="store_true", help="Watch inbox/ and ingest new files in micro-batches")
+    group.add_argument(
+        "--cluster", action="store_true",
+        help="Rewrite CORE facts in ingest.yaml storage.cluster_by_period in event-date order",
+    )
+    parser.add_argument(
+        "--ingest-workers", type=int, default=1, metavar="N",
+        help="Worker threads for hash/read/DQ/cast during ingestion (default: 1, sequential)",
+    )
+    parser.add_argument(
+        "--ingest-prefetch", type=int, default=0, metavar="N",
+        help="With one worker, prepare up to N files ahead while the current one commits (default: 0, off)",
+    )
+    parser.add_argument(
+        "--bulk-upsert", action="store_true",
+        help="Group staged files per CORE table and upsert each table once per batch",
+    )
+    parser.add_argument(
+        "--quarantine", action="store_true",
+        help="Move rows failing row-level DQ to raw.quarantine_<table> and load the rest",
+    )
+    parser.add_argument(
+        "--archive", action="store_true",
+        help="After commit, move loaded files to archive/<table>/<date>/ and rejected ones to rejected/<date>/",
+    )
+    parser.add_argument(
+        "--watch-interval", type=float, default=None, metavar="S",
+        help="Seconds between inbox polls with --watch (default: ingest.yaml watch.poll_seconds)",
+    )
 
     args = parser.parse_args()
 
@@ -317,16 +457,37 @@ def main():
 
     try:
         if args.init:
-            init_db(con)
+            init_db(con, config)
             seed_dim_charge_policy(con, config)
             logger.info("Database initialized successfully.")
             logger.info(f"Database path: {DB_PATH.resolve()}")
 
         elif args.once:
-            run_pipeline(con, config, dry_run=False)
+            run_pipeline(
+                con, config, dry_run=False,
+                ingest_workers=args.ingest_workers, bulk_upsert=args.bulk_upsert,
+                quarantine=args.quarantine, ingest_prefetch=args.ingest_prefetch,
+                archive=args.archive,
+            )
 
         elif args.dry_run:
-            run_pipeline(con, config, dry_run=True)
+            run_pipeline(
+                con, config, dry_run=True,
+                ingest_workers=args.ingest_workers, bulk_upsert=args.bulk_upsert,
+                quarantine=args.quarantine, ingest_prefetch=args.ingest_prefetch,
+                archive=args.archive,
+            )
+
+        elif args.watch:
+            try:
+                watch_pipeline(
+                    con, config, interval=args.watch_interval,
+                    ingest_workers=args.ingest_workers, bulk_upsert=args.bulk_upsert,
+                    quarantine=args.quarantine, ingest_prefetch=args.ingest_prefetch,
+                    archive=args.archive,
+                )
+            except KeyboardInterrupt:
+                logger.info("Watcher stopped.")
 
         elif args.status:
             print_status(con, config)
@@ -337,6 +498,9 @@ def main():
         elif args.rollback is not None:
             rollback_batches(con, config, args.rollback)
 
+        elif args.cluster:
+            cluster_facts(con, config)
+
     finally:
         con.close()
 
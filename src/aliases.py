@@ -5,40 +5,30 @@ This module builds reverse lookups and applies them to DataFrames.
 """
 import polars as pl
 from src.config import AppConfig
+from src.registry import compile_alias_map
 
 
 def build_alias_map(config: AppConfig, table_name: str) -> dict[str, str]:
     """Build {lowercased_alias -> canonical_name} for a given table.
 
     Applies common aliases first, then table-specific aliases (override on conflict).
+    Per-file code should use the precompiled config.registry instead.
     """
-    result: dict[str, str] = {}
+    return compile_alias_map(config.aliases, table_name)
 
-    # Apply common aliases
-    common = config.aliases.get("common", {})
-    for canonical, variants in common.items():
-        for v in variants:
-            result[v.lower().strip()] = canonical
 
-    # Apply table-specific aliases (override common if conflict)
-    table_aliases = config.aliases.get(table_name, {})
-    for canonical, variants in table_aliases.items():
-        for v in variants:
-            result[v.lower().strip()] = canonical
+def apply_aliases(
+    df: pl.DataFrame | pl.LazyFrame, table_name: str, config: AppConfig
+) -> pl.DataFrame | pl.LazyFrame:
+    """Rename DataFrame (or LazyFrame) columns using alias mapping from config.
 
-    return result
-
-
-def apply_aliases(df: pl.DataFrame, table_name: str, config: AppConfig) -> pl.DataFrame:
-    """Rename DataFrame columns using alias mapping from config.
-
-    Returns a new DataFrame with canonical column names.
+    Returns a new frame of the same kind with canonical column names.
     Unknown columns are kept as-is (they will be filtered later by schema validation).
     """
-    alias_map = build_alias_map(config, table_name)
+    alias_map = config.registry.table(table_name).alias_map
     rename_map: dict[str, str] = {}
 
-    for col in df.columns:
+    for col in df.collect_schema().names():
         canonical = alias_map.get(col.lower().strip())
         if canonical and canonical != col:
             rename_map[col] = canonical
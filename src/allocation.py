@@ -3,13 +3,21 @@
 Conservation: SUM(allocated) == invoice_total for every invoice.
 Determinism: same inputs -> same outputs (stable ordering, Hare-Niemeyer rounding).
 """
+import logging
 import math
+from collections import Counter
+from collections.abc import Mapping
+from dataclasses import dataclass
 from decimal import Decimal, ROUND_HALF_UP
+from types import MappingProxyType
 
 import duckdb
 import polars as pl
 
 from src.config import AppConfig, SUPPORTED_ALLOCATION_BASES
+from src.periods import period_bounds, period_predicate
+
+logger = logging.getLogger(__name__)
 
 
 def largest_fraction_round(raw_amounts: list[float], total: float, decimals: int) -> list[float]:
@@ -41,6 +49,96 @@ def largest_fraction_round(raw_amounts: list[float], total: float, decimals: int
     return [v / factor for v in floored]
 
 
+def _constant(value: float, n: int) -> pl.Series:
+    """A materialized constant column.
+
+    Polars evaluates `x / scalar` as `x * (1 / scalar)`, which is not
+    bit-identical to Python's `x / scalar`; dividing by a real column is.
+    """
+    return pl.Series([value] * n, dtype=pl.Float64)
+
+
+def largest_fraction_round_grouped(
+    df: pl.DataFrame,
+    raw_col: str,
+    total_col: str,
+    by: str | list[str],
+    decimals: int,
+    alias: str = "allocated_amount",
+) -> pl.DataFrame:
+    """Vectorized largest_fraction_round over every `by` partition of df.
+
+    Each partition gets exactly what largest_fraction_round(raw amounts in
+    row order, total, decimals) returns: floors plus the shortfall handed to
+    the largest remainders. The ordinal rank of -remainder within the
+    partition is the stable argsort on (-remainder, index), so ties still go
+    to the earlier row. total_col must be constant within a partition.
+    Adds `alias`; rows keep their order.
+    """
+    factor = 10 ** decimals
+    scaled = pl.col(raw_col) * factor
+    floored = scaled.floor()
+    shortfall = (
+        (pl.col(total_col) * factor).round(0, mode="half_to_even").cast(pl.Int64)
+        - floored.cast(pl.Int64).sum().over(by)
+    )
+    units = floored.cast(pl.Int64) + (
+        (-(scaled - floored)).rank("ordinal").over(by) <= shortfall
+    ).cast(pl.Int64)
+    return df.with_columns((units / _constant(float(factor), df.height)).alias(alias))
+
+
+@dataclass(frozen=True)
+class BasisStats:
+    """Summary of one basis column over a target scope."""
+    rows: int
+    null_count: int
+    nonzero_count: int      # non-null values != 0
+    total: float            # sum in target order, nulls as 0
+
+
+def _basis_stat_exprs(columns) -> tuple[list[str], list[pl.Expr]]:
+    """Supported basis columns among `columns`, and the expressions summarizing them.
+
+    The total is a left-to-right running sum, which equals Python's sum()
+    bit for bit (Polars' sum() uses a different summation order).
+    """
+    bases = sorted(SUPPORTED_ALLOCATION_BASES & set(columns))
+    exprs = [pl.len().alias("_rows")]
+    for b in bases:
+        exprs += [
+            pl.col(b).null_count().alias(f"_nulls:{b}"),
+            (pl.col(b) != 0).sum().alias(f"_nonzero:{b}"),
+            pl.col(b).fill_null(0).cum_sum().last().alias(f"_total:{b}"),
+        ]
+    return bases, exprs
+
+
+def _stats_of_row(row: dict, bases: list[str]) -> dict[str, BasisStats]:
+    return {
+        b: BasisStats(row["_rows"], row[f"_nulls:{b}"], row[f"_nonzero:{b}"], row[f"_total:{b}"])
+        for b in bases
+    }
+
+
+def frame_basis_stats(targets: pl.DataFrame) -> dict[str, BasisStats]:
+    """BasisStats of every supported basis column of a target frame."""
+    bases, exprs = _basis_stat_exprs(targets.columns)
+    return _stats_of_row(targets.select(exprs).row(0, named=True), bases)
+
+
+def choose_basis(priority: list[str], stats: dict[str, BasisStats]) -> str | None:
+    """First basis in priority order that is usable for a scope with these stats.
+
+    A basis is usable if the scope has it and at least one target has a
+    non-null, non-zero value for it.
+    """
+    for basis in priority:
+        if basis in stats and stats[basis].nonzero_count > 0:
+            return basis
+    return None
+
+
 def resolve_basis(
     charge_type: str,
     targets: pl.DataFrame,
@@ -49,21 +147,58 @@ def resolve_basis(
     """Resolve the first usable allocation basis for a charge type.
 
     Checks charge_type_overrides first, then default_basis_by_stage.
-    A basis is usable if all targets have non-null, non-zero values for it.
+    A basis is usable if at least one target has a non-null, non-zero value.
     """
-    basis_priority = config.get_allocation_basis_priority(charge_type)
-
-    for basis in basis_priority:
-        if basis in targets.columns:
-            col = targets[basis]
-            # Check if all values are non-null and non-zero
-            if col.null_count() == 0 and (col != 0).all():
-                return basis
-            # Allow if at least some are non-null and non-zero
-            if col.null_count() < col.len() and col.drop_nulls().filter(col.drop_nulls() != 0).len() > 0:
-                return basis
+    return choose_basis(config.get_allocation_basis_priority(charge_type), frame_basis_stats(targets))
 
-    return None
+
+class BasisResolver:
+    """Memoized basis decisions per (charge_type, scope), with usage counts.
+
+    The decision for a scope is made once from its BasisStats; every further
+    charge line of that charge type and scope is a dict lookup. report()
+    shows which basis each charge type ended up on and how often that was a
+    fallback (not the first basis in its priority list).
+    """
+
+    def __init__(self, config: AppConfig):
+        self.config = config
+        self._decisions: dict[tuple, str | None] = {}
+        self._lines: Counter = Counter()
+
+    def resolve(self, charge_type: str, scope, stats: dict[str, BasisStats]) -> str | None:
+        """Basis for one charge line of charge_type allocated over `scope`."""
+        key = (charge_type, scope)
+        if key not in self._decisions:
+            self._decisions[key] = choose_basis(self.config.get_allocation_basis_priority(charge_type), stats)
+        basis = self._decisions[key]
+        self._lines[charge_type, basis] += 1
+        return basis
+
+    def report(self) -> pl.DataFrame:
+        """One row per (charge_type, allocation_basis) chosen: charge lines, scopes, fallback rank.
+
+        priority_rank is the basis' 1-based position in the charge type's
+        priority list (0 for a fallback target's basis outside that list);
+        allocation_basis is None for lines with no usable basis.
+        """
+        scopes = Counter((ct, basis) for (ct, _), basis in self._decisions.items())
+        rows = []
+        for (charge_type, basis), lines in sorted(self._lines.items(), key=lambda kv: (kv[0][0], kv[0][1] or "")):
+            priority = self.config.get_allocation_basis_priority(charge_type)
+            rank = priority.index(basis) + 1 if basis in priority else 0
+            rows.append({
+                "charge_type": charge_type,
+                "allocation_basis": basis,
+                "priority_rank": rank if basis is not None else None,
+                "is_fallback": basis is None or rank != 1,
+                "charge_lines": lines,
+                "scopes": scopes[charge_type, basis],
+            })
+        return pl.DataFrame(rows, schema={
+            "charge_type": pl.Utf8, "allocation_basis": pl.Utf8, "priority_rank": pl.Int64,
+            "is_fallback": pl.Boolean, "charge_lines": pl.Int64, "scopes": pl.Int64,
+        })
 
 
 def allocate_charge(
@@ -85,34 +220,39 @@ def allocate_charge(
     if targets.height == 0:
         return pl.DataFrame()
 
+    # Sort targets deterministically
+    sort_keys = config.get_sort_keys()
+    available_sort_keys = [k for k in sort_keys if k in targets.columns]
+    if available_sort_keys:
+        targets = targets.sort(available_sort_keys, maintain_order=True)
+
     # Resolve allocation basis
-    basis = resolve_basis(charge_type, targets, config)
+    stats = frame_basis_stats(targets)
+    basis = choose_basis(config.get_allocation_basis_priority(charge_type), stats)
     if basis is None:
         raise ValueError(
             f"Cannot resolve allocation basis for charge_type='{charge_type}'. "
             f"No valid basis found in targets. Tried: {config.get_allocation_basis_priority(charge_type)}"
         )
 
-    # Sort targets deterministically
-    sort_keys = config.get_sort_keys()
-    available_sort_keys = [k for k in sort_keys if k in targets.columns]
-    if available_sort_keys:
-        targets = targets.sort(available_sort_keys)
-
     # Compute proportions
     basis_values = targets[basis].fill_null(0).to_list()
-    total_basis = sum(basis_values)
+    total_basis = stats[basis].total
+    n = targets.height
 
     if total_basis == 0:
         # Equal distribution if all basis values are zero
-        raw_amounts = [amount / targets.height] * targets.height
+        raw = _constant(amount / n, n)
     else:
-        raw_amounts = [(v / total_basis) * amount for v in basis_values]
+        raw = (pl.Series(basis_values, dtype=pl.Float64) / _constant(float(total_basis), n)) * amount
 
     # Apply Hare-Niemeyer rounding
     rounding_cfg = config.allocation.get("rounding", {})
     decimals = rounding_cfg.get("decimals", 0)
-    allocated = largest_fraction_round(raw_amounts, amount, decimals)
+    allocated = largest_fraction_round_grouped(
+        pl.DataFrame({"_raw": raw, "_total": _constant(amount, n), "_group": pl.Series([0] * n)}),
+        "_raw", "_total", "_group", decimals,
+    )["allocated_amount"]
 
     # Get charge policy
     ct_policy = config.get_charge_type(charge_type)
@@ -127,8 +267,8 @@ def allocate_charge(
         pl.lit(invoice_line_no).alias("invoice_line_no"),
         pl.lit(basis).alias("allocation_basis"),
         pl.Series("basis_value", basis_values, dtype=pl.Float64),
-        pl.Series("allocated_amount", allocated, dtype=pl.Float64),
-        pl.Series("allocated_amount_krw", [a * rate_to_krw for a in allocated], dtype=pl.Float64),
+        allocated,
+        (allocated * rate_to_krw).alias("allocated_amount_krw"),
         pl.lit(currency).alias("currency"),
         pl.lit(ct_policy.capitalizable_flag).alias("capitalizable_flag"),
     ])
@@ -136,11 +276,339 @@ def allocate_charge(
     return result
 
 
+# Columns of mart.mart_charge_allocated, in table order
+ALLOCATED_COLUMNS = [
+    "period", "charge_type", "charge_domain", "cost_stage",
+    "invoice_no", "invoice_line_no", "item_id", "warehouse_id",
+    "channel_store_id", "lot_id", "allocation_basis", "basis_value",
+    "allocated_amount", "allocated_amount_krw", "currency", "capitalizable_flag",
+]
+
+
+def add_basis_columns(targets: pl.DataFrame) -> pl.DataFrame:
+    """Derive the allocation basis columns a target frame lacks."""
+    if "qty" not in targets.columns and "qty_shipped" in targets.columns:
+        targets = targets.with_columns(pl.col("qty_shipped").alias("qty"))
+    if "order_count" not in targets.columns:
+        targets = targets.with_columns(pl.lit(1).alias("order_count"))
+    if "line_count" not in targets.columns:
+        targets = targets.with_columns(pl.lit(1).alias("line_count"))
+    if "value" not in targets.columns and "qty" in targets.columns:
+        targets = targets.with_columns(pl.col("qty").alias("value"))
+    if "revenue" not in targets.columns:
+        targets = targets.with_columns(pl.lit(1.0).alias("revenue"))
+    return targets
+
+
+def shipment_targets(
+    con: duckdb.DuckDBPyConnection, config: AppConfig, periods: list[str] | None = None
+) -> pl.DataFrame:
+    """Shipments aggregated to (period, warehouse, channel store, item, lot) targets.
+
+    Only the given ship periods are read (all when None). Basis columns are
+    precomputed per target: qty/value = units shipped, weight and volume_cbm
+    summed (NULL when every line lacks them), order_count/line_count/revenue
+    = shipment lines (each line counted as one order, as before aggregation). A missing table yields no targets; other SQL errors
+    propagate instead of sending every charge to UNALLOCATED.
+    """
+    where, params = period_predicate("fact_shipment", periods, config)
+    try:
+        return con.execute(f"""
+            SELECT strftime(ship_date, '%Y-%m') AS period, warehouse_id, channel_store_id, item_id, lot_id,
+                   SUM(qty_shipped) AS qty,
+                   SUM(weight) AS weight,
+                   SUM(volume_cbm) AS volume_cbm,
+                   COUNT(*) AS order_count,
+                   COUNT(*) AS line_count,
+                   SUM(qty_shipped) AS value,
+                   CAST(COUNT(*) AS DOUBLE) AS revenue
+            FROM core.fact_shipment
+            WHERE {where}
+            GROUP BY ALL
+            ORDER BY period, warehouse_id, channel_store_id, item_id, lot_id
+        """, params).pl()
+    except duckdb.CatalogException as e:
+        logger.warning(f"No shipment targets: {e}")
+        return pl.DataFrame()
+
+
+# Bases only inventory (storage) targets carry
+STORAGE_BASES = frozenset({"onhand_cbm_days", "onhand_qty_days"})
+
+
+def uses_storage_targets(charge_type: str, config: AppConfig) -> bool:
+    """True if the charge type allocates over inventory (its basis priority has a storage basis)."""
+    return any(b in STORAGE_BASES for b in config.get_allocation_basis_priority(charge_type))
+
+
+def storage_targets(
+    con: duckdb.DuckDBPyConnection, config: AppConfig, periods: list[str]
+) -> pl.DataFrame:
+    """Inventory holding per (period, warehouse, item, lot) for storage charges.
+
+    Each snapshot's onhand_qty is held from its snapshot_date until the next
+    snapshot of the same (warehouse, item, lot), or until the end of its
+    month for the latest one. Those intervals are clipped to each period and
+    integrated in one query: onhand_qty_days = SUM(qty * days held),
+    onhand_cbm_days = the same weighted by dim_item.volume_cbm (NULL for
+    items without a volume). Inventory has no channel store, so each target
+    is split across the stores that shipped the item from that warehouse in
+    the period, by their share of units shipped; the P&L contribution mart
+    joins variable cost on channel_store_id. Items nothing shipped keep a
+    NULL channel_store_id. Like shipment_targets, only a missing table is
+    treated as "no targets".
+    """
+    if not periods:
+        return pl.DataFrame()
+    starts = [period_bounds(p)[0] for p in sorted(set(periods))]
+    where, params = period_predicate("fact_shipment", periods, config)
+    try:
+        return con.execute(f"""
+            WITH spans AS (
+                SELECT warehouse_id, item_id, lot_id, onhand_qty,
+                       snapshot_date AS held_from,
+                       COALESCE(
+                           LEAD(snapshot_date) OVER (
+                               PARTITION BY warehouse_id, item_id, lot_id ORDER BY snapshot_date
+                           ),
+                           CAST(date_trunc('month', snapshot_date) + INTERVAL 1 MONTH AS DATE)
+                       ) AS held_to
+                FROM core.fact_inventory_snapshot
+            ),
+            periods AS (
+                SELECT period_start, CAST(period_start + INTERVAL 1 MONTH AS DATE) AS period_end
+                FROM (SELECT unnest(?::DATE[]) AS period_start)
+            ),
+            held AS (
+                SELECT strftime(p.period_start, '%Y-%m') AS period, s.warehouse_id, s.item_id, s.lot_id,
+                       s.onhand_qty * (LEAST(s.held_to, p.period_end) - GREATEST(s.held_from, p.period_start))
+                           AS qty_days
+                FROM spans s
+                JOIN periods p ON s.held_from < p.period_end AND s.held_to > p.period_start
+            ),
+            store_shares AS (
+                SELECT strftime(ship_date, '%Y-%m') AS period, warehouse_id, item_id, channel_store_id,
+                       SUM(qty_shipped) / SUM(SUM(qty_shipped)) OVER (
+                           PARTITION BY strftime(ship_date, '%Y-%m'), warehouse_id, item_id
+                       ) AS store_share
+                FROM core.fact_shipment
+                WHERE qty_shipped > 0 AND channel_store_id IS NOT NULL AND {where}
+                GROUP BY 1, 2, 3, 4
+            )
+            SELECT h.period, h.warehouse_id, ss.channel_store_id, h.item_id, h.lot_id,
+                   SUM(h.qty_days * d.volume_cbm * COALESCE(ss.store_share, 1)) AS onhand_cbm_days,
+                   SUM(h.qty_days * COALESCE(ss.store_share, 1)) AS onhand_qty_days
+            FROM held h
+            LEFT JOIN core.dim_item d ON d.item_id = h.item_id
+            LEFT JOIN store_shares ss
+                ON ss.period = h.period AND ss.warehouse_id = h.warehouse_id AND ss.item_id = h.item_id
+            GROUP BY ALL
+            ORDER BY h.period, h.warehouse_id, h.item_id, h.lot_id, ss.channel_store_id
+        """, [starts, *params]).pl()
+    except duckdb.CatalogException as e:
+        logger.warning(f"No storage targets: {e}")
+        return pl.DataFrame()
+
+
+@dataclass(frozen=True)
+class TargetIndex:
+    """Allocation targets partitioned once per run by charge scope.
+
+    scopes maps (period, warehouse_id, channel_store_id) to that scope's
+    targets, sorted by the determinism sort keys. None in a key means "any":
+    (period, wh, None) holds every channel store of the warehouse, and
+    (period, None, None) the whole period. stats holds each scope's
+    BasisStats per basis column, computed once when the index is built.
+    """
+    scopes: Mapping[tuple, pl.DataFrame]
+    stats: Mapping[tuple, Mapping[str, BasisStats]]
+
+    def lookup(self, period: str, warehouse_id: str | None, channel_store_id: str | None) -> tuple | None:
+        """Most specific scope with targets for a charge line.
+
+        Tries (period, warehouse, store), (period, warehouse), (period, store),
+        then the whole period. None when the period has no targets at all.
+        """
+        wh, cs = warehouse_id or None, channel_store_id or None
+        for key in ((period, wh, cs), (period, wh, None), (period, None, cs), (period, None, None)):
+            if key in self.scopes:
+                return key
+        return None
+
+
+# Scope columns indexed besides period, most specific first
+_SCOPE_LEVELS = (("warehouse_id", "channel_store_id"), ("warehouse_id",), ("channel_store_id",), ())
+
+
+def build_target_index(targets: pl.DataFrame, config: AppConfig) -> TargetIndex:
+    """Partition a target frame (with a period column) into a TargetIndex."""
+    if targets.height == 0:
+        return TargetIndex(MappingProxyType({}), MappingProxyType({}))
+    sort_keys = [k for k in config.get_sort_keys() if k in targets.columns]
+    if sort_keys:
+        targets = targets.sort(sort_keys, maintain_order=True)
+    bases, stat_exprs = _basis_stat_exprs(targets.columns)
+
+    def scope_key(cols: list[str], values: tuple) -> tuple | None:
+        named = dict(zip(cols, values))
+        # Targets without a warehouse/store only belong to the coarser scopes
+        if any(named[c] is None for c in cols[1:]):
+            return None
+        return named["period"], named.get("warehouse_id"), named.get("channel_store_id")
+
+    scopes: dict[tuple, pl.DataFrame] = {}
+    stats: dict[tuple, dict[str, BasisStats]] = {}
+    for level in _SCOPE_LEVELS:
+        cols = ["period", *level]
+        for values, frame in targets.partition_by(cols, as_dict=True, maintain_order=True).items():
+            key = scope_key(cols, values)
+            if key is not None:
+                scopes[key] = frame
+        # Group aggregation sees each group's rows in frame order, like the partitions
+        for row in targets.group_by(cols, maintain_order=True).agg(stat_exprs).iter_rows(named=True):
+            key = scope_key(cols, tuple(row[c] for c in cols))
+            if key is not None:
+                stats[key] = MappingProxyType(_stats_of_row(row, bases))
+    return TargetIndex(MappingProxyType(scopes), MappingProxyType(stats))
+
+
+def _fallback_target(warehouse_id: str, channel_store_id: str) -> pl.DataFrame:
+    """Single-row target used when a charge's period has no targets."""
+    return add_basis_columns(pl.DataFrame({
+        "item_id": ["UNALLOCATED"],
+        "warehouse_id": [warehouse_id],
+        "channel_store_id": [channel_store_id],
+        "lot_id": ["__NONE__"],
+        "qty": [1.0],
+        "onhand_cbm_days": [1.0],
+        "onhand_qty_days": [1.0],
+    }))
+
+
+def _charge_scopes(charges: pl.DataFrame, index: TargetIndex) -> tuple[list, dict, dict]:
+    """Target scope key of every charge line, and the target frame and BasisStats per scope.
+
+    Scopes come from index.lookup. A line whose period has no targets gets
+    the UNALLOCATED target of its (warehouse, channel store).
+    """
+    def column(name: str) -> list:
+        return charges[name].to_list() if name in charges.columns else [None] * charges.height
+
+    keys: list[tuple] = []
+    frames: dict[tuple, pl.DataFrame] = {}
+    stats: dict[tuple, Mapping[str, BasisStats]] = {}
+    for period, wh, cs in zip(column("period"), column("warehouse_id"), column("channel_store_id")):
+        key = index.lookup(period, wh, cs)
+        if key is None:
+            key = (period, wh or "UNKNOWN", cs or "UNKNOWN")
+            if key not in frames:
+                frames[key] = _fallback_target(key[1], key[2])
+                stats[key] = frame_basis_stats(frames[key])
+        elif key not in frames:
+            frames[key] = index.scopes[key]
+            stats[key] = index.stats[key]
+        keys.append(key)
+    return keys, frames, stats
+
+
+def allocate_charges(
+    charges: pl.DataFrame,
+    index: TargetIndex,
+    config: AppConfig,
+    fx_map: dict | None = None,
+    resolver: BasisResolver | None = None,
+) -> pl.DataFrame:
+    """Allocate every charge line against its target scope in one vectorized pass.
+
+    Produces, row for row and bit for bit, what calling allocate_charge on
+    each charge line with its scope (see _charge_scopes) would: basis shares
+    and Hare-Niemeyer rounding run as grouped window operations over the
+    joined (charge line x target) frame instead of a Python loop per line.
+    Bases are resolved through `resolver` (a fresh BasisResolver if None)
+    from the index's per-scope BasisStats. Lines without a usable basis are
+    left out, as allocate_charge raises for them.
+    """
+    fx_map = fx_map or {}
+    resolver = resolver or BasisResolver(config)
+    if charges.height == 0:
+        return pl.DataFrame()
+
+    keys, frames, stats = _charge_scopes(charges, index)
+    scope_ids = {key: i for i, key in enumerate(frames)}
+
+    meta = {"_scope": [], "allocation_basis": [], "_total": [], "_n": [], "_rate": [],
+            "charge_domain": [], "cost_stage": [], "capitalizable_flag": []}
+    for row, key in zip(charges.select("charge_type", "period", "currency").iter_rows(), keys):
+        charge_type, period, currency = row
+        basis = resolver.resolve(charge_type, key, stats[key])
+        ct_policy = config.get_charge_type(charge_type)
+        meta["_scope"].append(scope_ids[key])
+        meta["allocation_basis"].append(basis)
+        meta["_total"].append(float(stats[key][basis].total) if basis is not None else None)
+        meta["_n"].append(frames[key].height)
+        meta["_rate"].append(1.0 if currency == "KRW" else fx_map.get((period, currency), 1.0))
+        meta["charge_domain"].append(ct_policy.charge_domain)
+        meta["cost_stage"].append(ct_policy.cost_stage)
+        meta["capitalizable_flag"].append(ct_policy.capitalizable_flag)
+
+    lines = pl.concat([
+        charges.select(
+            "period", "charge_type", "invoice_no", "invoice_line_no", "amount", "currency",
+        ).with_row_index("_charge"),
+        pl.DataFrame(meta, schema_overrides={"_scope": pl.UInt32, "_total": pl.Float64, "_rate": pl.Float64}),
+    ], how="horizontal").filter(pl.col("allocation_basis").is_not_null())
+    if lines.height == 0:
+        return pl.DataFrame()
+
+    used = sorted(set(lines["allocation_basis"].to_list()))
+    in_use = set(lines["_scope"].to_list())
+    scoped = pl.concat([
+        frames[key].select(
+            "item_id", "warehouse_id", "channel_store_id", "lot_id",
+            *[pl.col(b).cast(pl.Float64) for b in used if b in frames[key].columns],
+        ).with_columns(
+            pl.lit(scope_ids[key], dtype=pl.UInt32).alias("_scope"),
+            pl.int_range(pl.len(), dtype=pl.UInt32).alias("_pos"),
+        )
+        for key in frames
+        if scope_ids[key] in in_use
+    ], how="diagonal_relaxed")
+
+    basis_value = pl.lit(None, dtype=pl.Float64)
+    for b in reversed(used):
+        basis_value = pl.when(pl.col("allocation_basis") == b).then(pl.col(b)).otherwise(basis_value)
+
+    decimals = config.allocation.get("rounding", {}).get("decimals", 0)
+
+    expanded = (
+        lines.join(scoped, on="_scope", how="inner")
+        .with_columns(basis_value.fill_null(0).alias("basis_value"))
+        .with_columns(
+            pl.when(pl.col("_total") == 0)
+            .then(pl.col("amount") / pl.col("_n"))
+            .otherwise((pl.col("basis_value") / pl.col("_total")) * pl.col("amount"))
+            .alias("_raw")
+        )
+    )
+    expanded = largest_fraction_round_grouped(
+        expanded.sort("_charge", "_pos"), "_raw", "amount", "_charge", decimals,
+    )
+
+    return (
+        expanded.with_columns(
+            (pl.col("allocated_amount") * pl.col("_rate")).alias("allocated_amount_krw"),
+        )
+        .select(ALLOCATED_COLUMNS)
+    )
+
+
 def allocate_all_charges(con: duckdb.DuckDBPyConnection, config: AppConfig) -> None:
     """Run full allocation for all charges. Write to mart.mart_charge_allocated."""
     # Read charges
     try:
-        charges_df = con.execute("SELECT * FROM core.fact_charge_actual").pl()
+        charges_df = con.execute(
+            "SELECT * FROM core.fact_charge_actual ORDER BY invoice_no, invoice_line_no, charge_type"
+        ).pl()
     except Exception:
         return
 
@@ -155,99 +623,37 @@ def allocate_all_charges(con: duckdb.DuckDBPyConnection, config: AppConfig) -> N
     except Exception:
         fx_map = {}
 
-    # Read potential targets (shipments as default allocation targets)
-    try:
-        ship_df = con.execute("""
-            SELECT shipment_id, ship_date, warehouse_id, item_id, lot_id,
-                   qty_shipped, weight, volume_cbm, channel_order_id, channel_store_id,
-                   source_system
-            FROM core.fact_shipment
-        """).pl()
-    except Exception:
-        ship_df = pl.DataFrame()
-
-    all_allocated = []
-
-    for row in charges_df.iter_rows(named=True):
-        charge_type = row["charge_type"]
-        period = row["period"]
-        amount = row["amount"]
-        currency = row["currency"]
-        invoice_no = row["invoice_no"]
-        invoice_line_no = row["invoice_line_no"]
-        warehouse_id = row.get("warehouse_id")
-        channel_store_id = row.get("channel_store_id")
-
-        # Get FX rate
-        rate_to_krw = fx_map.get((period, currency), 1.0)
-        if currency == "KRW":
-            rate_to_krw = 1.0
-
-        # Build target set
-        targets = ship_df.clone() if ship_df.height > 0 else pl.DataFrame()
-
-        if targets.height == 0:
-            # If no shipment data, create a single-row fallback target
-            targets = pl.DataFrame({
-                "item_id": ["UNALLOCATED"],
-                "warehouse_id": [warehouse_id or "UNKNOWN"],
-                "channel_store_id": [channel_store_id or "UNKNOWN"],
-                "lot_id": ["__NONE__"],
-                "qty": [1.0],
-            })
-
-        # Filter targets by scope if reference info available
-        if warehouse_id and "warehouse_id" in targets.columns:
-            scoped = targets.filter(pl.col("warehouse_id") == warehouse_id)
-            if scoped.height > 0:
-                targets = scoped
-
-        # Add derived basis columns if missing
-        if "qty" not in targets.columns and "qty_shipped" in targets.columns:
-            targets = targets.with_columns(pl.col("qty_shipped").alias("qty"))
-        if "order_count" not in targets.columns:
-            targets = targets.with_columns(pl.lit(1).alias("order_count"))
-        if "line_count" not in targets.columns:
-            targets = targets.with_columns(pl.lit(1).alias("line_count"))
-        if "value" not in targets.columns and "qty" in targets.columns:
-            targets = targets.with_columns(pl.col("qty").alias("value"))
-        if "revenue" not in targets.columns:
-            targets = targets.with_columns(pl.lit(1.0).alias("revenue"))
-
-        try:
-            allocated_df = allocate_charge(
-                invoice_no=invoice_no,
-                invoice_line_no=invoice_line_no,
-                charge_type=charge_type,
-                amount=amount,
-                currency=currency,
-                period=period,
-                targets=targets,
-                config=config,
-                rate_to_krw=rate_to_krw,
+    # Storage charges allocate over inventory holding, everything else over shipments
+    storage_types = [ct for ct in charges_df["charge_type"].unique().to_list() if uses_storage_targets(ct, config)]
+    is_storage = pl.col("charge_type").is_in(storage_types)
+    resolver = BasisResolver(config)
+    parts = []
+    for charges, build_targets in (
+        (charges_df.filter(~is_storage), shipment_targets),
+        (charges_df.filter(is_storage), storage_targets),
+    ):
+        if charges.height == 0:
+            continue
+        periods = sorted(set(charges["period"].drop_nulls().to_list()))
+        index = build_target_index(build_targets(con, config, periods), config)
+        part = allocate_charges(charges, index, config, fx_map, resolver)
+        if part.height > 0:
+            parts.append(part)
+    allocated = pl.concat(parts, how="vertical_relaxed") if parts else pl.DataFrame()
+    for r in resolver.report().filter(pl.col("is_fallback")).iter_rows(named=True):
+        if r["allocation_basis"] is None:
+            logger.warning(
+                f"{r['charge_type']}: no usable allocation basis, {r['charge_lines']} charge lines not allocated"
+            )
+        else:
+            logger.info(
+                f"{r['charge_type']}: fell back to basis '{r['allocation_basis']}' "
+                f"(priority {r['priority_rank']}) for {r['charge_lines']} charge lines in {r['scopes']} scopes"
             )
-            if allocated_df.height > 0:
-                # Select only the columns needed for mart_charge_allocated
-                keep_cols = [
-                    "period", "charge_type", "charge_domain", "cost_stage",
-                    "invoice_no", "invoice_line_no", "item_id", "warehouse_id",
-                    "channel_store_id", "lot_id", "allocation_basis", "basis_value",
-                    "allocated_amount", "allocated_amount_krw", "currency", "capitalizable_flag",
-                ]
-                for c in keep_cols:
-                    if c not in allocated_df.columns:
-                        allocated_df = allocated_df.with_columns(pl.lit(None).cast(pl.Utf8).alias(c))
-                allocated_df = allocated_df.select(keep_cols)
-                all_allocated.append(allocated_df)
-        except ValueError as e:
-            # Log but continue
-            pass
 
     # Write to mart
     con.execute("DELETE FROM mart.mart_charge_allocated")
-    if all_allocated:
-        combined = pl.concat(all_allocated, how="diagonal_relaxed")
-        arrow = combined.to_arrow()
-        con.register("_alloc_staging", arrow)
+    if allocated.height > 0:
+        con.register("_alloc_staging", allocated.to_arrow())
         con.execute("INSERT INTO mart.mart_charge_allocated SELECT * FROM _alloc_staging")
         con.unregister("_alloc_staging")
@@ -7,6 +7,8 @@ from pathlib import Path
 from dataclasses import dataclass, field
 from typing import Any
 
+from src.registry import SchemaRegistry, build_registry
+
 CONFIG_DIR = Path("config")
 
 SUPPORTED_ALLOCATION_BASES = frozenset({
@@ -51,7 +53,9 @@ class AppConfig:
         self.coverage_policy: dict = self._load_yaml(config_dir / "policies" / "coverage_policy.yaml")
         self.allocation: dict = self._load_yaml(config_dir / "policies" / "allocation.yaml")
         self.tax_policy: dict = self._load_yaml(config_dir / "policies" / "tax_policy.yaml")
+        self.ingest: dict = self._load_yaml(config_dir / "ingest.yaml")
         self._cross_validate()
+        self.registry: SchemaRegistry = build_registry(self.schema, self.aliases)
 
     @staticmethod
     def _load_yaml(path: Path) -> dict:
@@ -3,8 +3,14 @@
 All CREATE TABLE / CREATE SCHEMA statements live here.
 No other module may define DDL.
 """
-import duckdb
+from functools import lru_cache
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+import duckdb
+
+if TYPE_CHECKING:
+    from src.config import AppConfig
 
 DB_PATH = Path("data/scm.duckdb")
 
@@ -43,7 +49,13 @@ RAW_TABLES = {
             row_count BIGINT DEFAULT 0,
             status VARCHAR NOT NULL DEFAULT 'pending',
             error_msg VARCHAR,
-            processed_at TIMESTAMP DEFAULT current_timestamp
+            processed_at TIMESTAMP DEFAULT current_timestamp,
+            archive_path VARCHAR,
+            rows_inserted BIGINT,
+            rows_updated BIGINT,
+            rows_unchanged BIGINT,
+            period_min VARCHAR,
+            period_max VARCHAR
         )
     """,
     "raw.system_dq_report": """
@@ -58,6 +70,33 @@ RAW_TABLES = {
             checked_at TIMESTAMP DEFAULT current_timestamp
         )
     """,
+    "raw.system_loaded_file": """
+        CREATE TABLE IF NOT EXISTS raw.system_loaded_file (
+            file_hash VARCHAR PRIMARY KEY,
+            batch_id BIGINT NOT NULL,
+            file_name VARCHAR NOT NULL,
+            loaded_at TIMESTAMP DEFAULT current_timestamp
+        )
+    """,
+    "raw.system_file_hash_cache": """
+        CREATE TABLE IF NOT EXISTS raw.system_file_hash_cache (
+            file_path VARCHAR PRIMARY KEY,
+            file_size BIGINT NOT NULL,
+            mtime_ns BIGINT NOT NULL,
+            file_hash VARCHAR NOT NULL,
+            hashed_at TIMESTAMP DEFAULT current_timestamp
+        )
+    """,
+    "raw.schema_migrations": """
+        CREATE TABLE IF NOT EXISTS raw.schema_migrations (
+            migration_id VARCHAR PRIMARY KEY,
+            table_name VARCHAR NOT NULL,
+            column_name VARCHAR NOT NULL,
+            column_type VARCHAR NOT NULL,
+            source VARCHAR NOT NULL,
+            applied_at TIMESTAMP DEFAULT current_timestamp
+        )
+    """,
     "raw.system_batch_lock": """
         CREATE TABLE IF NOT EXISTS raw.system_batch_lock (
             lock_id INTEGER PRIMARY KEY DEFAULT 1,
@@ -165,6 +204,7 @@ CORE_FACT_TABLES = {
             source_file_hash VARCHAR NOT NULL,
             source_pk VARCHAR,
             loaded_at TIMESTAMP DEFAULT current_timestamp,
+            row_hash UBIGINT,
             PRIMARY KEY (channel_order_id, line_no)
         )
     """,
@@ -185,6 +225,7 @@ CORE_FACT_TABLES = {
             source_file_hash VARCHAR NOT NULL,
             source_pk VARCHAR,
             loaded_at TIMESTAMP DEFAULT current_timestamp,
+            row_hash UBIGINT,
             PRIMARY KEY (shipment_id, item_id, lot_id)
         )
     """,
@@ -204,6 +245,7 @@ CORE_FACT_TABLES = {
             source_file_hash VARCHAR NOT NULL,
             source_pk VARCHAR,
             loaded_at TIMESTAMP DEFAULT current_timestamp,
+            row_hash UBIGINT,
             PRIMARY KEY (return_id, item_id, lot_id)
         )
     """,
@@ -222,6 +264,7 @@ CORE_FACT_TABLES = {
             source_file_hash VARCHAR NOT NULL,
             source_pk VARCHAR,
             loaded_at TIMESTAMP DEFAULT current_timestamp,
+            row_hash UBIGINT,
             PRIMARY KEY (snapshot_date, warehouse_id, item_id, lot_id)
         )
     """,
@@ -241,6 +284,7 @@ CORE_FACT_TABLES = {
             source_file_hash VARCHAR NOT NULL,
             source_pk VARCHAR,
             loaded_at TIMESTAMP DEFAULT current_timestamp,
+            row_hash UBIGINT,
             PRIMARY KEY (po_id, item_id)
         )
     """,
@@ -261,6 +305,7 @@ CORE_FACT_TABLES = {
             source_file_hash VARCHAR NOT NULL,
             source_pk VARCHAR,
             loaded_at TIMESTAMP DEFAULT current_timestamp,
+            row_hash UBIGINT,
             PRIMARY KEY (receipt_id, item_id)
         )
     """,
@@ -282,6 +327,7 @@ CORE_FACT_TABLES = {
             source_file_hash VARCHAR NOT NULL,
             source_pk VARCHAR,
             loaded_at TIMESTAMP DEFAULT current_timestamp,
+            row_hash UBIGINT,
             PRIMARY KEY (settlement_id, line_no)
         )
     """,
@@ -306,6 +352,7 @@ CORE_FACT_TABLES = {
             source_file_hash VARCHAR NOT NULL,
             source_pk VARCHAR,
             loaded_at TIMESTAMP DEFAULT current_timestamp,
+            row_hash UBIGINT,
             PRIMARY KEY (invoice_no, invoice_line_no, charge_type)
         )
     """,
@@ -319,6 +366,7 @@ CORE_FACT_TABLES = {
             source_file_hash VARCHAR DEFAULT '',
             source_pk VARCHAR,
             loaded_at TIMESTAMP DEFAULT current_timestamp,
+            row_hash UBIGINT,
             PRIMARY KEY (period, currency)
         )
     """,
@@ -333,11 +381,28 @@ CORE_FACT_TABLES = {
             source_file_hash VARCHAR DEFAULT '',
             source_pk VARCHAR,
             loaded_at TIMESTAMP DEFAULT current_timestamp,
+            row_hash UBIGINT,
             PRIMARY KEY (item_id, cost_component, effective_from)
         )
     """,
 }
 
+# ---------- QUARANTINE: rows split off each CORE fact in quarantine ingest mode ----------
+QUARANTINE_TABLES = {
+    f"raw.quarantine_{fact.split('.')[1]}": f"""
+        CREATE TABLE IF NOT EXISTS raw.quarantine_{fact.split('.')[1]} (
+            batch_id BIGINT NOT NULL,
+            file_name VARCHAR NOT NULL,
+            file_hash VARCHAR NOT NULL,
+            row_index BIGINT NOT NULL,
+            rule VARCHAR NOT NULL,
+            row_data VARCHAR NOT NULL,
+            quarantined_at TIMESTAMP DEFAULT current_timestamp
+        )
+    """
+    for fact in CORE_FACT_TABLES
+}
+
 # ================================================================
 # MART LAYER
 # ================================================================
@@ -770,44 +835,47 @@ OPS_TABLES = {
 }
 
 
+ALL_TABLES = {
+    **RAW_TABLES,
+    **CORE_DIM_TABLES,
+    **CORE_FACT_TABLES,
+    **QUARANTINE_TABLES,
+    **MART_TABLES,
+    **OPS_TABLES,
+}
+
+
 def get_connection(path: Path = DB_PATH) -> duckdb.DuckDBPyConnection:
     """Get a DuckDB connection, creating parent directories if needed."""
     path.parent.mkdir(parents=True, exist_ok=True)
     return duckdb.connect(str(path))
 
 
-def init_db(con: duckdb.DuckDBPyConnection) -> None:
-    """Create all schemas and tables idempotently."""
+def init_db(con: duckdb.DuckDBPyConnection, config: "AppConfig | None" = None) -> None:
+    """Create all schemas and tables idempotently, then apply additive migrations.
+
+    With a config, CORE facts also gain columns added to schema.yaml.
+    """
     for schema in SCHEMAS:
         con.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
 
-    all_tables = {}
-    all_tables.update(RAW_TABLES)
-    all_tables.update(CORE_DIM_TABLES)
-    all_tables.update(CORE_FACT_TABLES)
-    all_tables.update(MART_TABLES)
-    all_tables.update(OPS_TABLES)
-
-    for ddl in all_tables.values():
+    registry_is_new = not table_exists(con, "raw", "system_loaded_file")
+    for ddl in ALL_TABLES.values():
         con.execute(ddl)
 
-    # Migrate: add coverage_flag to existing mart tables that lack it.
-    # Uses information_schema to check column existence (fail-loud if table missing).
-    _COVERAGE_FLAG_TABLES = [
-        "mart.mart_pnl_cogs",
-        "mart.mart_pnl_gross_margin",
-        "mart.mart_pnl_contribution",
-        "mart.mart_pnl_operating_profit",
-    ]
-    for tbl in _COVERAGE_FLAG_TABLES:
-        schema_name, tbl_name = tbl.split(".")
-        exists = con.execute(
-            "SELECT COUNT(*) FROM information_schema.columns "
-            "WHERE table_schema = ? AND table_name = ? AND column_name = 'coverage_flag'",
-            [schema_name, tbl_name],
-        ).fetchone()[0]
-        if not exists:
-            con.execute(f"ALTER TABLE {tbl} ADD COLUMN coverage_flag VARCHAR")
+    # Tables created by older versions get the columns added since
+    migrate_schema(con, config)
+
+    # Backfill the loaded-file registry once, from file logs written before it
+    # existed; later dry runs log successes that must not enter it.
+    if registry_is_new:
+        con.execute("""
+            INSERT OR IGNORE INTO raw.system_loaded_file (file_hash, batch_id, file_name, loaded_at)
+            SELECT file_hash, MIN(batch_id), MIN(file_name), MIN(processed_at)
+            FROM raw.system_file_log
+            WHERE status = 'success'
+            GROUP BY file_hash
+        """)
 
     # Seed batch lock row if not exists
     con.execute("""
@@ -817,6 +885,110 @@ def init_db(con: duckdb.DuckDBPyConnection) -> None:
     """)
 
 
+@lru_cache(maxsize=1)
+def expected_columns() -> dict[tuple[str, str], tuple[tuple[str, str, str | None], ...]]:
+    """{(schema, table): ((column, type, default), ...)} as declared by the DDL above.
+
+    Obtained by running the DDL once in a scratch in-memory DuckDB, so the
+    DDL strings stay the only place where columns are declared.
+    """
+    scratch = duckdb.connect(":memory:")
+    try:
+        for schema in SCHEMAS:
+            scratch.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+        for ddl in ALL_TABLES.values():
+            scratch.execute(ddl)
+        rows = scratch.execute(
+            "SELECT table_schema, table_name, column_name, data_type, column_default "
+            "FROM information_schema.columns ORDER BY table_schema, table_name, ordinal_position"
+        ).fetchall()
+    finally:
+        scratch.close()
+
+    result: dict[tuple[str, str], list] = {}
+    for schema, table, column, data_type, default in rows:
+        result.setdefault((schema, table), []).append((column, data_type, default))
+    return {key: tuple(cols) for key, cols in result.items()}
+
+
+def plan_migrations(con: duckdb.DuckDBPyConnection, config: "AppConfig | None" = None) -> list[dict]:
+    """Columns missing from existing tables, from one information_schema query.
+
+    Sources: the DDL above for every table, plus schema.yaml columns of the
+    CORE facts when a config is given. Only additions are planned; type
+    changes and drops are left to a human.
+    """
+    wanted: dict[tuple[str, str], list[tuple[str, str, str | None, str]]] = {
+        key: [(c, t, d, "ddl") for c, t, d in cols] for key, cols in expected_columns().items()
+    }
+    if config is not None:
+        for table_name, table_schema in config.schema.items():
+            key = ("core", table_name)
+            if key not in wanted:
+                continue
+            declared = {c for c, _, _, _ in wanted[key]}
+            for col in (*table_schema.required_columns, *table_schema.optional_columns):
+                if col.name not in declared:
+                    wanted[key].append((col.name, col.type, None, "schema.yaml"))
+                    declared.add(col.name)
+
+    live: dict[tuple[str, str], set[str]] = {}
+    for schema, table, column in con.execute(
+        "SELECT table_schema, table_name, column_name FROM information_schema.columns"
+    ).fetchall():
+        live.setdefault((schema, table), set()).add(column)
+
+    plan = []
+    for (schema, table), cols in wanted.items():
+        present = live.get((schema, table))
+        if present is None:
+            continue
+        for column, data_type, default, source in cols:
+            if column not in present:
+                plan.append({
+                    "migration_id": f"add_column:{schema}.{table}.{column}",
+                    "table_name": f"{schema}.{table}",
+                    "column_name": column,
+                    "column_type": data_type,
+                    "default": default,
+                    "source": source,
+                })
+    return plan
+
+
+def migrate_schema(con: duckdb.DuckDBPyConnection, config: "AppConfig | None" = None) -> list[str]:
+    """Apply planned ADD COLUMN migrations in one transaction and record them.
+
+    Adding a nullable column is a catalog change in DuckDB: existing column
+    data is not rewritten, so this stays cheap on large databases. Declared
+    defaults are carried over; NOT NULL constraints are not (existing rows).
+    Returns the applied migration ids.
+    """
+    con.execute(RAW_TABLES["raw.schema_migrations"])
+    plan = plan_migrations(con, config)
+    if not plan:
+        return []
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        for m in plan:
+            default = f" DEFAULT {m['default']}" if m["default"] is not None else ""
+            con.execute(
+                f"ALTER TABLE {m['table_name']} ADD COLUMN {m['column_name']} {m['column_type']}{default}"
+            )
+        con.executemany(
+            "INSERT OR IGNORE INTO raw.schema_migrations (migration_id, table_name, column_name, column_type, source) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [[m["migration_id"], m["table_name"], m["column_name"], m["column_type"], m["source"]] for m in plan],
+        )
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+    return [m["migration_id"] for m in plan]
+
+
 def table_exists(con: duckdb.DuckDBPyConnection, schema: str, table: str) -> bool:
     """Check if a table exists in the given schema."""
     result = con.execute(
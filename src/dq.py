@@ -49,9 +49,8 @@ def check_required_columns(df: pl.DataFrame, table_name: str, config: AppConfig)
 def check_null_business_keys(df: pl.DataFrame, table_name: str, config: AppConfig) -> list[DQResult]:
     """Check that business key columns have no NULLs."""
     results = []
-    schema = config.get_schema(table_name)
 
-    for bk_col in schema.business_key:
+    for bk_col in config.registry.table(table_name).business_key:
         if bk_col not in df.columns:
             continue
 
@@ -76,8 +75,7 @@ def check_null_business_keys(df: pl.DataFrame, table_name: str, config: AppConfi
 def check_duplicate_business_keys(df: pl.DataFrame, table_name: str, config: AppConfig) -> list[DQResult]:
     """Check for duplicate composite business keys within the file."""
     results = []
-    schema = config.get_schema(table_name)
-    bk_cols = [c for c in schema.business_key if c in df.columns]
+    bk_cols = [c for c in config.registry.table(table_name).business_key if c in df.columns]
 
     if not bk_cols:
         return results
@@ -130,49 +128,38 @@ def check_charge_types(df: pl.DataFrame, config: AppConfig) -> list[DQResult]:
 def check_type_coercion(df: pl.DataFrame, table_name: str, config: AppConfig) -> list[DQResult]:
     """Check that columns can be cast to their declared types."""
     results = []
-    schema = config.get_schema(table_name)
-    all_cols = list(schema.required_columns) + list(schema.optional_columns)
-
-    type_map = {
-        "VARCHAR": pl.Utf8,
-        "BIGINT": pl.Int64,
-        "DOUBLE": pl.Float64,
-        "DATE": pl.Date,
-        "BOOLEAN": pl.Boolean,
-    }
-
-    for col_def in all_cols:
-        if col_def.name not in df.columns:
-            continue
-        target_type = type_map.get(col_def.type)
-        if target_type is None:
+    entry = config.registry.table(table_name)
+
+    for name, target_type in entry.cast_types.items():
+        if name not in df.columns:
             continue
+        type_str = entry.column_types[name]
 
         # Only check if column is currently string and needs conversion
-        if df[col_def.name].dtype == pl.Utf8 and target_type != pl.Utf8:
+        if df[name].dtype == pl.Utf8 and target_type != pl.Utf8:
             try:
                 if target_type == pl.Int64:
-                    df[col_def.name].cast(pl.Int64, strict=True)
+                    df[name].cast(pl.Int64, strict=True)
                 elif target_type == pl.Float64:
-                    df[col_def.name].cast(pl.Float64, strict=True)
+                    df[name].cast(pl.Float64, strict=True)
                 elif target_type == pl.Date:
-                    df[col_def.name].str.to_date(strict=False)
+                    df[name].str.to_date(strict=False)
                 elif target_type == pl.Boolean:
                     pass  # Boolean coercion is flexible
             except Exception as e:
                 results.append(DQResult(
-                    check_name=f"type_coercion_{col_def.name}",
+                    check_name=f"type_coercion_{name}",
                     severity="HIGH",
                     passed=False,
-                    detail=f"Column '{col_def.name}' cannot be cast to {col_def.type}: {e}"
+                    detail=f"Column '{name}' cannot be cast to {type_str}: {e}"
                 ))
                 continue
 
         results.append(DQResult(
-            check_name=f"type_coercion_{col_def.name}",
+            check_name=f"type_coercion_{name}",
             severity="HIGH",
             passed=True,
-            detail=f"Column '{col_def.name}' can be cast to {col_def.type}"
+            detail=f"Column '{name}' can be cast to {type_str}"
         ))
     return results
 
@@ -193,6 +180,191 @@ def run_all_checks(
     return results
 
 
+# Prefix for the cast copies carried alongside the original columns in the fused query
+_CAST_PREFIX = "__cast__"
+
+
+def _check_aggs(schema: pl.Schema, table_name: str, config: AppConfig, cast_of) -> tuple[list[pl.Expr], dict]:
+    """Aggregations behind every check, plus the plan needed to read them back.
+
+    cast_of(name, target) gives the cast value of a column, so the same counts
+    can run over raw columns or over cast copies already in the frame.
+    """
+    entry = config.registry.table(table_name)
+    columns = schema.names()
+
+    aggs = [pl.len().alias("_rows")]
+    bk_cols = [c for c in entry.business_key if c in columns]
+    for c in bk_cols:
+        aggs.append(pl.col(c).null_count().alias(f"_null_{c}"))
+    if bk_cols:
+        aggs.append(pl.struct(bk_cols).n_unique().alias("_unique_bk"))
+
+    cast_cols = [name for name in entry.cast_types if name in columns]
+    for name in cast_cols:
+        target_type = entry.cast_types[name]
+        if schema[name] == pl.Utf8 and target_type in (pl.Int64, pl.Float64):
+            aggs.append(
+                (pl.col(name).is_not_null() & cast_of(name, target_type).is_null())
+                .sum()
+                .alias(f"_castfail_{name}")
+            )
+
+    check_charges = table_name == "fact_charge_actual" and "charge_type" in columns
+    if check_charges:
+        aggs.append(pl.col("charge_type").unique().implode().alias("_charge_types"))
+
+    plan = {"bk_cols": bk_cols, "cast_cols": cast_cols, "check_charges": check_charges}
+    return aggs, plan
+
+
+def _results_from_stats(
+    stats: dict, schema: pl.Schema, table_name: str, config: AppConfig, plan: dict
+) -> list[DQResult]:
+    """Turn the aggregated counts into the same DQResults as run_all_checks."""
+    entry = config.registry.table(table_name)
+    bk_cols = plan["bk_cols"]
+
+    results = check_required_columns(pl.DataFrame(schema=schema), table_name, config)
+
+    for c in bk_cols:
+        null_count = stats[f"_null_{c}"]
+        results.append(DQResult(
+            check_name=f"null_business_key_{c}",
+            severity="CRITICAL",
+            passed=null_count == 0,
+            detail=(f"Business key '{c}' has {null_count} NULL values in {table_name}"
+                    if null_count else f"Business key '{c}' has no NULLs"),
+        ))
+
+    if bk_cols:
+        dup_count = stats["_rows"] - stats["_unique_bk"]
+        results.append(DQResult(
+            check_name="duplicate_business_keys",
+            severity="HIGH",
+            passed=dup_count == 0,
+            detail=(f"Found {dup_count} duplicate business key(s) in {table_name} on {bk_cols}"
+                    if dup_count else f"No duplicate business keys in {table_name}"),
+        ))
+
+    for name in plan["cast_cols"]:
+        failed = stats.get(f"_castfail_{name}", 0)
+        type_str = entry.column_types[name]
+        results.append(DQResult(
+            check_name=f"type_coercion_{name}",
+            severity="HIGH",
+            passed=failed == 0,
+            detail=(f"Column '{name}' cannot be cast to {type_str}: {failed} values failed"
+                    if failed else f"Column '{name}' can be cast to {type_str}"),
+        ))
+
+    if plan["check_charges"]:
+        unknown = set(stats["_charge_types"]) - config.get_valid_charge_types()
+        results.append(DQResult(
+            check_name="charge_type_validation",
+            severity="HIGH",
+            passed=not unknown,
+            detail=(f"Unknown charge types not in policy: {sorted(unknown)}"
+                    if unknown else "All charge types are valid"),
+        ))
+
+    return results
+
+
+def run_fused_checks(
+    df: pl.DataFrame,
+    table_name: str,
+    config: AppConfig,
+) -> tuple[list[DQResult], pl.DataFrame]:
+    """Run the run_all_checks checks and the schema.yaml casts in one pass.
+
+    Every column is cast once; the counts read the cast copies and the same
+    copies come back as the cast frame, so cast_columns has nothing left to do.
+    If a cast raises outright (e.g. a date format that cannot be inferred),
+    falls back to run_all_checks, which pins the failure on its column, and
+    returns the frame uncast.
+    Returns (results, frame).
+    """
+    entry = config.registry.table(table_name)
+    to_cast = [
+        name for name, target in entry.cast_types.items()
+        if name in df.columns and df.schema[name] != target
+    ]
+
+    def cast_of(name: str, target: pl.DataType) -> pl.Expr:
+        if name in to_cast:
+            return pl.col(_CAST_PREFIX + name)
+        return pl.col(name).cast(target, strict=False)
+
+    aggs, plan = _check_aggs(df.schema, table_name, config, cast_of)
+    base = df.lazy().with_columns(entry.cast_exprs[name].alias(_CAST_PREFIX + name) for name in to_cast)
+    frame = base.select(
+        pl.col(_CAST_PREFIX + c).alias(c) if c in to_cast else pl.col(c) for c in df.columns
+    )
+
+    try:
+        # collect_all shares the cast subplan between the two outputs
+        stats, cast_df = pl.collect_all([base.select(aggs), frame])
+    except pl.exceptions.PolarsError:
+        return run_all_checks(df, table_name, config), df
+
+    return _results_from_stats(stats.row(0, named=True), df.schema, table_name, config, plan), cast_df
+
+
+def run_lazy_checks(
+    lf: pl.LazyFrame,
+    table_name: str,
+    config: AppConfig,
+) -> tuple[list[DQResult], int]:
+    """Run the same checks as run_all_checks over a LazyFrame in one streaming pass.
+
+    Null, duplicate and cast-failure counts are aggregated over the whole file,
+    so the verdict does not depend on how the file is chunked afterwards. Only
+    the business-key hash set grows with the file, never the full rows.
+    Returns (results, row_count).
+    """
+    lf_schema = lf.collect_schema()
+    aggs, plan = _check_aggs(
+        lf_schema, table_name, config, lambda name, target: pl.col(name).cast(target, strict=False)
+    )
+    stats = lf.select(aggs).collect(engine="streaming").row(0, named=True)
+    return _results_from_stats(stats, lf_schema, table_name, config, plan), stats["_rows"]
+
+
+def quarantine_rule_expr(schema: pl.Schema, table_name: str, config: AppConfig) -> pl.Expr:
+    """Per-row expression naming the checks a row fails, comma-separated (null when clean).
+
+    Covers the checks that can be pinned on rows: NULL business key, duplicate
+    business key, uncastable numeric value and unknown charge_type. Rule names
+    are the check_name of the matching file-level DQResult; every row of a
+    duplicated key is flagged, since there is no telling which one is right.
+    """
+    entry = config.registry.table(table_name)
+    columns = schema.names()
+    flags = []
+
+    bk_cols = [c for c in entry.business_key if c in columns]
+    for c in bk_cols:
+        flags.append(pl.when(pl.col(c).is_null()).then(pl.lit(f"null_business_key_{c}")))
+    if bk_cols:
+        flags.append(pl.when(pl.struct(bk_cols).is_duplicated()).then(pl.lit("duplicate_business_keys")))
+
+    for name, target_type in entry.cast_types.items():
+        if name in columns and schema[name] == pl.Utf8 and target_type in (pl.Int64, pl.Float64):
+            failed = pl.col(name).is_not_null() & pl.col(name).cast(target_type, strict=False).is_null()
+            flags.append(pl.when(failed).then(pl.lit(f"type_coercion_{name}")))
+
+    if table_name == "fact_charge_actual" and "charge_type" in columns:
+        valid = sorted(config.get_valid_charge_types())
+        unknown = pl.col("charge_type").is_in(valid).fill_null(False).not_()
+        flags.append(pl.when(unknown).then(pl.lit("charge_type_validation")))
+
+    if not flags:
+        return pl.lit(None, dtype=pl.Utf8).alias("rule")
+    rule = pl.concat_str(flags, separator=",", ignore_nulls=True)
+    return pl.when(rule != "").then(rule).alias("rule")
+
+
 def has_failures(results: list[DQResult]) -> bool:
     """Check if any CRITICAL or HIGH DQ checks failed."""
     return any(not r.passed and r.severity in ("CRITICAL", "HIGH") for r in results)
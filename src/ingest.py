@@ -1,76 +1,441 @@
 """ETL ingestion: detect table type, apply aliases, validate, DQ check, upsert.
 
-Ingestion from inbox/ (CSV/XLSX). Idempotent, transactional, fail-loud.
+Ingestion from inbox/ (CSV, gzip/zstd CSV, Parquet, Arrow IPC, XLSX). Idempotent, transactional, fail-loud.
 """
+import csv
 import hashlib
+import importlib.util
+import io
 import logging
+import mmap
 import os
-from datetime import datetime, timezone
+import shutil
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import UTC, date, datetime
 from pathlib import Path
+from queue import Empty, Full, Queue
 
 import duckdb
 import polars as pl
+import pyarrow as pa
 
-from src.aliases import apply_aliases, build_alias_map
+from src.aliases import apply_aliases
 from src.config import AppConfig
-from src.dq import DQResult, has_failures, run_all_checks
+from src.dq import (
+    DQResult,
+    has_failures,
+    quarantine_rule_expr,
+    run_fused_checks,
+    run_lazy_checks,
+)
+from src.periods import event_period_range
 
 logger = logging.getLogger(__name__)
 
 INBOX_DIR = Path("inbox")
 
-# Type mapping from schema.yaml type strings to Polars casts
-TYPE_CAST_MAP = {
-    "VARCHAR": pl.Utf8,
-    "BIGINT": pl.Int64,
-    "DOUBLE": pl.Float64,
-    "DATE": pl.Date,
-    "BOOLEAN": pl.Boolean,
-}
-
 # Columns that are optional in the business key (use sentinel for NULL)
 SENTINEL_VALUE = "__NONE__"
 
+# Read size for hashing files that cannot be memory-mapped
+HASH_READ_SIZE = 1024 * 1024
+
+# Bulk upsert mode flushes staged frames once this many rows are pending
+BULK_FLUSH_ROWS = 2_000_000
+
+# Inbox file name suffix -> reader; the longest matching suffix wins
+INBOX_FORMATS = {
+    ".csv": "csv",
+    ".csv.gz": "csv",
+    ".csv.zst": "csv",
+    ".parquet": "parquet",
+    ".arrow": "ipc",
+    ".ipc": "ipc",
+    ".feather": "ipc",
+    ".xlsx": "excel",
+    ".xls": "excel",
+}
+
+# Compressed CSV suffix -> Arrow codec used to decompress it as a stream
+CSV_COMPRESSION = {".gz": "gzip", ".zst": "zstd"}
+
+
+def inbox_format(path: Path) -> str | None:
+    """Reader for an inbox file (csv | parquet | ipc | excel), None if unsupported."""
+    name = path.name.lower()
+    for suffix in sorted(INBOX_FORMATS, key=len, reverse=True):
+        if name.endswith(suffix):
+            return INBOX_FORMATS[suffix]
+    return None
+
+
+def _open_csv_stream(path: Path) -> pa.NativeFile:
+    """Binary stream over a CSV, decompressed on the fly for .csv.gz/.csv.zst."""
+    return pa.input_stream(str(path), compression=CSV_COMPRESSION.get(path.suffix.lower()))
+
+
+@dataclass
+class PreparedFile:
+    """CPU-side result for one inbox file, ready for the single DuckDB writer.
+
+    status: ready | stream | skipped | dq_failed | error | already_loaded
+    A "stream" file carries a LazyFrame (already aliased and DQ-checked) that
+    the writer upserts chunk by chunk instead of a materialized DataFrame.
+    In quarantine mode, rows split off by row-level DQ sit in `quarantine`
+    (row_index, rule, row_data) while `df` holds the clean remainder.
+    `sheet` is set for one worksheet of a workbook fanned out per sheet.
+    `period_range` is the (first, last) 'YYYY-MM' of the event_date_column.
+    """
+    file_path: Path
+    sheet: str | None = None
+    file_hash: str = ""
+    status: str = "pending"
+    table_name: str | None = None
+    df: pl.DataFrame | None = None
+    lazy: pl.LazyFrame | None = None
+    row_count: int = 0
+    dq_results: list[DQResult] = field(default_factory=list)
+    error: str | None = None
+    quarantine: pl.DataFrame | None = None
+    period_range: tuple[str, str] | None = None
+
+    @property
+    def name(self) -> str:
+        """File name as logged; 'book.xlsx[Sheet2]' for a fanned-out worksheet."""
+        return sheet_file_name(self.file_path, self.sheet)
+
 
 def compute_file_hash(path: Path) -> str:
-    """Compute SHA256 hash of file contents."""
+    """Compute SHA256 hash of file contents.
+
+    Hashes straight from a memory map (no Python-level chunk loop); files that
+    cannot be mapped (empty, special filesystems) fall back to 1 MB reads.
+    """
     h = hashlib.sha256()
     with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(mm)
+        except (ValueError, OSError):
+            f.seek(0)
+            for chunk in iter(lambda: f.read(HASH_READ_SIZE), b""):
+                h.update(chunk)
     return h.hexdigest()
 
 
-def read_file(path: Path) -> pl.DataFrame:
-    """Read CSV or XLSX file into a Polars DataFrame (all columns as strings)."""
-    suffix = path.suffix.lower()
-    if suffix == ".csv":
-        return pl.read_csv(path, infer_schema_length=0, encoding="utf8-lossy")
-    elif suffix in (".xlsx", ".xls"):
-        return pl.read_excel(path, infer_schema_length=0)
-    raise ValueError(f"Unsupported file type: {suffix}")
+def _stat_key(path: Path) -> tuple[str, int, int]:
+    st = path.stat()
+    return str(path.resolve()), st.st_size, st.st_mtime_ns
 
 
-def detect_table_type(df: pl.DataFrame, config: AppConfig) -> str:
-    """Score each table in schema.yaml by required_columns overlap. Ties -> FAIL."""
-    scores: dict[str, float] = {}
-
-    for table_name, table_schema in config.schema.items():
-        # Build alias map for candidate table to check mapped names
-        alias_map = build_alias_map(config, table_name)
-        mapped_cols: set[str] = set()
-        for col in df.columns:
-            canonical = alias_map.get(col.lower().strip(), col.lower().strip())
-            mapped_cols.add(canonical)
-
-        required = {c.name for c in table_schema.required_columns}
-        if len(required) == 0:
+def resolve_file_hashes(
+    con: duckdb.DuckDBPyConnection,
+    files: list[Path],
+    pool: ThreadPoolExecutor | None = None,
+    update_cache: bool = True,
+) -> list[str | None]:
+    """Hash files through raw.system_file_hash_cache keyed on (path, size, mtime_ns).
+
+    Unchanged files cost one stat; only new or modified files are read (in the
+    pool when given). Unreadable files yield None. Runs on the writer thread.
+    With update_cache=False (dry runs) new hashes are not written back.
+    """
+    keys: list[tuple[str, int, int] | None] = []
+    for f in files:
+        try:
+            keys.append(_stat_key(f))
+        except OSError:
+            keys.append(None)
+
+    paths = pl.DataFrame({"file_path": [k[0] for k in keys if k]}, schema={"file_path": pl.Utf8})
+    con.register("_hash_paths", paths.to_arrow())
+    try:
+        cached = {
+            row[0]: (row[1], row[2], row[3])
+            for row in con.execute(
+                "SELECT c.file_path, c.file_size, c.mtime_ns, c.file_hash "
+                "FROM raw.system_file_hash_cache c SEMI JOIN _hash_paths p USING (file_path)"
+            ).fetchall()
+        }
+    finally:
+        con.unregister("_hash_paths")
+
+    hashes: list[str | None] = [None] * len(files)
+    misses = []
+    for i, key in enumerate(keys):
+        if key is None:
             continue
-        scores[table_name] = len(required & mapped_cols) / len(required)
+        hit = cached.get(key[0])
+        if hit is not None and hit[:2] == key[1:]:
+            hashes[i] = hit[2]
+        else:
+            misses.append(i)
+
+    mapper = pool.map if pool is not None else map
+    new_entries = []
+    for i, file_hash in zip(misses, mapper(_hash_or_none, [files[i] for i in misses])):
+        hashes[i] = file_hash
+        # Only cache if the file did not change while it was being hashed
+        try:
+            if file_hash is not None and _stat_key(files[i]) == keys[i]:
+                new_entries.append((*keys[i], file_hash))
+        except OSError:
+            pass
+
+    if new_entries and update_cache:
+        entries = pl.DataFrame(
+            new_entries, schema=["file_path", "file_size", "mtime_ns", "file_hash"], orient="row"
+        )
+        con.register("_hash_entries", entries.to_arrow())
+        try:
+            con.execute(
+                "INSERT OR REPLACE INTO raw.system_file_hash_cache (file_path, file_size, mtime_ns, file_hash) "
+                "SELECT file_path, file_size, mtime_ns, file_hash FROM _hash_entries"
+            )
+        finally:
+            con.unregister("_hash_entries")
+
+    return hashes
+
+
+def prune_file_hash_cache(con: duckdb.DuckDBPyConnection, inbox: Path, files: list[Path]) -> int:
+    """Delete hash cache rows of files under inbox that are no longer listed in it.
+
+    Keeps raw.system_file_hash_cache at the size of the inbox once files are
+    archived or removed. Returns the number of rows deleted.
+    """
+    prefix = os.path.join(str(inbox.resolve()), "")
+    listed = pl.DataFrame({"file_path": [str(f.resolve()) for f in files]}, schema={"file_path": pl.Utf8})
+    con.register("_listed_paths", listed.to_arrow())
+    try:
+        deleted = con.execute(
+            "DELETE FROM raw.system_file_hash_cache c "
+            "WHERE starts_with(c.file_path, ?) "
+            "AND NOT EXISTS (SELECT 1 FROM _listed_paths l WHERE l.file_path = c.file_path) "
+            "RETURNING 1",
+            [prefix],
+        ).fetchall()
+    finally:
+        con.unregister("_listed_paths")
+    return len(deleted)
+
+
+def read_file(path: Path, sheet: str | None = None) -> pl.DataFrame:
+    """Read an inbox file into a Polars DataFrame.
+
+    CSV and XLSX come back as all strings. Parquet and Arrow IPC keep their
+    stored types; conform_typed_columns reconciles them with schema.yaml.
+    `sheet` picks a worksheet (default: the first one).
+    """
+    fmt = inbox_format(path)
+    if fmt == "csv":
+        if path.suffix.lower() in CSV_COMPRESSION:
+            with _open_csv_stream(path) as stream:
+                return pl.read_csv(stream, infer_schema_length=0, encoding="utf8-lossy")
+        return pl.read_csv(path, infer_schema_length=0, encoding="utf8-lossy")
+    if fmt == "parquet":
+        return pl.read_parquet(path)
+    if fmt == "ipc":
+        return pl.read_ipc(path)
+    if fmt == "excel":
+        return read_excel_sheet(path, sheet)
+    raise ValueError(f"Unsupported file type: {path.name}")
 
-    if not scores:
+
+def excel_engine() -> str:
+    """calamine (Rust, via fastexcel) when installed, else openpyxl read-only streaming."""
+    return "calamine" if importlib.util.find_spec("fastexcel") is not None else "openpyxl"
+
+
+def sheet_file_name(path: Path, sheet: str | None) -> str:
+    return path.name if sheet is None else f"{path.name}[{sheet}]"
+
+
+def sheet_hash(file_hash: str | None, sheet: str | None) -> str | None:
+    """Logical hash of one worksheet: the workbook hash salted with the sheet name."""
+    if file_hash is None or sheet is None:
+        return file_hash
+    return hashlib.sha256(f"{file_hash}:{sheet}".encode()).hexdigest()
+
+
+def list_sheets(path: Path) -> list[str]:
+    """Worksheet names in workbook order (reads the workbook index only)."""
+    if excel_engine() == "calamine":
+        import fastexcel
+
+        return fastexcel.read_excel(path).sheet_names
+
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+
+def select_sheets(path: Path, config: AppConfig) -> list[str | None]:
+    """Worksheets of an inbox workbook to ingest, per ingest.yaml excel.sheets.
+
+    "first" (default) keeps the workbook a single file (sheet None, whole-file
+    hash). "all" or a list of names fans it out into one logical file per
+    sheet; any other string is a single sheet name. A workbook whose sheets
+    cannot be listed stays a single file, so the read error is reported for
+    it like for any other file.
+    """
+    wanted = config.ingest.get("excel", {}).get("sheets", "first")
+    if isinstance(wanted, str) and wanted not in ("first", "all"):
+        wanted = [wanted]
+    elif not isinstance(wanted, (str, list)) or not wanted:
+        raise ValueError(
+            f"ingest.yaml excel.sheets must be 'first', 'all', a sheet name or a list of names, got {wanted!r}"
+        )
+    if wanted == "first" or inbox_format(path) != "excel":
+        return [None]
+    try:
+        names = list_sheets(path)
+    except Exception:
+        return [None]
+    if wanted == "all":
+        return names
+    selected = [n for n in names if n in wanted]
+    # A missing sheet is kept so it fails loudly at read time
+    return selected or [wanted[0]]
+
+
+def _excel_cell_str(value) -> str | None:
+    """Render an openpyxl cell value the way it would appear in a CSV export."""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == datetime.min.time() else value.isoformat(sep=" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def _read_xlsx_openpyxl(path: Path, sheet: str | None) -> pl.DataFrame:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet] if sheet is not None else wb.worksheets[0]
+        # Stored dimensions are often wrong; scan to the real end of the data
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        while header and header[-1] is None:
+            header.pop()
+        width = len(header)
+        columns = [str(v) if v is not None else f"__UNNAMED__{i}" for i, v in enumerate(header)]
+
+        data = []
+        for row in rows:
+            values = [_excel_cell_str(v) for v in row[:width]]
+            if any(v is not None for v in values):
+                values.extend([None] * (width - len(values)))
+                data.append(values)
+    finally:
+        wb.close()
+
+    return pl.DataFrame(data, schema={c: pl.Utf8 for c in columns}, orient="row")
+
+
+def read_excel_sheet(path: Path, sheet: str | None = None) -> pl.DataFrame:
+    """Read one worksheet (default: the first) as all-string columns, used range only.
+
+    Fully empty rows are dropped. The read time is logged per sheet.
+    """
+    engine = excel_engine()
+    started = time.perf_counter()
+    if engine == "calamine":
+        df = pl.read_excel(
+            path, sheet_name=sheet, sheet_id=None if sheet else 1,
+            engine="calamine", infer_schema_length=0,
+        )
+        if df.width:
+            df = df.filter(~pl.all_horizontal(pl.all().is_null()))
+    else:
+        df = _read_xlsx_openpyxl(path, sheet)
+    logger.info(
+        f"  {sheet_file_name(path, sheet)}: read {df.height} rows x {df.width} cols "
+        f"in {time.perf_counter() - started:.2f}s ({engine})"
+    )
+    return df
+
+
+def scan_csv_lazy(path: Path) -> pl.LazyFrame:
+    """Lazily scan a CSV with all columns as strings (streaming counterpart of read_file)."""
+    return pl.scan_csv(path, infer_schema=False, encoding="utf8-lossy")
+
+
+def use_streaming(path: Path, config: AppConfig) -> bool:
+    """Large uncompressed CSVs (ingest.yaml streaming.min_file_mb) are ingested in chunks."""
+    min_mb = config.ingest.get("streaming", {}).get("min_file_mb")
+    if min_mb is None or inbox_format(path) != "csv" or path.suffix.lower() in CSV_COMPRESSION:
+        return False
+    return path.stat().st_size >= min_mb * 1024 * 1024
+
+
+def read_header(path: Path, sheet: str | None = None) -> list[str]:
+    """Read only the header row: CSV first line (decompressing just that far),
+    Parquet/IPC schema metadata, XLSX first row (openpyxl read-only).
+
+    Formats without a cheap header path fall back to a full read_file.
+    """
+    fmt = inbox_format(path)
+    suffix = path.suffix.lower()
+    if fmt == "csv":
+        with _open_csv_stream(path) as stream:
+            text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+            return next(csv.reader(text), [])
+    if fmt == "parquet":
+        return list(pl.read_parquet_schema(path))
+    if fmt == "ipc":
+        return list(pl.read_ipc_schema(path))
+    if suffix == ".xlsx":
+        from openpyxl import load_workbook
+
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            ws = wb[sheet] if sheet is not None else wb.worksheets[0]
+            first = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+            return [str(v) for v in first if v is not None]
+        finally:
+            wb.close()
+    return read_file(path, sheet).columns
+
+
+def detect_table_type_from_columns(columns: list[str], config: AppConfig) -> str:
+    """Score each table in schema.yaml by required_columns overlap. Ties -> FAIL.
+
+    Scoring goes through the precomputed alias -> tables index, so the cost is
+    one dict lookup per header column regardless of how many tables exist.
+    """
+    index = config.registry.detection_index
+    required = {
+        t: entry.required_columns
+        for t, entry in config.registry.tables.items()
+        if entry.required_columns
+    }
+    if not required:
         raise ValueError("No tables defined in schema.yaml")
 
+    matched: dict[str, set[str]] = {t: set() for t in required}
+    for col in columns:
+        for table_name, canonical in index.get(col.lower().strip(), {}).items():
+            matched[table_name].add(canonical)
+
+    scores = {t: len(matched[t]) / len(req) for t, req in required.items()}
     ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
 
     # Check for ties at the top
@@ -88,48 +453,68 @@ def detect_table_type(df: pl.DataFrame, config: AppConfig) -> str:
     return ranked[0][0]
 
 
-def cast_columns(df: pl.DataFrame, table_name: str, config: AppConfig) -> pl.DataFrame:
-    """Cast DataFrame columns to their declared types from schema.yaml."""
-    schema = config.get_schema(table_name)
-    all_cols = list(schema.required_columns) + list(schema.optional_columns)
+def detect_table_type(df: pl.DataFrame, config: AppConfig) -> str:
+    """Score each table in schema.yaml by required_columns overlap. Ties -> FAIL."""
+    return detect_table_type_from_columns(df.columns, config)
+
 
+def conform_typed_columns(df: pl.DataFrame, table_name: str, config: AppConfig) -> pl.DataFrame:
+    """Reconcile typed (Parquet/IPC) columns with their declared schema.yaml types.
+
+    Columns already of the declared type are kept as-is, so they skip the
+    string round trip entirely. Narrower integers/floats are upcast and
+    datetimes truncated to dates; anything else is turned into strings so
+    DQ and cast_columns treat it exactly like a CSV value. String-only
+    frames (CSV/XLSX) pass through untouched.
+    """
+    entry = config.registry.table(table_name)
     exprs = []
-    for col_def in all_cols:
-        if col_def.name not in df.columns:
-            continue
-        target = TYPE_CAST_MAP.get(col_def.type)
-        if target is None:
+    for name, target in entry.cast_types.items():
+        if name not in df.columns:
             continue
-        if df[col_def.name].dtype == target:
+        dtype = df.schema[name]
+        if dtype == target or dtype == pl.Utf8:
             continue
-
-        if target == pl.Date:
-            exprs.append(pl.col(col_def.name).str.to_date(strict=False).alias(col_def.name))
-        elif target == pl.Boolean:
-            exprs.append(
-                pl.when(pl.col(col_def.name).str.to_lowercase().is_in(["true", "1", "yes"]))
-                .then(True)
-                .when(pl.col(col_def.name).str.to_lowercase().is_in(["false", "0", "no"]))
-                .then(False)
-                .otherwise(None)
-                .alias(col_def.name)
-            )
+        widen_int = target in (pl.Int64, pl.Float64) and dtype.is_integer() and dtype != pl.UInt64
+        if widen_int or (target == pl.Float64 and dtype.is_float()):
+            exprs.append(pl.col(name).cast(target))
+        elif target == pl.Date and isinstance(dtype, pl.Datetime):
+            exprs.append(pl.col(name).cast(pl.Date))
         else:
-            exprs.append(pl.col(col_def.name).cast(target, strict=False).alias(col_def.name))
+            exprs.append(pl.col(name).cast(pl.Utf8))
+    return df.with_columns(exprs) if exprs else df
+
+
+def cast_columns(df: pl.DataFrame, table_name: str, config: AppConfig) -> pl.DataFrame:
+    """Cast DataFrame columns to their declared types from schema.yaml."""
+    entry = config.registry.table(table_name)
 
+    exprs = [
+        entry.cast_exprs[name]
+        for name, target in entry.cast_types.items()
+        if name in df.columns and df[name].dtype != target
+    ]
     if exprs:
         df = df.with_columns(exprs)
 
     return df
 
 
+def encode_categoricals(df: pl.DataFrame, config: AppConfig) -> pl.DataFrame:
+    """Dictionary-encode the ingest.yaml encoding.categorical_columns (pl.Categorical).
+
+    Repeated IDs are then held once per distinct value while the frame waits
+    in the writer queue or the bulk upserter, and reach DuckDB as Arrow
+    dictionary arrays that it scans straight into the VARCHAR columns.
+    """
+    wanted = config.ingest.get("encoding", {}).get("categorical_columns", [])
+    exprs = [pl.col(c).cast(pl.Categorical) for c in wanted if df.schema.get(c) == pl.Utf8]
+    return df.with_columns(exprs) if exprs else df
+
+
 def filter_columns(df: pl.DataFrame, table_name: str, config: AppConfig) -> pl.DataFrame:
     """Keep only columns that are in the schema (required + optional) + system columns."""
-    schema = config.get_schema(table_name)
-    known_cols = {c.name for c in schema.required_columns} | {c.name for c in schema.optional_columns}
-    # Also keep system columns that might already be present
-    known_cols.update({"source_system", "source_pk", "load_batch_id", "source_file_hash", "loaded_at"})
-
+    known_cols = config.registry.table(table_name).known_columns
     keep = [c for c in df.columns if c in known_cols]
     return df.select(keep)
 
@@ -138,7 +523,7 @@ def add_system_columns(
     df: pl.DataFrame, batch_id: int, file_hash: str, table_name: str, config: AppConfig
 ) -> pl.DataFrame:
     """Add system columns required for CORE tables."""
-    schema = config.get_schema(table_name)
+    entry = config.registry.table(table_name)
 
     # Ensure source_system exists
     if "source_system" not in df.columns:
@@ -152,18 +537,35 @@ def add_system_columns(
     df = df.with_columns([
         pl.lit(batch_id).alias("load_batch_id"),
         pl.lit(file_hash).alias("source_file_hash"),
-        pl.lit(datetime.now(timezone.utc)).alias("loaded_at"),
+        pl.lit(datetime.now(UTC)).alias("loaded_at"),
     ])
 
     # Fill sentinel for optional PK components
-    bk_cols = list(schema.business_key)
-    for col in bk_cols:
-        if col in df.columns:
-            df = df.with_columns(
-                pl.col(col).fill_null(SENTINEL_VALUE).alias(col)
-            )
+    sentinel_fills = [
+        pl.col(col).fill_null(SENTINEL_VALUE).alias(col)
+        for col in entry.business_key
+        if col in df.columns
+    ]
+    if sentinel_fills:
+        df = df.with_columns(sentinel_fills)
 
-    return df
+    return df.with_columns(row_hash_expr(df.columns, table_name, config))
+
+
+def row_hash_expr(columns: list[str], table_name: str, config: AppConfig) -> pl.Expr:
+    """Content hash (UInt64) over the table's schema.yaml columns, in sorted order.
+
+    Columns absent from the file hash as typed NULLs, so a re-export with or
+    without an empty optional column hashes the same. Polars hashes are stable
+    for a given Polars version; after an upgrade rows rewrite once.
+    """
+    entry = config.registry.table(table_name)
+    present = set(columns)
+    fields = [
+        pl.col(c) if c in present else pl.lit(None, dtype=entry.cast_types.get(c, pl.Utf8)).alias(c)
+        for c in entry.content_columns
+    ]
+    return pl.struct(fields).hash(seed=0).alias("row_hash")
 
 
 def get_target_column_order(table_name: str, con: duckdb.DuckDBPyConnection) -> list[str]:
@@ -176,60 +578,338 @@ def get_target_column_order(table_name: str, con: duckdb.DuckDBPyConnection) ->
     return [c[0] for c in cols]
 
 
+def _align_to_target(df: pl.DataFrame, target_cols: list[str]) -> pl.DataFrame:
+    """Add missing target columns as NULL and reorder to the CORE table layout."""
+    missing = [pl.lit(None).cast(pl.Utf8).alias(c) for c in target_cols if c not in df.columns]
+    if missing:
+        df = df.with_columns(missing)
+    return df.select(target_cols)
+
+
+@dataclass
+class UpsertCounts:
+    """Rows of an upsert by outcome, compared on business key and row_hash."""
+
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+    @property
+    def rows(self) -> int:
+        return self.inserted + self.updated + self.unchanged
+
+    def __add__(self, other: "UpsertCounts") -> "UpsertCounts":
+        return UpsertCounts(
+            self.inserted + other.inserted, self.updated + other.updated, self.unchanged + other.unchanged
+        )
+
+
+def _upsert_returning(
+    con: duckdb.DuckDBPyConnection,
+    df: pl.DataFrame,
+    table_name: str,
+    bk_cols: list[str],
+    returning: str,
+) -> tuple[pa.Table, pa.Table]:
+    """Upsert a staged frame in two statements; returns their (inserted, updated) RETURNING rows.
+
+    New business keys are inserted first (ON CONFLICT DO NOTHING), then the
+    conflicting rows are rewritten when their row_hash differs; rows just
+    inserted match their own hash and are skipped. Both statements resolve
+    the staged rows through the PK index, so the cost follows the size of the
+    delta instead of a scan of core.<table_name>. The frame must not contain
+    duplicate business keys.
+    """
+    target_cols = get_target_column_order(table_name, con)
+    df = _align_to_target(df, target_cols)
+
+    update_cols = [c for c in target_cols if c not in bk_cols]
+    set_clause = ", ".join(f"{c} = excluded.{c}" for c in update_cols)
+
+    con.register("_staging", df.to_arrow())
+    try:
+        inserted = con.execute(f"""
+            INSERT INTO core.{table_name} SELECT * FROM _staging
+            ON CONFLICT DO NOTHING
+            RETURNING {returning}
+        """).to_arrow_table()
+        updated = con.execute(f"""
+            INSERT INTO core.{table_name} AS c SELECT * FROM _staging
+            ON CONFLICT ({", ".join(bk_cols)}) DO UPDATE SET {set_clause}
+            WHERE c.row_hash IS DISTINCT FROM excluded.row_hash
+            RETURNING {returning}
+        """).to_arrow_table()
+    finally:
+        con.unregister("_staging")
+    return inserted, updated
+
+
+def _replace_into_core(
+    con: duckdb.DuckDBPyConnection,
+    df: pl.DataFrame,
+    table_name: str,
+    bk_cols: list[str],
+) -> UpsertCounts:
+    """Set-based upsert of a staged frame against the CORE table's PRIMARY KEY.
+
+    Re-sent overlapping exports only rewrite the rows whose row_hash changed
+    (see _upsert_returning).
+    """
+    inserted, updated = _upsert_returning(con, df, table_name, bk_cols, "1")
+    return UpsertCounts(inserted.num_rows, updated.num_rows, len(df) - inserted.num_rows - updated.num_rows)
+
+
+def _replace_into_core_by_file(
+    con: duckdb.DuckDBPyConnection,
+    df: pl.DataFrame,
+    table_name: str,
+    bk_cols: list[str],
+) -> dict[str, UpsertCounts]:
+    """_replace_into_core for frames staged from several files, counted per source_file_hash."""
+
+    def per_file(rows: pa.Table) -> dict[str, int]:
+        return dict(pl.from_arrow(rows)["source_file_hash"].value_counts().iter_rows())
+
+    inserted, updated = _upsert_returning(con, df, table_name, bk_cols, "source_file_hash")
+    inserted, updated = per_file(inserted), per_file(updated)
+
+    counts = {}
+    for file_hash, staged in df["source_file_hash"].value_counts().iter_rows():
+        n_inserted, n_updated = inserted.get(file_hash, 0), updated.get(file_hash, 0)
+        counts[file_hash] = UpsertCounts(n_inserted, n_updated, staged - n_inserted - n_updated)
+    return counts
+
+
 def upsert_core(
     con: duckdb.DuckDBPyConnection,
     df: pl.DataFrame,
     table_name: str,
     config: AppConfig,
-    batch_id: int,
-    file_hash: str,
-) -> int:
-    """Transactional upsert: DELETE matching BK rows, then INSERT."""
-    schema = config.get_schema(table_name)
-    bk_cols = list(schema.business_key)
+) -> UpsertCounts:
+    """Upsert a staged frame into core.<table_name> on its business key.
 
-    # Get target table column order
-    target_cols = get_target_column_order(table_name, con)
+    Rows with a new business key are inserted, rows whose row_hash changed
+    replace the stored row, and identical rows are left alone. Returns the
+    counts of each outcome.
+    """
+    bk_cols = list(config.registry.table(table_name).business_key)
+    return _replace_into_core(con, df, table_name, bk_cols)
 
-    # Ensure df has all target columns (add missing as NULL)
-    for col in target_cols:
-        if col not in df.columns:
-            df = df.with_columns(pl.lit(None).cast(pl.Utf8).alias(col))
 
-    # Reorder columns to match target table
-    df = df.select(target_cols)
+class BulkUpserter:
+    """Stage upsert frames per CORE table and write each table in one statement.
 
-    arrow_table = df.to_arrow()
-    con.register("_staging", arrow_table)
+    Frames for the same table are concatenated in staging order; on business
+    key collisions the last staged row wins, exactly as if the files had been
+    upserted one after another.
+    """
 
-    try:
-        # Delete existing rows with matching business keys
-        bk_where = " AND ".join(f"t.{c} = s.{c}" for c in bk_cols)
-        con.execute(f"""
-            DELETE FROM core.{table_name} t
-            WHERE EXISTS (
-                SELECT 1 FROM _staging s WHERE {bk_where}
+    def __init__(self, con: duckdb.DuckDBPyConnection, config: AppConfig):
+        self.con = con
+        self.config = config
+        self._staged: dict[str, list[pl.DataFrame]] = {}
+        self.stats: dict[str, dict] = {}
+
+    @property
+    def pending_rows(self) -> int:
+        return sum(df.height for frames in self._staged.values() for df in frames)
+
+    def add(self, table_name: str, df: pl.DataFrame) -> None:
+        self._staged.setdefault(table_name, []).append(df)
+
+    @property
+    def tables(self) -> list[str]:
+        """Tables with staged frames, in flush order."""
+        return sorted(self._staged)
+
+    def flush_table(self, table_name: str) -> dict[str, UpsertCounts]:
+        """Upsert the frames staged for one table; returns UpsertCounts per source file hash.
+
+        Rows superseded by a later file in the same flush are not written and
+        count for neither file. Runs inside the caller's transaction and raises
+        on failure; the staged frames are dropped either way.
+        """
+        frames = self._staged.pop(table_name)
+        started = time.perf_counter()
+        bk_cols = list(self.config.registry.table(table_name).business_key)
+        if len(frames) == 1:
+            df = frames[0]
+        else:
+            df = pl.concat(frames, how="diagonal_relaxed").unique(
+                subset=bk_cols, keep="last", maintain_order=True
             )
-        """)
+        file_counts = _replace_into_core_by_file(self.con, df, table_name, bk_cols)
+        elapsed = time.perf_counter() - started
+        counts = sum(file_counts.values(), UpsertCounts())
+
+        total = self.stats.setdefault(table_name, {"files": 0, "rows": 0, "seconds": 0.0})
+        total["files"] += len(frames)
+        total["rows"] += counts.rows
+        total["seconds"] += elapsed
+        logger.info(
+            f"  upsert core.{table_name}: {len(frames)} files, {counts.rows} rows "
+            f"({counts.inserted} new, {counts.updated} updated, {counts.unchanged} unchanged) in {elapsed:.2f}s"
+        )
+        return file_counts
 
-        # Insert all rows
-        con.execute(f"INSERT INTO core.{table_name} SELECT * FROM _staging")
-        row_count = len(df)
-    finally:
-        con.unregister("_staging")
 
-    return row_count
+def upsert_core_streaming(
+    con: duckdb.DuckDBPyConnection,
+    lf: pl.LazyFrame,
+    table_name: str,
+    config: AppConfig,
+    batch_id: int,
+    file_hash: str,
+    chunk_rows: int,
+) -> tuple[UpsertCounts, tuple[str, str] | None]:
+    """Upsert a lazily scanned file in chunks of chunk_rows rows.
+
+    Each chunk goes through filter/cast/system columns and the set-based upsert,
+    so peak memory follows chunk_rows rather than the file size. Runs inside
+    the caller's transaction (see CommitGroup), so a failing chunk rolls back
+    together with the rest of the file. The file must already have passed
+    run_lazy_checks (no duplicate business keys). Also returns the file's
+    event period range, merged from the chunks, for rollback pruning.
+    """
+    bk_cols = list(config.registry.table(table_name).business_key)
+    counts = UpsertCounts()
+    period_range: tuple[str, str] | None = None
+
+    for chunk in lf.collect_batches(chunk_size=chunk_rows, engine="streaming"):
+        chunk = filter_columns(chunk, table_name, config)
+        chunk = cast_columns(chunk, table_name, config)
+        chunk = add_system_columns(chunk, batch_id, file_hash, table_name, config)
+        chunk_range = event_period_range(chunk, table_name, config)
+        if chunk_range is not None:
+            period_range = chunk_range if period_range is None else (
+                min(period_range[0], chunk_range[0]), max(period_range[1], chunk_range[1])
+            )
+        chunk = encode_categoricals(chunk, config)
+        counts += _replace_into_core(con, chunk, table_name, bk_cols)
+
+    return counts, period_range
 
 
 def is_file_already_loaded(con: duckdb.DuckDBPyConnection, file_hash: str) -> bool:
     """Check if a file with this hash was already loaded successfully."""
     result = con.execute(
-        "SELECT COUNT(*) FROM raw.system_file_log WHERE file_hash = ? AND status = 'success'",
+        "SELECT COUNT(*) FROM raw.system_loaded_file WHERE file_hash = ?",
         [file_hash]
     ).fetchone()
     return result[0] > 0
 
 
+def get_loaded_hashes(con: duckdb.DuckDBPyConnection, hashes: list[str | None]) -> set[str]:
+    """Return the subset of hashes already loaded successfully, in one query.
+
+    Probes the raw.system_loaded_file primary key with a semi-join, so the
+    cost follows the number of candidates, not the size of the file log.
+    """
+    candidates = sorted({h for h in hashes if h is not None})
+    if not candidates:
+        return set()
+
+    con.register("_candidate_hashes", pl.DataFrame({"file_hash": candidates}).to_arrow())
+    try:
+        rows = con.execute(
+            "SELECT l.file_hash FROM raw.system_loaded_file l "
+            "SEMI JOIN _candidate_hashes c USING (file_hash)"
+        ).fetchall()
+    finally:
+        con.unregister("_candidate_hashes")
+    return {r[0] for r in rows}
+
+
+_FILE_LOG_SCHEMA = {
+    "batch_id": pl.Int64, "file_name": pl.Utf8, "file_hash": pl.Utf8, "table_name": pl.Utf8,
+    "row_count": pl.Int64, "status": pl.Utf8, "error_msg": pl.Utf8, "processed_at": pl.Datetime("us"),
+    "rows_inserted": pl.Int64, "rows_updated": pl.Int64, "rows_unchanged": pl.Int64,
+    "period_min": pl.Utf8, "period_max": pl.Utf8,
+}
+_DQ_REPORT_SCHEMA = {
+    "batch_id": pl.Int64, "file_name": pl.Utf8, "table_name": pl.Utf8, "check_name": pl.Utf8,
+    "severity": pl.Utf8, "passed": pl.Boolean, "detail": pl.Utf8, "checked_at": pl.Datetime("us"),
+}
+
+
+class LogBuffer:
+    """Columnar buffer for raw.system_file_log and raw.system_dq_report rows.
+
+    Rows are timestamped when recorded and written with one Arrow-registered
+    INSERT per table on flush(), instead of one statement per row. With
+    register_loaded=False (dry runs) successful files are logged but not
+    entered into raw.system_loaded_file, so a later real run still loads them.
+    """
+
+    def __init__(self, register_loaded: bool = True):
+        self.register_loaded = register_loaded
+        self.file_rows: dict[str, list] = {c: [] for c in _FILE_LOG_SCHEMA}
+        self.dq_rows: dict[str, list] = {c: [] for c in _DQ_REPORT_SCHEMA}
+
+    def __len__(self) -> int:
+        return len(self.file_rows["batch_id"]) + len(self.dq_rows["batch_id"])
+
+    def add_file(
+        self,
+        batch_id: int,
+        file_name: str,
+        file_hash: str,
+        table_name: str | None,
+        row_count: int,
+        status: str,
+        error_msg: str | None = None,
+        counts: UpsertCounts | None = None,
+        period_range: tuple[str, str] | None = None,
+    ) -> None:
+        row = (
+            batch_id, file_name, file_hash, table_name, row_count, status, error_msg, datetime.now(),
+            *((counts.inserted, counts.updated, counts.unchanged) if counts else (None, None, None)),
+            *(period_range or (None, None)),
+        )
+        for col, value in zip(_FILE_LOG_SCHEMA, row):
+            self.file_rows[col].append(value)
+
+    def add_dq(self, batch_id: int, file_name: str, table_name: str, results: list[DQResult]) -> None:
+        now = datetime.now()
+        for r in results:
+            row = (batch_id, file_name, table_name, r.check_name, r.severity, r.passed, r.detail, now)
+            for col, value in zip(_DQ_REPORT_SCHEMA, row):
+                self.dq_rows[col].append(value)
+
+    def clear(self) -> None:
+        for values in (*self.file_rows.values(), *self.dq_rows.values()):
+            values.clear()
+
+    def flush(self, con: duckdb.DuckDBPyConnection) -> None:
+        """Write buffered rows (successful loads also enter the loaded-file registry, unless disabled)."""
+        if self.file_rows["batch_id"]:
+            cols = ", ".join(_FILE_LOG_SCHEMA)
+            frame = pl.DataFrame(self.file_rows, schema=_FILE_LOG_SCHEMA)
+            con.register("_file_log_buffer", frame.to_arrow())
+            try:
+                con.execute(f"INSERT INTO raw.system_file_log ({cols}) SELECT {cols} FROM _file_log_buffer")
+                if self.register_loaded:
+                    con.execute("""
+                        INSERT OR IGNORE INTO raw.system_loaded_file (file_hash, batch_id, file_name, loaded_at)
+                        SELECT file_hash, FIRST(batch_id), FIRST(file_name), FIRST(processed_at)
+                        FROM _file_log_buffer
+                        WHERE status = 'success'
+                        GROUP BY file_hash
+                    """)
+            finally:
+                con.unregister("_file_log_buffer")
+
+        if self.dq_rows["batch_id"]:
+            cols = ", ".join(_DQ_REPORT_SCHEMA)
+            frame = pl.DataFrame(self.dq_rows, schema=_DQ_REPORT_SCHEMA)
+            con.register("_dq_report_buffer", frame.to_arrow())
+            try:
+                con.execute(f"INSERT INTO raw.system_dq_report ({cols}) SELECT {cols} FROM _dq_report_buffer")
+            finally:
+                con.unregister("_dq_report_buffer")
+        self.clear()
+
+
 def log_file(
     con: duckdb.DuckDBPyConnection,
     batch_id: int,
@@ -239,13 +919,22 @@ def log_file(
     row_count: int,
     status: str,
     error_msg: str | None = None,
+    logs: LogBuffer | None = None,
+    counts: UpsertCounts | None = None,
+    period_range: tuple[str, str] | None = None,
 ) -> None:
-    """Log file processing result."""
-    con.execute(
-        "INSERT INTO raw.system_file_log (batch_id, file_name, file_hash, table_name, row_count, status, error_msg) "
-        "VALUES (?, ?, ?, ?, ?, ?, ?)",
-        [batch_id, file_name, file_hash, table_name, row_count, status, error_msg]
+    """Log file processing result (buffered when a LogBuffer is given).
+
+    counts (inserted/updated/unchanged rows) is None for dry runs, which
+    write nothing.
+    period_range feeds rollback pruning (src.periods.batch_periods).
+    """
+    buffer = logs if logs is not None else LogBuffer()
+    buffer.add_file(
+        batch_id, file_name, file_hash, table_name, row_count, status, error_msg, counts, period_range
     )
+    if logs is None:
+        buffer.flush(con)
 
 
 def log_dq_results(
@@ -254,14 +943,372 @@ def log_dq_results(
     file_name: str,
     table_name: str,
     results: list[DQResult],
+    logs: LogBuffer | None = None,
 ) -> None:
-    """Log DQ check results."""
-    for r in results:
+    """Log DQ check results (buffered when a LogBuffer is given)."""
+    buffer = logs if logs is not None else LogBuffer()
+    buffer.add_dq(batch_id, file_name, table_name, results)
+    if logs is None:
+        buffer.flush(con)
+
+
+def prepare_file(
+    file_path: Path,
+    config: AppConfig,
+    batch_id: int,
+    file_hash: str | None = None,
+    quarantine: bool = False,
+    sheet: str | None = None,
+) -> PreparedFile:
+    """Run the CPU-heavy stages for one file: hash, read, detect, alias, DQ, cast, encode.
+
+    Never touches the database, so it is safe to run in a worker thread.
+    Failures are captured on the returned PreparedFile instead of raised.
+    With quarantine=True, row-level DQ failures split off the offending rows
+    instead of rejecting the file (streamed files are still all-or-nothing).
+    With a sheet, only that worksheet is read, under its logical sheet hash.
+    """
+    prepared = PreparedFile(file_path=file_path, sheet=sheet)
+    try:
+        prepared.file_hash = file_hash or sheet_hash(compute_file_hash(file_path), sheet)
+
+        # Detect from the header alone so unrecognized files fail before a full read
+        header = read_header(file_path, sheet)
+        if not header:
+            prepared.status = "skipped"
+            prepared.error = "Empty file"
+            return prepared
+
+        table_name = detect_table_type_from_columns(header, config)
+        prepared.table_name = table_name
+
+        if use_streaming(file_path, config):
+            return _prepare_streaming(prepared, config)
+
+        df = read_file(file_path, sheet)
+        if df.height == 0:
+            prepared.status = "skipped"
+            prepared.error = "Empty file"
+            return prepared
+
+        df = apply_aliases(df, table_name, config)
+        df = conform_typed_columns(df, table_name, config)
+
+        # One pass: DQ counts and the schema casts share the same cast columns
+        raw_df = df
+        prepared.dq_results, df = run_fused_checks(df, table_name, config)
+        if has_failures(prepared.dq_results):
+            if quarantine:
+                df = _split_quarantine(prepared, raw_df, df, config)
+            if prepared.quarantine is None:
+                failed = [r for r in prepared.dq_results if not r.passed and r.severity in ("CRITICAL", "HIGH")]
+                prepared.status = "dq_failed"
+                prepared.error = prepared.error or "; ".join(r.detail for r in failed)
+                return prepared
+
+        df = filter_columns(df, table_name, config)
+        df = cast_columns(df, table_name, config)
+        df = add_system_columns(df, batch_id, prepared.file_hash, table_name, config)
+        prepared.period_range = event_period_range(df, table_name, config)
+        prepared.df = encode_categoricals(df, config)
+        prepared.status = "ready"
+
+    except Exception as e:
+        prepared.status = "error"
+        prepared.error = str(e)
+
+    return prepared
+
+
+def _quarantine_limit(config: AppConfig, key: str, table_name: str) -> float:
+    limits = config.get_threshold("quarantine", key)
+    return limits.get(table_name, limits["default"])
+
+
+def _split_quarantine(
+    prepared: PreparedFile, raw_df: pl.DataFrame, cast_df: pl.DataFrame, config: AppConfig
+) -> pl.DataFrame:
+    """Move rows failing row-level DQ to prepared.quarantine and return the clean rows.
+
+    Leaves prepared.quarantine unset (the file fails as a whole) when a failed
+    check cannot be pinned on rows, e.g. a missing required column, or when
+    the quarantined rows exceed the thresholds.yaml quarantine limits.
+    """
+    table_name = prepared.table_name
+    rules = raw_df.select(quarantine_rule_expr(raw_df.schema, table_name, config)).to_series()
+    bad = rules.is_not_null()
+    n_bad = int(bad.sum())
+
+    failed = {r.check_name for r in prepared.dq_results if not r.passed and r.severity in ("CRITICAL", "HIGH")}
+    flagged = set(rules.drop_nulls().str.split(",").explode().unique().to_list())
+    if not failed <= flagged:
+        return cast_df
+
+    max_ratio = _quarantine_limit(config, "max_row_ratio", table_name)
+    max_rows = _quarantine_limit(config, "max_rows", table_name)
+    if n_bad > max_rows or n_bad > max_ratio * raw_df.height:
+        prepared.error = (
+            f"Quarantine limit exceeded: {n_bad} of {raw_df.height} rows failed row-level DQ "
+            f"(max_row_ratio={max_ratio}, max_rows={max_rows})"
+        )
+        return cast_df
+
+    prepared.quarantine = (
+        raw_df.select(
+            pl.int_range(pl.len(), dtype=pl.Int64).alias("row_index"),
+            rules,
+            pl.struct(pl.all()).struct.json_encode().alias("row_data"),
+        )
+        .filter(bad)
+    )
+    return cast_df.filter(~bad)
+
+
+def write_quarantine(
+    con: duckdb.DuckDBPyConnection,
+    quarantined: pl.DataFrame,
+    table_name: str,
+    batch_id: int,
+    file_name: str,
+    file_hash: str,
+) -> int:
+    """Insert quarantined rows into raw.quarantine_<table>. Returns the row count."""
+    con.register("_quarantine", quarantined.to_arrow())
+    try:
         con.execute(
-            "INSERT INTO raw.system_dq_report (batch_id, file_name, table_name, check_name, severity, passed, detail) "
-            "VALUES (?, ?, ?, ?, ?, ?, ?)",
-            [batch_id, file_name, table_name, r.check_name, r.severity, r.passed, r.detail]
+            f"INSERT INTO raw.quarantine_{table_name} (batch_id, file_name, file_hash, row_index, rule, row_data) "
+            "SELECT ?, ?, ?, row_index, rule, row_data FROM _quarantine",
+            [batch_id, file_name, file_hash],
         )
+    finally:
+        con.unregister("_quarantine")
+    return quarantined.height
+
+
+def _prepare_streaming(prepared: PreparedFile, config: AppConfig) -> PreparedFile:
+    """Streaming variant of prepare_file: DQ in one lazy pass, no full read."""
+    table_name = prepared.table_name
+    lf = apply_aliases(scan_csv_lazy(prepared.file_path), table_name, config)
+    prepared.dq_results, prepared.row_count = run_lazy_checks(lf, table_name, config)
+
+    if prepared.row_count == 0:
+        prepared.status = "skipped"
+        prepared.error = "Empty file"
+    elif has_failures(prepared.dq_results):
+        failed = [r for r in prepared.dq_results if not r.passed and r.severity in ("CRITICAL", "HIGH")]
+        prepared.status = "dq_failed"
+        prepared.error = "; ".join(r.detail for r in failed)
+    else:
+        prepared.lazy = lf
+        prepared.status = "stream"
+    return prepared
+
+
+def commit_file(
+    con: duckdb.DuckDBPyConnection,
+    prepared: PreparedFile,
+    config: AppConfig,
+    batch_id: int,
+    dry_run: bool = False,
+    upserter: BulkUpserter | None = None,
+    logs: LogBuffer | None = None,
+) -> dict:
+    """Write a prepared file: DQ log, CORE upsert and file log (writer side only).
+
+    With an upserter the frame is only staged: the result comes back with
+    status "staged" and nothing is written until the upserter flushes
+    (_flush_staged). Returns a dict with processing result info.
+    """
+    file_name = prepared.name
+    result = {
+        "file": file_name,
+        "status": prepared.status,
+        "table": prepared.table_name,
+        "rows": 0,
+        "error": prepared.error,
+    }
+
+    if prepared.status == "error":
+        return _record_error(con, batch_id, result, prepared.error, logs)
+
+    try:
+        if upserter is not None and prepared.status == "ready" and not dry_run:
+            upserter.add(prepared.table_name, prepared.df)
+            result["status"] = "staged"
+            result["rows"] = prepared.df.height
+            return result
+
+        if prepared.dq_results:
+            log_dq_results(con, batch_id, file_name, prepared.table_name, prepared.dq_results, logs)
+
+        if prepared.status in ("skipped", "dq_failed"):
+            log_file(
+                con, batch_id, file_name, prepared.file_hash, prepared.table_name, 0,
+                prepared.status, prepared.error, logs,
+            )
+            return result
+
+        counts = None
+        if dry_run:
+            row_count = prepared.row_count if prepared.status == "stream" else prepared.df.height
+        else:
+            counts = _write_file(con, prepared, config, batch_id)
+            row_count = counts.rows
+
+        result["status"] = "success"
+        result["rows"] = row_count
+        log_file(
+            con, batch_id, file_name, prepared.file_hash, prepared.table_name, row_count, "success",
+            _quarantine_note(prepared), logs, counts, prepared.period_range,
+        )
+
+    except Exception as e:
+        return _record_error(con, batch_id, result, str(e), logs)
+
+    return result
+
+
+def _write_file(
+    con: duckdb.DuckDBPyConnection, prepared: PreparedFile, config: AppConfig, batch_id: int
+) -> UpsertCounts:
+    """CORE upsert (streamed or in-memory) plus quarantined rows of one file.
+
+    A streamed file gets its period_range here, once its chunks are read.
+    """
+    if prepared.status == "stream":
+        chunk_rows = config.ingest.get("streaming", {}).get("chunk_rows", 500_000)
+        counts, prepared.period_range = upsert_core_streaming(
+            con, prepared.lazy, prepared.table_name, config, batch_id,
+            prepared.file_hash, chunk_rows,
+        )
+    else:
+        counts = upsert_core(con, prepared.df, prepared.table_name, config)
+    _commit_quarantine(con, prepared, batch_id)
+    return counts
+
+
+class CommitGroup:
+    """Explicit DuckDB transaction around the writes of one or more files.
+
+    Each file's CORE upsert, quarantined rows, DQ log and file log commit
+    together: a crash never leaves a file half applied, and grouping several
+    small files per COMMIT saves fsyncs. DuckDB has no SAVEPOINT, so when a
+    file fails inside a group the transaction is rolled back and the files
+    that already succeeded in it are written again in a fresh one; their log
+    rows (and the failed file's) are still buffered and commit with them.
+    Files staged for a bulk upsert write nothing here (see _flush_staged).
+    """
+
+    def __init__(self, con: duckdb.DuckDBPyConnection, logs: LogBuffer, size: int = 1):
+        self.con = con
+        self.logs = logs
+        self.size = max(1, size)
+        self.active = False
+        # Files written in the open transaction
+        self.members: list[PreparedFile] = []
+
+    def _begin(self) -> None:
+        if not self.active:
+            self.con.execute("BEGIN TRANSACTION")
+            self.active = True
+
+    def add(
+        self,
+        prepared: PreparedFile,
+        config: AppConfig,
+        batch_id: int,
+        dry_run: bool = False,
+        upserter: BulkUpserter | None = None,
+    ) -> dict:
+        """commit_file inside the group's transaction; commits once the group is full."""
+        self._begin()
+        result = commit_file(self.con, prepared, config, batch_id, dry_run, upserter, self.logs)
+
+        if result["status"] == "error" and prepared.status != "error":
+            self._recover(config, batch_id)
+            return result
+
+        if result["status"] == "success" and not dry_run:
+            self.members.append(prepared)
+        # A streamed file is large enough to be a group of its own
+        if len(self.members) >= self.size or prepared.status == "stream":
+            self.commit()
+        return result
+
+    def _recover(self, config: AppConfig, batch_id: int) -> None:
+        self.con.execute("ROLLBACK")
+        self.active = False
+        survivors, self.members = self.members, []
+        self._begin()
+        for prepared in survivors:
+            _write_file(self.con, prepared, config, batch_id)
+        self.commit()
+
+    def commit(self) -> None:
+        """Write buffered log rows and COMMIT (log rows alone also get a transaction)."""
+        if not self.active and not len(self.logs):
+            return
+        self._begin()
+        self.logs.flush(self.con)
+        self.con.execute("COMMIT")
+        self.active = False
+        self.members.clear()
+
+    def abort(self) -> None:
+        """On an unexpected failure: roll back an open group and drop its log rows.
+
+        Without an open transaction the buffered rows describe writes that
+        already happened (or none), so they are committed instead.
+        """
+        if self.active:
+            self.con.execute("ROLLBACK")
+            self.active = False
+            self.members.clear()
+            self.logs.clear()
+        else:
+            self.commit()
+
+
+def _commit_quarantine(con: duckdb.DuckDBPyConnection, prepared: PreparedFile, batch_id: int) -> None:
+    if prepared.quarantine is not None:
+        write_quarantine(
+            con, prepared.quarantine, prepared.table_name, batch_id,
+            prepared.name, prepared.file_hash,
+        )
+
+
+def _quarantine_note(prepared: PreparedFile) -> str | None:
+    """file_log error_msg for a file loaded with quarantined rows."""
+    if prepared.quarantine is None:
+        return None
+    return f"{prepared.quarantine.height} rows quarantined to raw.quarantine_{prepared.table_name}"
+
+
+def _record_error(
+    con: duckdb.DuckDBPyConnection, batch_id: int, result: dict, error: str, logs: LogBuffer | None = None
+) -> dict:
+    """Mark a result as failed and log it (best effort)."""
+    result["status"] = "error"
+    result["error"] = error
+    logger.error(f"Error processing {result['file']}: {error}")
+    try:
+        log_file(con, batch_id, result["file"], "", None, 0, "error", error, logs)
+    except Exception:
+        pass
+    return result
+
+
+# Skip reason of files whose hash was already loaded (archived as duplicates)
+ALREADY_LOADED_ERROR = "File already loaded (same hash)"
+
+
+def _skip_loaded_file(
+    con: duckdb.DuckDBPyConnection, batch_id: int, file_name: str, file_hash: str, logs: LogBuffer | None = None
+) -> dict:
+    """Record a file whose hash was already loaded successfully."""
+    error = ALREADY_LOADED_ERROR
+    log_file(con, batch_id, file_name, file_hash, None, 0, "skipped", error, logs)
+    return {"file": file_name, "status": "skipped", "table": None, "rows": 0, "error": error}
 
 
 def process_file(
@@ -270,79 +1317,407 @@ def process_file(
     config: AppConfig,
     batch_id: int,
     dry_run: bool = False,
+    quarantine: bool = False,
 ) -> dict:
     """Process a single file through the ETL pipeline.
 
     Returns a dict with processing result info.
     """
-    file_name = file_path.name
-    result = {"file": file_name, "status": "pending", "table": None, "rows": 0, "error": None}
-
     try:
-        # 1. Compute file hash
         file_hash = compute_file_hash(file_path)
-
-        # 2. Check if already loaded
         if is_file_already_loaded(con, file_hash):
-            result["status"] = "skipped"
-            result["error"] = "File already loaded (same hash)"
-            log_file(con, batch_id, file_name, file_hash, None, 0, "skipped", result["error"])
-            return result
+            return _skip_loaded_file(con, batch_id, file_path.name, file_hash)
+    except Exception as e:
+        prepared = PreparedFile(file_path=file_path, status="error", error=str(e))
+        return commit_file(con, prepared, config, batch_id, dry_run=dry_run)
 
-        # 3. Read file
-        df = read_file(file_path)
-        if df.height == 0:
-            result["status"] = "skipped"
-            result["error"] = "Empty file"
-            log_file(con, batch_id, file_name, file_hash, None, 0, "skipped", result["error"])
-            return result
+    prepared = prepare_file(file_path, config, batch_id, file_hash=file_hash, quarantine=quarantine)
+    group = CommitGroup(con, LogBuffer(register_loaded=not dry_run))
+    try:
+        result = group.add(prepared, config, batch_id, dry_run)
+        group.commit()
+    except BaseException:
+        group.abort()
+        raise
+    return result
 
-        # 4. Detect table type
-        table_name = detect_table_type(df, config)
-        result["table"] = table_name
 
-        # 5. Apply column aliases
-        df = apply_aliases(df, table_name, config)
+def _hash_or_none(path: Path) -> str | None:
+    """compute_file_hash that defers read errors to prepare time (reported per file)."""
+    try:
+        return compute_file_hash(path)
+    except OSError:
+        return None
 
-        # 6. Run DQ checks
-        dq_results = run_all_checks(df, table_name, config)
-        log_dq_results(con, batch_id, file_name, table_name, dq_results)
 
-        if has_failures(dq_results):
-            failed = [r for r in dq_results if not r.passed and r.severity in ("CRITICAL", "HIGH")]
-            error_detail = "; ".join(r.detail for r in failed)
-            result["status"] = "dq_failed"
-            result["error"] = error_detail
-            log_file(con, batch_id, file_name, file_hash, table_name, 0, "dq_failed", error_detail)
-            return result
+def _prepare_in_order(
+    pool: ThreadPoolExecutor,
+    units: list[tuple[Path, str | None]],
+    hashes: list[str | None],
+    loaded: set[str],
+    config: AppConfig,
+    batch_id: int,
+    workers: int,
+    quarantine: bool = False,
+) -> Iterator[PreparedFile]:
+    """Yield PreparedFiles in input order with at most 2 x workers files in flight.
 
-        # 7. Filter to known columns and cast types
-        df = filter_columns(df, table_name, config)
-        df = cast_columns(df, table_name, config)
+    Files whose hash is already loaded are not read at all.
+    """
+    in_flight: deque[Future] = deque()
+    window = 2 * workers
+
+    for (file_path, sheet), file_hash in zip(units, hashes):
+        if file_hash in loaded:
+            done: Future = Future()
+            done.set_result(
+                PreparedFile(file_path=file_path, sheet=sheet, file_hash=file_hash, status="already_loaded")
+            )
+            in_flight.append(done)
+        else:
+            in_flight.append(
+                pool.submit(prepare_file, file_path, config, batch_id, file_hash, quarantine, sheet)
+            )
+        if len(in_flight) >= window:
+            yield in_flight.popleft().result()
 
-        # 8. Add system columns
-        df = add_system_columns(df, batch_id, file_hash, table_name, config)
+    while in_flight:
+        yield in_flight.popleft().result()
 
-        # 9. Upsert into CORE
-        if not dry_run:
-            row_count = upsert_core(con, df, table_name, config, batch_id, file_hash)
-        else:
-            row_count = df.height
 
-        result["status"] = "success"
-        result["rows"] = row_count
-        log_file(con, batch_id, file_name, file_hash, table_name, row_count, "success")
+def _prepare_sequential(
+    units: list[tuple[Path, str | None]],
+    hashes: list[str | None],
+    loaded: set[str],
+    config: AppConfig,
+    batch_id: int,
+    quarantine: bool = False,
+) -> Iterator[PreparedFile]:
+    """Yield PreparedFiles one at a time on the calling thread."""
+    for (file_path, sheet), file_hash in zip(units, hashes):
+        if file_hash in loaded:
+            yield PreparedFile(file_path=file_path, sheet=sheet, file_hash=file_hash, status="already_loaded")
+            continue
+        yield prepare_file(file_path, config, batch_id, file_hash, quarantine, sheet)
 
-    except Exception as e:
-        result["status"] = "error"
-        result["error"] = str(e)
-        logger.error(f"Error processing {file_name}: {e}")
+
+_PREFETCH_DONE = object()
+
+
+def _prefetch(prepared_files: Iterator[PreparedFile], depth: int) -> Iterator[PreparedFile]:
+    """Run a prepare iterator on a reader thread, at most `depth` files ahead.
+
+    The bounded queue caps memory at depth prepared files (plus the one being
+    prepared and the one being committed). Files come out in the order the
+    iterator yields them. If the consumer stops early, the reader stops too.
+    """
+    queue: Queue = Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce() -> None:
         try:
-            log_file(con, batch_id, file_name, "", None, 0, "error", str(e))
-        except Exception:
+            for prepared in prepared_files:
+                if not put(prepared):
+                    return
+        except BaseException as e:
+            put(e)
+        else:
+            put(_PREFETCH_DONE)
+
+    reader = threading.Thread(target=produce, name="ingest-reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is _PREFETCH_DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        try:
+            while True:
+                queue.get_nowait()
+        except Empty:
             pass
+        reader.join()
 
-    return result
+
+def _log_result(r: dict) -> None:
+    logger.info(f"  {r['file']}: {r['status']} ({r['rows']} rows) -> {r['table']}")
+
+
+def _flush_staged(
+    con: duckdb.DuckDBPyConnection,
+    upserter: BulkUpserter,
+    staged: list[tuple[dict, PreparedFile]],
+    batch_id: int,
+    logs: LogBuffer,
+) -> set[str]:
+    """Flush the upserter one CORE table per transaction and finalize the staged files.
+
+    A table's upsert commits together with the quarantined rows, DQ log and
+    file log of the files staged for it. If any of it fails, the transaction
+    rolls back and those files are logged as errors (with their DQ results)
+    in a fresh one; the other tables still flush. Expects no open transaction
+    and an empty log buffer. Returns the hashes of the files committed.
+    """
+    by_table: dict[str, list[tuple[dict, PreparedFile]]] = {}
+    for r, prepared in staged:
+        by_table.setdefault(prepared.table_name, []).append((r, prepared))
+    staged.clear()
+
+    loaded: set[str] = set()
+    for table_name in upserter.tables:
+        files = by_table.get(table_name, [])
+        con.execute("BEGIN TRANSACTION")
+        try:
+            for r, prepared in files:
+                _commit_quarantine(con, prepared, batch_id)
+                if prepared.dq_results:
+                    log_dq_results(con, batch_id, r["file"], table_name, prepared.dq_results, logs)
+            file_counts = upserter.flush_table(table_name)
+            for r, prepared in files:
+                log_file(
+                    con, batch_id, r["file"], prepared.file_hash, table_name, r["rows"], "success",
+                    _quarantine_note(prepared), logs, file_counts.get(prepared.file_hash, UpsertCounts()),
+                    prepared.period_range,
+                )
+            logs.flush(con)
+            con.execute("COMMIT")
+        except Exception as e:
+            con.execute("ROLLBACK")
+            logs.clear()
+            logger.error(f"  upsert core.{table_name} failed: {e}")
+            con.execute("BEGIN TRANSACTION")
+            for r, prepared in files:
+                r["rows"] = 0
+                if prepared.dq_results:
+                    log_dq_results(con, batch_id, r["file"], table_name, prepared.dq_results, logs)
+                _record_error(con, batch_id, r, str(e), logs)
+            logs.flush(con)
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            logs.clear()
+            raise
+        else:
+            for r, prepared in files:
+                r["status"] = "success"
+                loaded.add(prepared.file_hash)
+        for r, _ in files:
+            _log_result(r)
+    return loaded
+
+
+def _commit_in_order(
+    con: duckdb.DuckDBPyConnection,
+    prepared_files: Iterator[PreparedFile],
+    config: AppConfig,
+    batch_id: int,
+    dry_run: bool,
+    upserter: BulkUpserter | None,
+) -> list[dict]:
+    """Commit prepared files in the order they are yielded (single writer).
+
+    Writes go through a CommitGroup of ingest.yaml transactions.files_per_commit
+    files; file and DQ log rows are buffered and committed with their group.
+    The upserter flushes (bulk mode) run between groups, one transaction per
+    table. A staged file only counts as committed once its table's flush
+    commits; until then it still shadows later duplicates in the batch.
+    """
+    results = []
+    committed: set[str] = set()
+    staged: list[tuple[dict, PreparedFile]] = []
+    pending: set[str] = set()
+    group_size = config.ingest.get("transactions", {}).get("files_per_commit", 1)
+    group = CommitGroup(con, LogBuffer(register_loaded=not dry_run), group_size)
+    logs = group.logs
+
+    def flush_staged() -> None:
+        group.commit()
+        committed.update(_flush_staged(con, upserter, staged, batch_id, logs))
+        pending.clear()
+
+    try:
+        for prepared in prepared_files:
+            if (
+                prepared.status == "already_loaded"
+                or prepared.file_hash in committed
+                or prepared.file_hash in pending
+            ):
+                r = _skip_loaded_file(con, batch_id, prepared.name, prepared.file_hash, logs)
+            else:
+                if prepared.status == "stream" and staged:
+                    # Streamed files bypass the upserter; keep sorted-order semantics.
+                    flush_staged()
+                r = group.add(prepared, config, batch_id, dry_run, upserter)
+                if r["status"] == "success":
+                    committed.add(prepared.file_hash)
+            results.append(r)
+
+            if r["status"] == "staged":
+                staged.append((r, prepared))
+                pending.add(prepared.file_hash)
+                if upserter.pending_rows >= BULK_FLUSH_ROWS:
+                    flush_staged()
+            else:
+                _log_result(r)
+
+        if upserter is not None:
+            flush_staged()
+        group.commit()
+    except BaseException:
+        group.abort()
+        raise
+
+    return results
+
+
+def archive_settings(config: AppConfig) -> dict:
+    """ingest.yaml `archive` section with defaults filled in."""
+    settings = config.ingest.get("archive", {}) or {}
+    return {
+        "dir": Path(settings.get("dir", "archive")),
+        "rejected_dir": Path(settings.get("rejected_dir", "rejected")),
+        "compress": settings.get("compress") or None,
+    }
+
+
+def _split_format_suffix(name: str) -> tuple[str, str]:
+    """("orders", ".csv.gz") for "orders.csv.gz" (longest inbox format suffix)."""
+    lower = name.lower()
+    for suffix in sorted(INBOX_FORMATS, key=len, reverse=True):
+        if lower.endswith(suffix):
+            return name[: -len(suffix)], name[-len(suffix):]
+    return name, ""
+
+
+def archive_file(path: Path, dest_dir: Path, batch_id: int, compress: str | None = None) -> Path:
+    """Move an inbox file into dest_dir and return its new path.
+
+    With compress="zstd", plain and gzip CSVs are rewritten as .csv.zst (still
+    a valid inbox format); other files are moved as they are. A name already
+    taken in dest_dir gets the batch id appended to its stem.
+    """
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    stem, suffix = _split_format_suffix(path.name)
+    recompress = compress == "zstd" and suffix.lower() in (".csv", ".csv.gz")
+    if recompress:
+        suffix = ".csv.zst"
+    dest = dest_dir / f"{stem}{suffix}"
+    if dest.exists():
+        dest = dest_dir / f"{stem}.b{batch_id}{suffix}"
+
+    if not recompress:
+        shutil.move(str(path), str(dest))
+        return dest
+
+    tmp = dest.with_name(dest.name + ".tmp")
+    try:
+        with _open_csv_stream(path) as src, pa.output_stream(str(tmp), compression="zstd") as out:
+            while chunk := src.read(HASH_READ_SIZE):
+                out.write(chunk)
+        os.replace(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    path.unlink()
+    return dest
+
+
+def _archive_dir(settings: dict, results: list[dict], day: str) -> Path:
+    """Destination folder of an inbox file from the results of its units.
+
+    <rejected>/<day> when any unit failed (DQ failures, errors), so a workbook
+    with one failed sheet is not archived with its loaded ones; otherwise
+    archive/<table>/<day> when a unit loaded, archive/_duplicate/<day> when
+    every unit was skipped as already loaded, and <rejected>/<day> for empty
+    files.
+    """
+    if any(r["status"] not in ("success", "skipped") for r in results):
+        return settings["rejected_dir"] / day
+    tables = [r["table"] for r in results if r["status"] == "success"]
+    if tables:
+        return settings["dir"] / tables[0] / day
+    if all(r["status"] == "skipped" and r.get("error") == ALREADY_LOADED_ERROR for r in results):
+        return settings["dir"] / "_duplicate" / day
+    return settings["rejected_dir"] / day
+
+
+def archive_files(
+    con: duckdb.DuckDBPyConnection,
+    config: AppConfig,
+    batch_id: int,
+    units: list[tuple[Path, str | None]],
+    results: list[dict],
+) -> None:
+    """Move committed inbox files out of the inbox (post-commit step).
+
+    Files whose units all loaded or were skipped go to archive/<table>/<date>/
+    (or archive/_duplicate/ when all were duplicates of earlier loads); files
+    with a unit rejected by DQ or an error, and empty files, go to the
+    rejected folder. The new path is stored as archive_path on the file's
+    raw.system_file_log rows and on the result dicts, and the file's hash
+    cache row is dropped; these log writes run in one transaction after the
+    moves. A file that cannot be moved stays in the inbox (warning) and keeps
+    its log rows and cache entry as they are.
+    """
+    settings = archive_settings(config)
+    day = datetime.now(UTC).date().isoformat()
+    names = {sheet_file_name(f, sheet): f for f, sheet in units}
+    by_file: dict[Path, list[dict]] = {}
+    for r in results:
+        if r["file"] in names:
+            by_file.setdefault(names[r["file"]], []).append(r)
+
+    moved: list[tuple[str, Path, list[dict]]] = []
+    for f, unit_results in by_file.items():
+        cache_path = str(f.resolve())
+        try:
+            dest = archive_file(f, _archive_dir(settings, unit_results, day), batch_id, settings["compress"])
+        except OSError as e:
+            logger.warning(f"Could not archive {f.name}, left in inbox: {e}")
+            continue
+        moved.append((cache_path, dest, unit_results))
+        logger.info(f"  {f.name}: archived to {dest}")
+    if not moved:
+        return
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        for cache_path, dest, unit_results in moved:
+            file_names = [r["file"] for r in unit_results]
+            placeholders = ", ".join("?" * len(file_names))
+            con.execute(
+                f"UPDATE raw.system_file_log SET archive_path = ? WHERE batch_id = ? AND file_name IN ({placeholders})",
+                [str(dest), batch_id, *file_names],
+            )
+            con.execute("DELETE FROM raw.system_file_hash_cache WHERE file_path = ?", [cache_path])
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    for _, dest, unit_results in moved:
+        for r in unit_results:
+            r["archive_path"] = str(dest)
+
+
+def _unit_hashes(
+    units: list[tuple[Path, str | None]], files: list[Path], file_hashes: list[str | None]
+) -> list[str | None]:
+    by_path = dict(zip(files, file_hashes))
+    return [sheet_hash(by_path[f], sheet) for f, sheet in units]
 
 
 def ingest_all(
@@ -351,29 +1726,65 @@ def ingest_all(
     inbox_dir: Path | None = None,
     dry_run: bool = False,
     batch_id: int = 0,
+    workers: int = 1,
+    bulk: bool = False,
+    quarantine: bool = False,
+    prefetch: int = 0,
+    files: list[Path] | None = None,
+    archive: bool = False,
 ) -> list[dict]:
     """Ingest all files from inbox/ directory.
 
-    Files are processed in sorted order for determinism.
+    Files are processed in sorted order for determinism. With workers > 1 the
+    CPU-heavy stages run in a thread pool; upserts and log writes stay on the
+    single DuckDB connection and still commit in sorted order. With bulk=True
+    the frames are grouped per CORE table and upserted once per table. With
+    quarantine=True, rows failing row-level DQ go to raw.quarantine_<table>
+    and the rest of the file is loaded (see thresholds.yaml quarantine).
+    With a single worker and prefetch > 0, a reader thread prepares up to
+    `prefetch` files ahead while the writer commits (the worker pool already
+    overlaps the two). `files` restricts the batch to the given paths instead
+    of scanning the inbox (the --watch micro-batches). With archive=True,
+    processed files are moved out of the inbox after commit (archive_files).
     """
-    inbox = inbox_dir or INBOX_DIR
-    if not inbox.exists():
-        logger.info(f"Inbox directory does not exist: {inbox}")
-        return []
+    if files is None:
+        inbox = inbox_dir or INBOX_DIR
+        if not inbox.exists():
+            logger.info(f"Inbox directory does not exist: {inbox}")
+            return []
+        files = [f for f in inbox.iterdir() if f.is_file() and inbox_format(f) is not None]
+        if not dry_run:
+            prune_file_hash_cache(con, inbox, files)
 
-    files = sorted(
-        [f for f in inbox.iterdir() if f.is_file() and f.suffix.lower() in (".csv", ".xlsx", ".xls")],
-        key=lambda f: f.name
-    )
+    files = sorted(files, key=lambda f: f.name)
 
     if not files:
         logger.info("No files found in inbox/")
         return []
 
-    results = []
-    for file_path in files:
-        r = process_file(con, file_path, config, batch_id, dry_run=dry_run)
-        results.append(r)
-        logger.info(f"  {r['file']}: {r['status']} ({r['rows']} rows) -> {r['table']}")
+    upserter = BulkUpserter(con, config) if bulk else None
+
+    # Workbooks may fan out into one logical file per worksheet
+    units = [(f, sheet) for f in files for sheet in select_sheets(f, config)]
+
+    if workers <= 1:
+        hashes = _unit_hashes(units, files, resolve_file_hashes(con, files, update_cache=not dry_run))
+        loaded = get_loaded_hashes(con, hashes)
+        prepared_files = _prepare_sequential(units, hashes, loaded, config, batch_id, quarantine)
+        if prefetch > 0:
+            prepared_files = _prefetch(prepared_files, prefetch)
+        results = _commit_in_order(con, prepared_files, config, batch_id, dry_run, upserter)
+    else:
+        # Threads (not processes): Polars and hashlib release the GIL for the
+        # heavy work, and the config/DataFrames need no pickling.
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest") as pool:
+            hashes = _unit_hashes(units, files, resolve_file_hashes(con, files, pool, not dry_run))
+            loaded = get_loaded_hashes(con, hashes)
+            prepared_files = _prepare_in_order(
+                pool, units, hashes, loaded, config, batch_id, workers, quarantine
+            )
+            results = _commit_in_order(con, prepared_files, config, batch_id, dry_run, upserter)
 
+    if archive and not dry_run:
+        archive_files(con, config, batch_id, units, results)
     return results
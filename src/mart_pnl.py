@@ -376,6 +376,19 @@ def build_mart_pnl_contribution(con: duckdb.DuckDBPyConnection, config: AppConfi
             con.register("_contrib_staging", arrow)
             con.execute("INSERT INTO mart.mart_pnl_contribution SELECT * FROM _contrib_staging")
             con.unregister("_contrib_staging")
+
+        # Variable cost on an (item, channel store) without gross margin cannot enter contribution
+        unmatched = con.execute("""
+            SELECT COUNT(*), SUM(vc.allocated_amount_krw)
+            FROM mart.mart_pnl_variable_cost vc
+            ANTI JOIN mart.mart_pnl_gross_margin gm
+                ON gm.period = vc.period AND gm.item_id = vc.item_id AND gm.channel_store_id = vc.channel_store_id
+        """).fetchone()
+        if unmatched[0]:
+            logger.warning(
+                "Contribution excludes %s variable cost rows (%.0f KRW) without a matching gross margin row",
+                unmatched[0], unmatched[1] or 0,
+            )
     except Exception as e:
         logger.warning("Contribution build failed: %s", e)
 
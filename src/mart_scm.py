@@ -21,6 +21,7 @@ from src.expiry import (
     detect_expired_issues,
     write_expired_issues,
 )
+from src.periods import period_predicate
 
 logger = logging.getLogger(__name__)
 
@@ -32,12 +33,15 @@ def _write_mart(
     con: duckdb.DuckDBPyConnection,
     df: pl.DataFrame,
     table: str,
+    where: str = "TRUE",
+    params: list | None = None,
 ) -> None:
     """Delete existing rows and insert *df* into *table*.
 
     Handles the empty-DataFrame case gracefully (just deletes existing rows).
+    With *where*, only the matching rows are replaced (period-scoped rebuilds).
     """
-    con.execute(f"DELETE FROM {table}")
+    con.execute(f"DELETE FROM {table} WHERE {where}", params or [])
     if df.height == 0:
         logger.info("No rows to write for %s", table)
         return
@@ -49,10 +53,10 @@ def _write_mart(
     logger.info("Wrote %d rows to %s", df.height, table)
 
 
-def _safe_query(con: duckdb.DuckDBPyConnection, sql: str) -> pl.DataFrame:
+def _safe_query(con: duckdb.DuckDBPyConnection, sql: str, params: list | None = None) -> pl.DataFrame:
     """Execute *sql* and return a Polars DataFrame; return empty on error."""
     try:
-        return con.execute(sql).pl()
+        return con.execute(sql, params or []).pl()
     except Exception as exc:
         logger.warning("Query failed (%s): %s", exc, sql[:120])
         return pl.DataFrame()
@@ -770,19 +774,22 @@ def build_mart_shipment_performance(
 def build_mart_shipment_daily(
     con: duckdb.DuckDBPyConnection,
     config: AppConfig,
+    periods: list[str] | None = None,
 ) -> pl.DataFrame:
     """Build mart.mart_shipment_daily.
 
-    일별 출고 추이를 집계합니다.
+    일별 출고 추이를 집계합니다. periods가 주어지면 해당 월만 다시 집계합니다.
     """
-    shipments_df = _safe_query(con, """
+    where, params = period_predicate("fact_shipment", periods, config)
+    shipments_df = _safe_query(con, f"""
         SELECT ship_date, warehouse_id, shipment_id,
                item_id, qty_shipped, weight, volume_cbm,
                channel_order_id
         FROM core.fact_shipment
-    """)
+        WHERE {where}
+    """, params)
     if shipments_df.height == 0:
-        _write_mart(con, pl.DataFrame(), "mart.mart_shipment_daily")
+        _write_mart(con, pl.DataFrame(), "mart.mart_shipment_daily", where, params)
         return pl.DataFrame()
 
     agg = (
@@ -808,7 +815,7 @@ def build_mart_shipment_daily(
         pl.col("unique_items").cast(pl.Int64),
     ])
 
-    _write_mart(con, result, "mart.mart_shipment_daily")
+    _write_mart(con, result, "mart.mart_shipment_daily", where, params)
     return result
 
 
@@ -904,18 +911,21 @@ def build_mart_return_analysis(
 def build_mart_return_daily(
     con: duckdb.DuckDBPyConnection,
     config: AppConfig,
+    periods: list[str] | None = None,
 ) -> pl.DataFrame:
     """Build mart.mart_return_daily.
 
-    일별 반품 추이를 집계합니다.
+    일별 반품 추이를 집계합니다. periods가 주어지면 해당 월만 다시 집계합니다.
     """
-    returns_df = _safe_query(con, """
+    where, params = period_predicate("fact_return", periods, config)
+    returns_df = _safe_query(con, f"""
         SELECT return_date, warehouse_id, return_id,
                item_id, qty_returned, channel_order_id, reason
         FROM core.fact_return
-    """)
+        WHERE {where}
+    """, params)
     if returns_df.height == 0:
-        _write_mart(con, pl.DataFrame(), "mart.mart_return_daily")
+        _write_mart(con, pl.DataFrame(), "mart.mart_return_daily", where, params)
         return pl.DataFrame()
 
     agg = (
@@ -940,7 +950,7 @@ def build_mart_return_daily(
         pl.col("unique_items").cast(pl.Int64),
     ])
 
-    _write_mart(con, result, "mart.mart_return_daily")
+    _write_mart(con, result, "mart.mart_return_daily", where, params)
     return result
 
 
@@ -962,21 +972,42 @@ _MART_BUILDERS = [
     ("mart_return_daily",          build_mart_return_daily),
 ]
 
+# Daily marts keyed by their source fact's event date: each month is built
+# from that month's CORE rows only, so they can be rebuilt per period.
+_PERIOD_SCOPED_SOURCES = {
+    "mart_shipment_daily": "fact_shipment",
+    "mart_return_daily":   "fact_return",
+}
+
 
 def build_all_scm_marts(
     con: duckdb.DuckDBPyConnection,
     config: AppConfig,
+    periods: dict[str, list[str] | None] | None = None,
 ) -> dict[str, int]:
     """Build all SCM mart tables in dependency order.
 
+    *periods* maps changed CORE tables to the periods they received (see
+    periods.batch_periods). When given, the daily marts rebuild only those
+    months of their source fact, or are left as they are when it did not
+    change; a table mapped to None rebuilds them whole. Other marts are
+    always rebuilt whole.
+
     Returns a dict mapping mart name to row count written.
     """
     results: dict[str, int] = {}
 
     for name, builder in _MART_BUILDERS:
+        kwargs = {}
+        source = _PERIOD_SCOPED_SOURCES.get(name)
+        if periods is not None and source is not None:
+            if source not in periods:
+                logger.info("Skipping %s: %s unchanged", name, source)
+                continue
+            kwargs["periods"] = periods[source]
         logger.info("Building %s ...", name)
         try:
-            df = builder(con, config)
+            df = builder(con, config, **kwargs)
             results[name] = df.height if isinstance(df, pl.DataFrame) else 0
             logger.info("  -> %s: %d rows", name, results[name])
         except Exception as exc:
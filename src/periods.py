@@ -0,0 +1,167 @@
+"""Period (YYYY-MM) pruning for CORE facts on their schema.yaml event_date_column.
+
+CORE facts listed under ingest.yaml storage.cluster_by_period can be
+rewritten in event-date order (cluster_core_facts). DuckDB keeps min/max
+zonemaps per row group, so on a clustered table a period_predicate() filter
+skips every row group outside the requested months instead of scanning the
+whole table. Each loaded file's period range is kept in raw.system_file_log,
+which lets rollbacks prune their deletes, and --watch and --rollback rebuild
+only the changed months of the daily SCM marts.
+"""
+import logging
+from datetime import date
+
+import duckdb
+import polars as pl
+
+from src.config import AppConfig
+
+logger = logging.getLogger(__name__)
+
+
+def period_of(value) -> str | None:
+    """'YYYY-MM' of a date or of a 'YYYY-MM[-DD]' string."""
+    if value is None:
+        return None
+    if isinstance(value, date):
+        return f"{value.year:04d}-{value.month:02d}"
+    return str(value)[:7]
+
+
+def period_bounds(period: str) -> tuple[date, date]:
+    """[first day, first day of the next month) of a 'YYYY-MM' period."""
+    year, month = int(period[:4]), int(period[5:7])
+    start = date(year, month, 1)
+    end = date(year + month // 12, month % 12 + 1, 1)
+    return start, end
+
+
+def periods_between(first: str, last: str) -> list[str]:
+    """Every period from first to last inclusive."""
+    periods = []
+    start, _ = period_bounds(first)
+    stop, _ = period_bounds(last)
+    while start <= stop:
+        periods.append(period_of(start))
+        start = period_bounds(periods[-1])[1]
+    return periods
+
+
+def period_predicate(
+    table_name: str, periods, config: AppConfig, alias: str = "", include_null: bool = False
+) -> tuple[str, list]:
+    """SQL filter (and parameters) restricting a CORE fact to the given periods.
+
+    DATE event columns get one half-open range per run of consecutive months,
+    which DuckDB checks against the row-group zonemaps; 'YYYY-MM' VARCHAR
+    period columns get an IN list. Tables without an event_date_column, or an
+    empty period list, get no filter ("TRUE"). With include_null, rows whose
+    event column is NULL also match when the column is optional (nullable).
+    """
+    event_col = config.get_schema(table_name).event_date_column
+    periods = sorted(set(periods or ()))
+    if not event_col or not periods:
+        return "TRUE", []
+    col = f"{alias}.{event_col}" if alias else event_col
+    entry = config.registry.table(table_name)
+
+    if entry.column_types.get(event_col) != "DATE":
+        sql, params = f"{col} IN ({', '.join('?' * len(periods))})", periods
+    else:
+        ranges: list[list[date]] = []
+        for period in periods:
+            start, end = period_bounds(period)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        sql = " OR ".join(f"({col} >= ? AND {col} < ?)" for _ in ranges)
+        sql, params = f"({sql})", [d for r in ranges for d in r]
+
+    if include_null and event_col not in entry.required_columns:
+        sql = f"({sql} OR {col} IS NULL)"
+    return sql, params
+
+
+def event_period_range(df: pl.DataFrame, table_name: str, config: AppConfig) -> tuple[str, str] | None:
+    """(first, last) period of a prepared frame's event_date_column, None if unknown.
+
+    NULL event dates are ignored; filters built from this range must match
+    them separately (period_predicate include_null).
+    """
+    event_col = config.get_schema(table_name).event_date_column
+    if not event_col or event_col not in df.columns or df.height == 0:
+        return None
+    lo, hi = df.select(pl.col(event_col).min().alias("lo"), pl.col(event_col).max().alias("hi")).row(0)
+    if lo is None:
+        return None
+    return period_of(lo), period_of(hi)
+
+
+def batch_periods(
+    con: duckdb.DuckDBPyConnection, batch_ids: list[int], updates_unknown: bool = False
+) -> dict[str, list[str] | None]:
+    """Periods each CORE table received in the given batches, from raw.system_file_log.
+
+    A table maps to None when a file loaded into it has no recorded range
+    (rows logged before the range was recorded). With updates_unknown, it
+    also maps to None when a file updated existing rows: their previous event
+    dates are not recorded, so a row moved to another month would leave its
+    old month out of the range.
+    """
+    placeholders = ", ".join("?" * len(batch_ids))
+    rows = con.execute(f"""
+        SELECT table_name, period_min, period_max, COALESCE(rows_updated, 1) > 0
+        FROM raw.system_file_log
+        WHERE status = 'success' AND batch_id IN ({placeholders})
+    """, batch_ids).fetchall()
+
+    periods: dict[str, set | None] = {}
+    for table_name, first, last, updated in rows:
+        if first is None or last is None or (updates_unknown and updated):
+            periods[table_name] = None
+        elif table_name not in periods or periods[table_name] is not None:
+            periods.setdefault(table_name, set()).update(periods_between(first, last))
+    return {t: None if p is None else sorted(p) for t, p in periods.items()}
+
+
+def clustered_tables(config: AppConfig) -> list[str]:
+    """CORE facts configured for period clustering (ingest.yaml storage.cluster_by_period)."""
+    return list(config.ingest.get("storage", {}).get("cluster_by_period", []) or [])
+
+
+def cluster_core_facts(
+    con: duckdb.DuckDBPyConnection, config: AppConfig, tables: list[str] | None = None
+) -> dict[str, int]:
+    """Rewrite CORE facts in (event_date_column, business key) order.
+
+    Rows upserted later land at the end of the table, so clustering degrades
+    as batches arrive; run it as maintenance (run.py --cluster). Each table is
+    rewritten in its own transaction. Returns {table: rows rewritten}.
+
+    The rewrite stages a full copy of the table in a temp table, so it needs
+    free memory or temp_directory space for the largest clustered table.
+    Deleting and re-inserting the same primary keys in one transaction needs
+    DuckDB >= 1.2 (older versions reject it as a duplicate key).
+    """
+    rewritten = {}
+    for table_name in tables if tables is not None else clustered_tables(config):
+        event_col = config.get_schema(table_name).event_date_column
+        if not event_col:
+            logger.warning(f"core.{table_name} has no event_date_column; not clustered")
+            continue
+        order_by = ", ".join([event_col, *config.registry.table(table_name).business_key])
+        con.execute("BEGIN TRANSACTION")
+        try:
+            con.execute(f"CREATE TEMP TABLE _cluster_rows AS SELECT * FROM core.{table_name} ORDER BY {order_by}")
+            con.execute(f"DELETE FROM core.{table_name}")
+            con.execute(f"INSERT INTO core.{table_name} SELECT * FROM _cluster_rows ORDER BY {order_by}")
+            rows = con.execute("SELECT COUNT(*) FROM _cluster_rows").fetchone()[0]
+            con.execute("DROP TABLE _cluster_rows")
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        rewritten[table_name] = rows
+        logger.info(f"Clustered core.{table_name} by {event_col}: {rows} rows")
+    return rewritten
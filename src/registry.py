@@ -0,0 +1,133 @@
+"""Precompiled per-table lookups derived from schema.yaml + column_aliases.yaml.
+
+Built once by AppConfig. Every per-file stage (detection, aliasing, DQ,
+filter, cast, upsert) reads from here instead of rebuilding alias maps,
+column sets and cast types for each file.
+"""
+from collections.abc import Mapping
+from dataclasses import dataclass
+from types import MappingProxyType
+
+import polars as pl
+
+# Type mapping from schema.yaml type strings to Polars dtypes
+TYPE_CAST_MAP = {
+    "VARCHAR": pl.Utf8,
+    "BIGINT": pl.Int64,
+    "DOUBLE": pl.Float64,
+    "DATE": pl.Date,
+    "BOOLEAN": pl.Boolean,
+}
+
+# System columns carried by every CORE fact besides the schema.yaml columns
+SYSTEM_COLUMNS = frozenset({
+    "source_system", "source_pk", "load_batch_id", "source_file_hash", "loaded_at", "row_hash",
+})
+
+
+@dataclass(frozen=True)
+class TableRegistry:
+    name: str
+    alias_map: Mapping[str, str]
+    required_columns: frozenset
+    optional_columns: frozenset
+    known_columns: frozenset
+    content_columns: tuple
+    business_key: tuple
+    column_types: Mapping[str, str]
+    cast_types: Mapping[str, pl.DataType]
+    cast_exprs: Mapping[str, pl.Expr]
+
+
+@dataclass(frozen=True)
+class SchemaRegistry:
+    tables: Mapping[str, TableRegistry]
+    detection_index: Mapping[str, Mapping[str, str]]
+
+    def table(self, table_name: str) -> TableRegistry:
+        """Get the compiled entry for a table."""
+        if table_name not in self.tables:
+            raise KeyError(f"Unknown table: '{table_name}'")
+        return self.tables[table_name]
+
+
+def compile_alias_map(aliases: dict, table_name: str) -> dict[str, str]:
+    """Build {lowercased_alias -> canonical_name} for a given table.
+
+    Applies common aliases first, then table-specific aliases (override on conflict).
+    """
+    result: dict[str, str] = {}
+
+    for canonical, variants in aliases.get("common", {}).items():
+        for v in variants:
+            result[v.lower().strip()] = canonical
+
+    for canonical, variants in aliases.get(table_name, {}).items():
+        for v in variants:
+            result[v.lower().strip()] = canonical
+
+    return result
+
+
+def cast_expr(name: str, target: pl.DataType) -> pl.Expr:
+    """Expression converting a string column to its declared type (non-strict)."""
+    if target == pl.Date:
+        return pl.col(name).str.to_date(strict=False).alias(name)
+    if target == pl.Boolean:
+        return (
+            pl.when(pl.col(name).str.to_lowercase().is_in(["true", "1", "yes"]))
+            .then(True)
+            .when(pl.col(name).str.to_lowercase().is_in(["false", "0", "no"]))
+            .then(False)
+            .otherwise(None)
+            .alias(name)
+        )
+    return pl.col(name).cast(target, strict=False).alias(name)
+
+
+def _compile_table(table_name: str, table_schema, aliases: dict) -> TableRegistry:
+    all_cols = list(table_schema.required_columns) + list(table_schema.optional_columns)
+    column_types = {c.name: c.type for c in all_cols}
+    cast_types = {c.name: TYPE_CAST_MAP[c.type] for c in all_cols if c.type in TYPE_CAST_MAP}
+    required = frozenset(c.name for c in table_schema.required_columns)
+    optional = frozenset(c.name for c in table_schema.optional_columns)
+
+    return TableRegistry(
+        name=table_name,
+        alias_map=MappingProxyType(compile_alias_map(aliases, table_name)),
+        required_columns=required,
+        optional_columns=optional,
+        known_columns=required | optional | SYSTEM_COLUMNS,
+        content_columns=tuple(sorted(required | optional)),
+        business_key=tuple(table_schema.business_key),
+        column_types=MappingProxyType(column_types),
+        cast_types=MappingProxyType(cast_types),
+        cast_exprs=MappingProxyType({name: cast_expr(name, t) for name, t in cast_types.items()}),
+    )
+
+
+def _compile_detection_index(tables: dict[str, TableRegistry]) -> dict[str, Mapping[str, str]]:
+    """Inverted index: lowercased header token -> {table_name: required column it satisfies}.
+
+    Tokens that do not resolve to a required column are left out, since they
+    never contribute to a detection score.
+    """
+    index: dict[str, dict[str, str]] = {}
+    for table_name, entry in tables.items():
+        req = entry.required_columns
+        if not req:
+            continue
+        for token in set(entry.alias_map) | req:
+            canonical = entry.alias_map.get(token, token)
+            if canonical in req:
+                index.setdefault(token, {})[table_name] = canonical
+    return {token: MappingProxyType(hits) for token, hits in index.items()}
+
+
+def build_registry(schema: dict, aliases: dict) -> SchemaRegistry:
+    """Compile every schema.yaml table once."""
+    tables = {name: _compile_table(name, ts, aliases) for name, ts in schema.items()}
+    return SchemaRegistry(
+        tables=MappingProxyType(tables),
+        detection_index=MappingProxyType(_compile_detection_index(tables)),
+    )
@@ -0,0 +1,200 @@
+"""Inbox watcher support for run.py --watch.
+
+The watcher polls inbox/ (no inotify dependency), hands files over once their
+size and mtime have stopped changing, and rebuilds only the mart phases that
+read the CORE tables a micro-batch actually touched.
+"""
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+import duckdb
+
+from src.config import AppConfig
+from src.ingest import INBOX_DIR, inbox_format
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class MartPhase:
+    name: str
+    label: str
+    reads: frozenset          # CORE tables the builders read
+    after: tuple = ()         # upstream phases whose marts they read
+    period_scoped: bool = False   # builders accept the changed periods
+
+
+def _build_scm(con, config, periods=None):
+    from src.mart_scm import build_all_scm_marts
+    build_all_scm_marts(con, config, periods)
+
+
+def _allocate(con, config):
+    from src.allocation import allocate_all_charges
+    allocate_all_charges(con, config)
+
+
+def _build_pnl(con, config):
+    from src.mart_pnl import build_all_pnl_marts
+    build_all_pnl_marts(con, config)
+
+
+def _build_reco(con, config):
+    from src.mart_reco import build_all_reco_marts
+    build_all_reco_marts(con, config)
+
+
+def _build_constraint(con, config):
+    from src.mart_constraint import build_all_constraint_marts
+    build_all_constraint_marts(con, config)
+
+
+def _compute_coverage(con, config):
+    from src.coverage import compute_coverage
+    compute_coverage(con, config)
+
+
+# Mart phases in build order (run.py phases 2-7). `reads` lists the CORE
+# inputs of each builder; `after` the phases whose marts it consumes.
+MART_PHASES = (
+    MartPhase("scm", "SCM Marts", frozenset({
+        "fact_order", "fact_shipment", "fact_return", "fact_inventory_snapshot",
+        "fact_po", "fact_receipt", "fact_cost_structure", "dim_item",
+    }), period_scoped=True),
+    MartPhase("allocation", "Cost Allocation", frozenset({
+        "fact_shipment", "fact_inventory_snapshot", "dim_item", "fact_charge_actual", "fact_exchange_rate",
+    })),
+    MartPhase("pnl", "P&L Marts", frozenset({
+        "fact_shipment", "fact_return", "fact_settlement", "fact_exchange_rate",
+        "fact_cost_structure", "dim_channel_store",
+    }), after=("allocation",)),
+    MartPhase("reco", "Reconciliation Marts", frozenset({
+        "fact_order", "fact_shipment", "fact_return", "fact_inventory_snapshot",
+        "fact_receipt", "fact_settlement", "fact_charge_actual", "fact_exchange_rate",
+    }), after=("allocation", "pnl")),
+    MartPhase("constraint", "Constraint Detection", frozenset({
+        "fact_order", "fact_shipment", "fact_return", "fact_po", "fact_receipt",
+    }), after=("scm",)),
+    MartPhase("coverage", "Coverage Reporting", frozenset({
+        "fact_order", "fact_shipment", "fact_settlement", "fact_charge_actual",
+        "fact_exchange_rate", "fact_cost_structure",
+    })),
+)
+
+_PHASE_FUNCS: dict[str, Callable] = {
+    "scm": _build_scm,
+    "allocation": _allocate,
+    "pnl": _build_pnl,
+    "reco": _build_reco,
+    "constraint": _build_constraint,
+    "coverage": _compute_coverage,
+}
+
+
+def affected_phases(tables: set[str] | None) -> list[str]:
+    """Mart phases to rebuild after `tables` changed, in build order.
+
+    None means "unknown" and selects every phase.
+    """
+    if tables is None:
+        return [p.name for p in MART_PHASES]
+    selected: list[str] = []
+    for phase in MART_PHASES:
+        if phase.reads & tables or any(up in selected for up in phase.after):
+            selected.append(phase.name)
+    return selected
+
+
+def build_marts(
+    con: duckdb.DuckDBPyConnection,
+    config: AppConfig,
+    phases: list[str] | None = None,
+    first_phase_no: int = 2,
+    periods: dict[str, list[str] | None] | None = None,
+) -> list[str]:
+    """Run the given mart phases (default: all) in build order. Returns the names run.
+
+    periods (CORE table -> changed periods, see periods.batch_periods) lets
+    period-scoped phases rebuild only those months; None rebuilds everything.
+    """
+    wanted = set(affected_phases(None) if phases is None else phases)
+    ran = []
+    for no, phase in enumerate(MART_PHASES, start=first_phase_no):
+        if phase.name not in wanted:
+            continue
+        logger.info(f"=== PHASE {no}: {phase.label} ===")
+        if phase.period_scoped and periods is not None:
+            _PHASE_FUNCS[phase.name](con, config, periods)
+        else:
+            _PHASE_FUNCS[phase.name](con, config)
+        ran.append(phase.name)
+    return ran
+
+
+def watch_settings(config: AppConfig) -> dict:
+    """ingest.yaml `watch` section with defaults filled in."""
+    settings = config.ingest.get("watch", {}) or {}
+    return {
+        "poll_seconds": float(settings.get("poll_seconds", 5)),
+        "stable_polls": int(settings.get("stable_polls", 2)),
+        "max_files_per_batch": int(settings.get("max_files_per_batch", 200)),
+    }
+
+
+class InboxTracker:
+    """Tracks inbox files across polls and reports the ones ready to ingest.
+
+    A file is ready once its (size, mtime) has been observed unchanged for
+    `stable_polls` consecutive polls, so files still being copied in are left
+    alone. Files handed out and marked done are not offered again unless they
+    are rewritten (size or mtime change).
+    """
+
+    def __init__(self, inbox_dir: Path | None = None, stable_polls: int = 2):
+        self.inbox = inbox_dir or INBOX_DIR
+        self.stable_polls = max(1, stable_polls)
+        self._seen: dict[Path, tuple[tuple[int, int], int]] = {}
+        self._done: dict[Path, tuple[int, int]] = {}
+
+    def poll(self) -> list[Path]:
+        """Scan the inbox once; return ready files sorted by name."""
+        if not self.inbox.exists():
+            return []
+        current: dict[Path, tuple[int, int]] = {}
+        for f in self.inbox.iterdir():
+            if not f.is_file() or inbox_format(f) is None:
+                continue
+            try:
+                st = f.stat()
+            except FileNotFoundError:
+                continue
+            current[f] = (st.st_size, st.st_mtime_ns)
+
+        ready = []
+        for f, sig in current.items():
+            if self._done.get(f) == sig:
+                continue
+            prev = self._seen.get(f)
+            count = prev[1] + 1 if prev and prev[0] == sig else 1
+            self._seen[f] = (sig, count)
+            if count >= self.stable_polls:
+                ready.append(f)
+
+        # Forget files that disappeared (moved away or deleted)
+        for f in list(self._seen):
+            if f not in current:
+                del self._seen[f]
+        for f in list(self._done):
+            if f not in current:
+                del self._done[f]
+
+        return sorted(ready, key=lambda f: f.name)
+
+    def mark_done(self, files: list[Path]) -> None:
+        """Record files as handled at their last observed size/mtime."""
+        for f in files:
+            entry = self._seen.pop(f, None)
+            if entry is not None:
+                self._done[f] = entry[0]
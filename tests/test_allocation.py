@@ -2,7 +2,11 @@
 import polars as pl
 import pytest
 
-from src.allocation import allocate_charge, largest_fraction_round
+from src.allocation import (
+    allocate_charge,
+    largest_fraction_round,
+    largest_fraction_round_grouped,
+)
 from src.config import AppConfig
 
 
@@ -138,6 +142,36 @@ class TestLargestFractionRound:
         assert largest_fraction_round([], 0.0, 0) == []
 
 
+class TestGroupedRounding:
+    """The vectorized kernel must match largest_fraction_round per partition."""
+
+    @pytest.mark.parametrize("decimals", [0, 2])
+    def test_matches_scalar_per_group(self, decimals):
+        import random
+
+        rng = random.Random(3)
+        rows = []
+        for g in range(40):
+            total = round(rng.uniform(-1000, 100_000), decimals)
+            n = rng.randint(1, 25)
+            weights = [rng.choice([1, 1, 2, 3]) for _ in range(n)]  # repeated weights: remainder ties
+            raw = [w / sum(weights) * total for w in weights]
+            rows += [(g, i, r, total) for i, r in enumerate(raw)]
+        df = pl.DataFrame(rows, schema=["g", "i", "raw", "total"], orient="row")
+
+        result = largest_fraction_round_grouped(df, "raw", "total", "g", decimals)
+
+        for (g,), part in result.partition_by("g", as_dict=True).items():
+            expected = largest_fraction_round(part["raw"].to_list(), part["total"][0], decimals)
+            assert part["allocated_amount"].to_list() == expected
+
+    def test_ties_go_to_earlier_rows(self):
+        df = pl.DataFrame({"g": ["A"] * 3 + ["B"] * 3, "raw": [1 / 3 * 100] * 6, "total": [100.0] * 6})
+        assert largest_fraction_round_grouped(df, "raw", "total", "g", 0)["allocated_amount"].to_list() == [
+            34.0, 33.0, 33.0, 34.0, 33.0, 33.0,
+        ]
+
+
 class TestUnsupportedBasis:
     """Unsupported allocation basis must raise."""
 
@@ -156,3 +190,258 @@ class TestUnsupportedBasis:
                 "INV-001", 1, "LAST_MILE_PARCEL", 1000.0, "KRW", "2024-01",
                 targets, config,
             )
+
+
+def _loop_reference(charges: pl.DataFrame, index, config, fx_map: dict) -> pl.DataFrame:
+    """Per-line allocation: allocate_charge on each charge line's scope."""
+    from src.allocation import ALLOCATED_COLUMNS, _charge_scopes
+
+    keys, frames, _ = _charge_scopes(charges, index)
+    allocated = []
+    for row, key in zip(charges.iter_rows(named=True), keys):
+        rate = 1.0 if row["currency"] == "KRW" else fx_map.get((row["period"], row["currency"]), 1.0)
+        try:
+            df = allocate_charge(
+                row["invoice_no"], row["invoice_line_no"], row["charge_type"], row["amount"],
+                row["currency"], row["period"], frames[key], config, rate,
+            )
+        except ValueError:
+            continue
+        allocated.append(df.select(ALLOCATED_COLUMNS))
+    return pl.concat(allocated, how="vertical_relaxed")
+
+
+class TestTargetIndex:
+    """Shipment targets: aggregated per period and scope, looked up most specific first."""
+
+    def test_shipment_targets_aggregate_requested_periods(self, tmp_path, con, config):
+        from src.allocation import shipment_targets
+        from src.ingest import process_file
+
+        pl.DataFrame({
+            "source_system": ["WMS"] * 4,
+            "shipment_id": ["S1", "S2", "S3", "S4"],
+            "ship_date": ["2024-01-05", "2024-01-09", "2024-01-20", "2024-02-01"],
+            "warehouse_id": ["WH-01"] * 4,
+            "channel_store_id": ["A"] * 4,
+            "item_id": ["SKU-1"] * 4,
+            "lot_id": ["L1"] * 4,
+            "qty_shipped": ["2", "3", "1", "9"],
+            "weight": ["1.5", None, None, None],
+            "channel_order_id": ["O1", "O1", None, "O2"],
+        }).write_csv(tmp_path / "shipments.csv")
+        process_file(con, tmp_path / "shipments.csv", config, batch_id=1)
+
+        targets = shipment_targets(con, config, ["2024-01"])
+        assert targets.select(
+            "period", "qty", "weight", "order_count", "line_count", "revenue",
+        ).rows() == [("2024-01", 6.0, 1.5, 3, 3, 3.0)]
+
+    def test_lookup_falls_back_to_coarser_scopes(self, config):
+        from src.allocation import build_target_index
+
+        index = build_target_index(pl.DataFrame({
+            "period": ["2024-01", "2024-01", "2024-01"],
+            "warehouse_id": ["WH-01", "WH-01", None],
+            "channel_store_id": ["A", "B", "A"],
+            "item_id": ["SKU-1", "SKU-2", "SKU-3"],
+            "lot_id": ["L1"] * 3,
+            "qty": [1.0, 2.0, 3.0],
+        }), config)
+
+        assert index.lookup("2024-01", "WH-01", "A") == ("2024-01", "WH-01", "A")
+        assert index.lookup("2024-01", "WH-01", "C") == ("2024-01", "WH-01", None)
+        assert index.lookup("2024-01", "", "A") == ("2024-01", None, "A")
+        assert index.lookup("2024-01", "WH-09", None) == ("2024-01", None, None)
+        assert index.lookup("2024-02", "WH-01", "A") is None
+        assert index.scopes["2024-01", None, "A"]["item_id"].to_list() == ["SKU-3", "SKU-1"]
+
+    def test_scope_stats_match_frame_stats(self, config):
+        from src.allocation import build_target_index, frame_basis_stats
+
+        index = build_target_index(pl.DataFrame({
+            "period": ["2024-01"] * 5,
+            "warehouse_id": ["WH-01", "WH-02", "WH-01", "WH-01", "WH-02"],
+            "channel_store_id": ["A"] * 5,
+            "item_id": ["SKU-5", "SKU-4", "SKU-3", "SKU-2", "SKU-1"],
+            "lot_id": ["L1"] * 5,
+            "weight": [0.1, None, 0.2, 0.0, 0.3],
+        }), config)
+
+        for key, frame in index.scopes.items():
+            assert dict(index.stats[key]) == frame_basis_stats(frame)
+        assert index.stats["2024-01", "WH-01", None]["weight"].nonzero_count == 2
+
+
+class TestStorageTargets:
+    """Storage charges allocate over cbm-days / qty-days held in the charge period."""
+
+    def _load_inventory(self, tmp_path, con, config):
+        from src.ingest import process_file
+
+        pl.DataFrame({
+            "source_system": ["WMS"] * 4,
+            "snapshot_date": ["2024-01-11", "2024-01-21", "2024-02-06", "2024-01-25"],
+            "warehouse_id": ["WH-01"] * 4,
+            "item_id": ["SKU-1", "SKU-1", "SKU-1", "SKU-2"],
+            "lot_id": ["L1"] * 4,
+            "onhand_qty": ["10", "20", "5", "4"],
+        }).write_csv(tmp_path / "inventory.csv")
+        process_file(con, tmp_path / "inventory.csv", config, batch_id=1)
+        con.execute("INSERT INTO core.dim_item (item_id, volume_cbm) VALUES ('SKU-1', 0.5), ('SKU-2', 2.0)")
+
+    def test_snapshot_intervals_are_clipped_to_periods(self, tmp_path, con, config):
+        from src.allocation import storage_targets
+
+        self._load_inventory(tmp_path, con, config)
+
+        targets = storage_targets(con, config, ["2024-01", "2024-02"])
+        # SKU-1 Jan: 10 x 10 days + 20 x 11 days; Feb: 20 x 5 days + 5 x 24 days (leap year)
+        # SKU-2 holds 4 from Jan 25 to month end only (latest snapshot)
+        assert targets.select("period", "item_id", "onhand_qty_days", "onhand_cbm_days").rows() == [
+            ("2024-01", "SKU-1", 320.0, 160.0),
+            ("2024-01", "SKU-2", 28.0, 56.0),
+            ("2024-02", "SKU-1", 220.0, 110.0),
+        ]
+
+    def test_storage_fee_allocated_by_cbm_days(self, tmp_path, con, config, sample_charge_df):
+        from src.allocation import allocate_all_charges
+        from src.ingest import process_file
+
+        self._load_inventory(tmp_path, con, config)
+        sample_charge_df.with_columns(
+            pl.lit("3PL_STORAGE_FEE").alias("charge_type"), pl.lit("2160").alias("amount"),
+        ).write_csv(tmp_path / "charges.csv")
+        process_file(con, tmp_path / "charges.csv", config, batch_id=2)
+
+        allocate_all_charges(con, config)
+
+        rows = con.execute("""
+            SELECT item_id, allocation_basis, basis_value, allocated_amount
+            FROM mart.mart_charge_allocated ORDER BY item_id
+        """).fetchall()
+        assert rows == [
+            ("SKU-1", "onhand_cbm_days", 160.0, 1600.0),
+            ("SKU-2", "onhand_cbm_days", 56.0, 560.0),
+        ]
+
+    def test_storage_fee_reaches_contribution(self, tmp_path, con, config, sample_charge_df, caplog):
+        from src.allocation import allocate_all_charges
+        from src.ingest import process_file
+        from src.mart_pnl import build_all_pnl_marts
+
+        self._load_inventory(tmp_path, con, config)
+        pl.DataFrame({
+            "source_system": ["WMS"] * 2,
+            "shipment_id": ["SHP-1", "SHP-2"],
+            "ship_date": ["2024-01-16", "2024-01-17"],
+            "warehouse_id": ["WH-01"] * 2,
+            "item_id": ["SKU-1"] * 2,
+            "qty_shipped": ["3", "1"],
+            "lot_id": ["L1"] * 2,
+            "channel_order_id": ["ORD-1", "ORD-2"],
+            "channel_store_id": ["STORE-A", "STORE-B"],
+        }).write_csv(tmp_path / "shipments.csv")
+        process_file(con, tmp_path / "shipments.csv", config, batch_id=2)
+        sample_charge_df.with_columns(
+            pl.lit("3PL_STORAGE_FEE").alias("charge_type"), pl.lit("2160").alias("amount"),
+        ).write_csv(tmp_path / "charges.csv")
+        process_file(con, tmp_path / "charges.csv", config, batch_id=3)
+
+        allocate_all_charges(con, config)
+        build_all_pnl_marts(con, config)
+
+        # SKU-1's 160 cbm-days split 3:1 by units shipped per store
+        rows = con.execute("""
+            SELECT item_id, channel_store_id, total_variable_cost_krw
+            FROM mart.mart_pnl_contribution ORDER BY item_id, channel_store_id
+        """).fetchall()
+        assert rows == [("SKU-1", "STORE-A", 1200.0), ("SKU-1", "STORE-B", 400.0)]
+        # SKU-2 never shipped: its storage cost has no gross margin row and is reported
+        assert "Contribution excludes 1 variable cost rows (560 KRW)" in caplog.text
+
+
+class TestBasisResolver:
+    """Basis decisions are memoized per (charge_type, scope) and reported."""
+
+    def test_fallback_report(self, config):
+        from src.allocation import BasisResolver, BasisStats
+
+        with_orders = {"order_count": BasisStats(3, 0, 3, 3)}
+        lines_only = {"order_count": BasisStats(3, 3, 0, 0), "line_count": BasisStats(3, 0, 3, 3)}
+        resolver = BasisResolver(config)
+        for _ in range(4):
+            assert resolver.resolve("LAST_MILE_PARCEL", "scope-1", with_orders) == "order_count"
+        # Memoized: later stats for the same scope are not consulted
+        assert resolver.resolve("LAST_MILE_PARCEL", "scope-1", lines_only) == "order_count"
+        assert resolver.resolve("LAST_MILE_PARCEL", "scope-2", lines_only) == "line_count"
+        assert resolver.resolve("3PL_STORAGE_FEE", "scope-1", lines_only) is None
+
+        assert resolver.report().rows() == [
+            ("3PL_STORAGE_FEE", None, None, True, 1, 1),
+            ("LAST_MILE_PARCEL", "line_count", 2, True, 1, 1),
+            ("LAST_MILE_PARCEL", "order_count", 1, False, 5, 1),
+        ]
+
+
+class TestVectorizedAllocation:
+    """allocate_charges must reproduce the per-line allocation exactly."""
+
+    def test_matches_per_line_allocation(self, config):
+        import random
+
+        from src.allocation import (
+            add_basis_columns,
+            allocate_charges,
+            build_target_index,
+        )
+
+        rng = random.Random(7)
+        n = 400
+        index = build_target_index(add_basis_columns(pl.DataFrame({
+            "period": [rng.choice(["2024-01", "2024-02"]) for _ in range(n)],
+            "warehouse_id": [rng.choice(["WH-01", "WH-02", "WH-03"]) for _ in range(n)],
+            "channel_store_id": [rng.choice(["S1", "S2", None]) for _ in range(n)],
+            # Few items/lots: many ties on the sort keys
+            "item_id": [rng.choice(["SKU-A", "SKU-B"]) for _ in range(n)],
+            "lot_id": [rng.choice(["L1", "L2"]) for _ in range(n)],
+            "qty_shipped": [float(rng.choice([1, 2, 3, 7])) for _ in range(n)],
+            "weight": [rng.choice([None, 0.5, 1.25, 3.0]) for _ in range(n)],
+            "volume_cbm": [None] * n,
+        })), config)
+        types = ["LAST_MILE_PARCEL", "DOMESTIC_TRUCKING", "FREIGHT_INTL_SEA", "PG_FEE", "3PL_STORAGE_FEE"]
+        m = 90
+        charges = pl.DataFrame({
+            "invoice_no": [f"INV-{i // 3}" for i in range(m)],
+            "invoice_line_no": [i % 3 + 1 for i in range(m)],
+            "charge_type": [types[i % len(types)] for i in range(m)],
+            "amount": [round(rng.uniform(-5000, 1_000_000), rng.choice([0, 2])) for _ in range(m)],
+            "currency": [rng.choice(["KRW", "USD"]) for _ in range(m)],
+            # 2024-03 has no shipments: UNALLOCATED fallback
+            "period": [rng.choice(["2024-01", "2024-02", "2024-03"]) for _ in range(m)],
+            "warehouse_id": [rng.choice(["WH-01", "WH-02", "WH-09", None, ""]) for _ in range(m)],
+            "channel_store_id": [rng.choice(["S1", "S3", None]) for _ in range(m)],
+        })
+        fx_map = {("2024-01", "USD"): 1321.7, ("2024-02", "USD"): 1330.05}
+
+        for decimals in (0, 2):
+            config.allocation["rounding"]["decimals"] = decimals
+            expected = _loop_reference(charges, index, config, fx_map)
+            result = allocate_charges(charges, index, config, fx_map)
+            assert result.cast(expected.schema).equals(expected)
+
+        assert "UNALLOCATED" in result["item_id"].to_list()
+        # Shipment targets carry no storage basis: storage charges only land on the fallback
+        assert set(result.filter(pl.col("charge_type") == "3PL_STORAGE_FEE")["item_id"]) == {"UNALLOCATED"}
+
+    def test_no_shipments_fall_back_to_unallocated(self, config):
+        from src.allocation import allocate_charges, build_target_index
+
+        charges = pl.DataFrame({
+            "invoice_no": ["INV-1"], "invoice_line_no": [1], "charge_type": ["LAST_MILE_PARCEL"],
+            "amount": [1234.4], "currency": ["KRW"], "period": ["2024-01"], "warehouse_id": ["WH-01"],
+        })
+        result = allocate_charges(charges, build_target_index(pl.DataFrame(), config), config)
+        assert result.select("item_id", "warehouse_id", "channel_store_id", "allocated_amount").rows() == [
+            ("UNALLOCATED", "WH-01", "UNKNOWN", 1234.0),
+        ]
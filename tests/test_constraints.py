@@ -27,7 +27,7 @@ class TestConstraintSignals:
         po_df = filter_columns(po_df, "fact_po", config)
         po_df = cast_columns(po_df, "fact_po", config)
         po_df = add_system_columns(po_df, 1, "h1", "fact_po", config)
-        upsert_core(con, po_df, "fact_po", config, 1, "h1")
+        upsert_core(con, po_df, "fact_po", config)
 
         signals = compute_supply_signals(con, config)
         # With no receipts and past ETAs, should detect late POs
@@ -50,7 +50,7 @@ class TestConstraintSignals:
         po_df = filter_columns(po_df, "fact_po", config)
         po_df = cast_columns(po_df, "fact_po", config)
         po_df = add_system_columns(po_df, 1, "h1", "fact_po", config)
-        upsert_core(con, po_df, "fact_po", config, 1, "h1")
+        upsert_core(con, po_df, "fact_po", config)
 
         signals1 = compute_supply_signals(con, config)
         signals2 = compute_supply_signals(con, config)
@@ -83,7 +83,7 @@ class TestCriticalAutoIssue:
         inv_df = filter_columns(inv_df, "fact_inventory_snapshot", config)
         inv_df = cast_columns(inv_df, "fact_inventory_snapshot", config)
         inv_df = add_system_columns(inv_df, 1, "h1", "fact_inventory_snapshot", config)
-        upsert_core(con, inv_df, "fact_inventory_snapshot", config, 1, "h1")
+        upsert_core(con, inv_df, "fact_inventory_snapshot", config)
 
         # Build inventory onhand mart first (needed for finance signals)
         from src.mart_scm import build_all_scm_marts
@@ -21,7 +21,7 @@ class TestCoverageReporting:
         fx_df = filter_columns(fx_df, "fact_exchange_rate", config)
         fx_df = cast_columns(fx_df, "fact_exchange_rate", config)
         fx_df = add_system_columns(fx_df, 1, "h1", "fact_exchange_rate", config)
-        upsert_core(con, fx_df, "fact_exchange_rate", config, 1, "h1")
+        upsert_core(con, fx_df, "fact_exchange_rate", config)
 
         # Also insert an order to create a period
         order_df = pl.DataFrame({
@@ -36,7 +36,7 @@ class TestCoverageReporting:
         order_df = filter_columns(order_df, "fact_order", config)
         order_df = cast_columns(order_df, "fact_order", config)
         order_df = add_system_columns(order_df, 1, "h2", "fact_order", config)
-        upsert_core(con, order_df, "fact_order", config, 1, "h2")
+        upsert_core(con, order_df, "fact_order", config)
 
         coverage_df = compute_coverage(con, config)
         fx_rows = coverage_df.filter(pl.col("domain") == "fx_rate")
@@ -61,7 +61,7 @@ class TestCoverageReporting:
         order_df = filter_columns(order_df, "fact_order", config)
         order_df = cast_columns(order_df, "fact_order", config)
         order_df = add_system_columns(order_df, 1, "h1", "fact_order", config)
-        upsert_core(con, order_df, "fact_order", config, 1, "h1")
+        upsert_core(con, order_df, "fact_order", config)
 
         coverage_df = compute_coverage(con, config)
         settlement_rows = coverage_df.filter(
@@ -1,11 +1,28 @@
 """Tests for ETL pipeline: idempotent upsert, alias mapping, DQ checks."""
+from datetime import datetime, timezone
+from pathlib import Path
+
 import polars as pl
 import pytest
-from pathlib import Path
 
 from src.aliases import apply_aliases
-from src.dq import run_all_checks, has_failures
-from src.ingest import detect_table_type, process_file, upsert_core, add_system_columns, filter_columns, cast_columns
+from src.dq import has_failures, run_all_checks, run_fused_checks
+from src.ingest import (
+    LogBuffer,
+    add_system_columns,
+    cast_columns,
+    compute_file_hash,
+    detect_table_type,
+    filter_columns,
+    get_loaded_hashes,
+    ingest_all,
+    log_dq_results,
+    log_file,
+    process_file,
+    read_header,
+    resolve_file_hashes,
+    upsert_core,
+)
 
 
 class TestIdempotentUpsert:
@@ -18,7 +35,7 @@ class TestIdempotentUpsert:
         df = cast_columns(df, "fact_order", config)
         df = add_system_columns(df, batch_id=1, file_hash="hash1", table_name="fact_order", config=config)
 
-        upsert_core(con, df, "fact_order", config, batch_id=1, file_hash="hash1")
+        upsert_core(con, df, "fact_order", config)
         count1 = con.execute("SELECT COUNT(*) FROM core.fact_order").fetchone()[0]
 
         # Load same data again
@@ -27,12 +44,51 @@ class TestIdempotentUpsert:
         df2 = cast_columns(df2, "fact_order", config)
         df2 = add_system_columns(df2, batch_id=2, file_hash="hash1", table_name="fact_order", config=config)
 
-        upsert_core(con, df2, "fact_order", config, batch_id=2, file_hash="hash1")
+        upsert_core(con, df2, "fact_order", config)
         count2 = con.execute("SELECT COUNT(*) FROM core.fact_order").fetchone()[0]
 
         assert count1 == count2, f"Idempotency violated: {count1} -> {count2}"
         assert count1 == 2  # Two distinct orders
 
+    def test_unchanged_rows_are_not_rewritten(self, con, config, sample_order_df):
+        def stage(df, batch_id):
+            df = cast_columns(filter_columns(apply_aliases(df, "fact_order", config), "fact_order", config), "fact_order", config)
+            return add_system_columns(df, batch_id=batch_id, file_hash=f"h{batch_id}", table_name="fact_order", config=config)
+
+        counts = upsert_core(con, stage(sample_order_df, 1), "fact_order", config)
+        assert (counts.inserted, counts.updated, counts.unchanged) == (2, 0, 0)
+
+        # Overlapping re-export: one row revised, one identical, one new
+        resent = pl.concat([
+            sample_order_df.with_columns(
+                pl.when(pl.col("channel_order_id") == "ORD-001").then(9).otherwise(pl.col("qty_ordered")).alias("qty_ordered")
+            ),
+            sample_order_df.head(1).with_columns(pl.lit("ORD-003").alias("channel_order_id")),
+        ], how="vertical_relaxed")
+        counts = upsert_core(con, stage(resent, 2), "fact_order", config)
+        assert (counts.inserted, counts.updated, counts.unchanged) == (1, 1, 1)
+
+        batches = dict(con.execute("SELECT channel_order_id, load_batch_id FROM core.fact_order").fetchall())
+        assert batches == {"ORD-001": 2, "ORD-002": 1, "ORD-003": 2}
+
+    def test_file_log_records_upsert_counts(self, tmp_path, con, config, sample_order_df):
+        sample_order_df.write_csv(tmp_path / "orders_1.csv")
+        sample_order_df.with_columns(pl.lit(5).alias("qty_ordered")).head(1).write_csv(tmp_path / "orders_2.csv")
+        process_file(con, tmp_path / "orders_1.csv", config, batch_id=1)
+        process_file(con, tmp_path / "orders_2.csv", config, batch_id=2)
+
+        rows = con.execute(
+            "SELECT rows_inserted, rows_updated, rows_unchanged FROM raw.system_file_log ORDER BY batch_id"
+        ).fetchall()
+        assert rows == [(2, 0, 0), (0, 1, 0)]
+
+    def test_row_hash_ignores_column_order_and_absent_optionals(self, config, sample_order_df):
+        df = cast_columns(sample_order_df, "fact_order", config)
+        reordered = df.select(reversed(df.columns)).with_columns(pl.lit(None).cast(pl.Utf8).alias("partner_id"))
+        a = add_system_columns(df, 1, "h", "fact_order", config)["row_hash"]
+        b = add_system_columns(reordered, 2, "h2", "fact_order", config)["row_hash"]
+        assert a.to_list() == b.to_list()
+
 
 class TestAliasMapping:
     """Alias mapping must come ONLY from config, not hardcoded."""
@@ -53,6 +109,20 @@ class TestAliasMapping:
         assert "fact_order" in config.aliases
         assert "channel_order_id" in config.aliases["fact_order"]
 
+    def test_registry_precompiled_and_frozen(self, config):
+        """The registry is compiled once on AppConfig and cannot be mutated."""
+        from src.aliases import build_alias_map
+
+        entry = config.registry.table("fact_order")
+        assert dict(entry.alias_map) == build_alias_map(config, "fact_order")
+        assert entry.business_key == ("channel_order_id", "line_no")
+        assert "qty_ordered" in entry.required_columns and "loaded_at" in entry.known_columns
+        assert entry.cast_types["order_date"] == pl.Date
+        with pytest.raises(TypeError):
+            entry.alias_map["new_alias"] = "item_id"
+        with pytest.raises(KeyError, match="Unknown table"):
+            config.registry.table("nope")
+
 
 class TestDQChecks:
     """DQ validation must catch missing cols, null keys, duplicates."""
@@ -115,6 +185,20 @@ class TestDQChecks:
         results = run_all_checks(df, "fact_charge_actual", config)
         assert has_failures(results), "Unknown charge_type should cause DQ failure"
 
+    def test_fused_matches_separate_checks(self, config, sample_order_df):
+        """The single-pass engine must reach the same verdicts and hand back the cast frame."""
+        good = apply_aliases(sample_order_df, "fact_order", config)
+        bad = pl.concat([good, good.head(1)]).with_columns(
+            pl.when(pl.int_range(pl.len()) == 0).then(pl.lit("ten")).otherwise(pl.col("qty_ordered")).alias("qty_ordered")
+        )
+
+        for df in (good, bad):
+            fused, cast_df = run_fused_checks(df, "fact_order", config)
+            separate = run_all_checks(df, "fact_order", config)
+            assert [(r.check_name, r.passed) for r in fused] == [(r.check_name, r.passed) for r in separate]
+            assert cast_df.equals(cast_columns(df, "fact_order", config))
+            assert cast_columns(cast_df, "fact_order", config) is cast_df
+
 
 class TestTableDetection:
     """Table type detection must use schema.yaml scores; ties -> FAIL."""
@@ -137,3 +221,789 @@ class TestTableDetection:
         })
         with pytest.raises(ValueError, match="(No table matched|Tie in table detection)"):
             detect_table_type(df, config)
+
+    def test_header_only_detection(self, tmp_path, config, sample_order_korean_df):
+        """CSV and XLSX headers are read without the data rows and detect the same table."""
+        from openpyxl import Workbook
+
+        csv_path = tmp_path / "orders.csv"
+        sample_order_korean_df.write_csv(csv_path)
+        assert read_header(csv_path) == sample_order_korean_df.columns
+
+        xlsx_path = tmp_path / "orders.xlsx"
+        wb = Workbook()
+        wb.active.append(sample_order_korean_df.columns)
+        wb.active.append(["OMS", "ORD-001", 1, "2024-01-15", "STORE-A", "SKU-001", 10])
+        wb.save(xlsx_path)
+        assert read_header(xlsx_path) == sample_order_korean_df.columns
+
+        assert detect_table_type(sample_order_korean_df, config) == "fact_order"
+
+    def test_unknown_file_rejected_from_header(self, tmp_path, con, config):
+        """An unrecognized file fails detection before its body is parsed."""
+        path = tmp_path / "junk.csv"
+        path.write_text("random_col_1,random_col_2\n" + "\"unterminated\n" * 3, encoding="utf-8")
+        r = process_file(con, path, config, batch_id=1)
+        assert r["status"] == "error"
+        assert "Tie in table detection" in r["error"] or "No table matched" in r["error"]
+
+
+def _write_inbox(inbox: Path, sample_order_df, sample_shipment_df) -> None:
+    """Inbox with two valid files, one duplicate, one DQ failure and one unknown table."""
+    inbox.mkdir()
+    sample_order_df.write_csv(inbox / "a_orders.csv")
+    sample_shipment_df.write_csv(inbox / "b_shipments.csv")
+    sample_order_df.write_csv(inbox / "c_orders_copy.csv")
+    sample_order_df.with_columns(pl.lit("ORD-001").alias("channel_order_id")).write_csv(inbox / "d_dup.csv")
+    pl.DataFrame({"random_col": ["x"]}).write_csv(inbox / "e_unknown.csv")
+
+
+def _orders(n: int) -> pl.DataFrame:
+    """n distinct OMS order lines, keyed by the aliased 주문번호 header."""
+    return pl.DataFrame({
+        "system": ["OMS"] * n,
+        "주문번호": [f"ORD-{i:05d}" for i in range(n)],
+        "line_no": ["1"] * n,
+        "order_date": ["2024-01-15"] * n,
+        "channel_store_id": ["STORE-A"] * n,
+        "item_id": [f"SKU-{i % 7}" for i in range(n)],
+        "qty_ordered": [str(i) for i in range(n)],
+    })
+
+
+def _bad_orders(directory: Path) -> Path:
+    """directory/orders.csv: 200 order lines, row 3 without a key and row 7 with a non-numeric qty."""
+    path = directory / "orders.csv"
+    _orders(200).with_columns(
+        pl.when(pl.int_range(pl.len()) == 3).then(None).otherwise(pl.col("주문번호")).alias("주문번호"),
+        pl.when(pl.int_range(pl.len()) == 7).then(pl.lit("x")).otherwise(pl.col("qty_ordered")).alias("qty_ordered"),
+    ).write_csv(path)
+    return path
+
+
+class TestParallelIngest:
+    """Parallel ingestion must produce the same results, in the same order, as sequential."""
+
+    def test_parallel_matches_sequential(self, tmp_path, config, sample_order_df, sample_shipment_df):
+        import duckdb
+
+        from src.db import init_db
+
+        inbox = tmp_path / "inbox"
+        _write_inbox(inbox, sample_order_df, sample_shipment_df)
+
+        outcomes = {}
+        for workers, prefetch in ((1, 0), (4, 0), (1, 2)):
+            con = duckdb.connect(str(tmp_path / f"w{workers}p{prefetch}.duckdb"))
+            init_db(con)
+            results = ingest_all(con, config, inbox_dir=inbox, batch_id=1, workers=workers, prefetch=prefetch)
+            file_log = con.execute(
+                "SELECT file_name, status, row_count FROM raw.system_file_log ORDER BY rowid"
+            ).fetchall()
+            orders = con.execute("SELECT COUNT(*) FROM core.fact_order").fetchone()[0]
+            con.close()
+            outcomes[workers, prefetch] = ([(r["file"], r["status"], r["rows"]) for r in results], file_log, orders)
+
+        assert outcomes[1, 0] == outcomes[4, 0] == outcomes[1, 2]
+        statuses = [s for _, s, _ in outcomes[4, 0][0]]
+        assert statuses == ["success", "success", "skipped", "dq_failed", "error"]
+
+    def test_prefetch_is_bounded_and_stops_with_consumer(self):
+        import threading
+
+        from src.ingest import _prefetch
+
+        produced = []
+
+        def files():
+            for i in range(1000):
+                produced.append(i)
+                yield i
+
+        it = _prefetch(files(), depth=3)
+        assert [next(it) for _ in range(5)] == [0, 1, 2, 3, 4]
+        # Queue depth 3 + 1 item blocked in put + the 5 consumed
+        assert len(produced) <= 5 + 3 + 1
+        it.close()
+        assert not any(t.name == "ingest-reader" for t in threading.enumerate())
+
+        def broken():
+            yield 1
+            raise ValueError("boom")
+
+        it = _prefetch(broken(), depth=2)
+        assert next(it) == 1
+        with pytest.raises(ValueError, match="boom"):
+            next(it)
+
+
+class TestBulkUpsert:
+    """Bulk mode groups files per table; later files win on business key collisions."""
+
+    def test_bulk_matches_sequential(self, tmp_path, config, sample_order_df, sample_shipment_df):
+        import duckdb
+
+        from src.db import init_db
+
+        inbox = tmp_path / "inbox"
+        inbox.mkdir()
+        sample_order_df.write_csv(inbox / "a_orders.csv")
+        sample_order_df.with_columns(pl.lit("99").alias("qty_ordered")).write_csv(inbox / "b_orders_fix.csv")
+        sample_shipment_df.write_csv(inbox / "c_shipments.csv")
+
+        outcomes = {}
+        for bulk in (False, True):
+            con = duckdb.connect(str(tmp_path / f"bulk_{bulk}.duckdb"))
+            init_db(con)
+            results = ingest_all(con, config, inbox_dir=inbox, batch_id=1, bulk=bulk)
+            orders = con.execute(
+                "SELECT channel_order_id, qty_ordered, source_file_hash FROM core.fact_order ORDER BY 1"
+            ).fetchall()
+            logged = con.execute(
+                "SELECT file_name, status, row_count FROM raw.system_file_log ORDER BY file_name"
+            ).fetchall()
+            con.close()
+            outcomes[bulk] = ([(r["file"], r["status"], r["rows"]) for r in results], orders, logged)
+
+        assert outcomes[False] == outcomes[True]
+        assert [q for _, q, _ in outcomes[True][1]] == [99.0, 99.0]
+
+    def test_bulk_logs_upsert_counts_per_file(self, tmp_path, con, config, sample_order_df):
+        inbox = tmp_path / "inbox"
+        inbox.mkdir()
+        sample_order_df.head(1).write_csv(inbox / "orders.csv")
+        ingest_all(con, config, inbox_dir=inbox, batch_id=1)
+
+        (inbox / "orders.csv").unlink()
+        sample_order_df.with_columns(pl.lit("7").alias("qty_ordered")).write_csv(inbox / "a_orders.csv")
+        sample_order_df.head(1).with_columns(pl.lit("ORD-009").alias("channel_order_id")).write_csv(
+            inbox / "b_orders_new.csv"
+        )
+        ingest_all(con, config, inbox_dir=inbox, batch_id=2, bulk=True)
+
+        rows = con.execute(
+            "SELECT file_name, rows_inserted, rows_updated, rows_unchanged FROM raw.system_file_log "
+            "WHERE batch_id = 2 ORDER BY file_name"
+        ).fetchall()
+        assert rows == [("a_orders.csv", 1, 1, 0), ("b_orders_new.csv", 1, 0, 0)]
+
+
+class TestStreamingIngest:
+    """Chunked CSV ingestion must match the in-memory path, DQ included."""
+
+    def test_streaming_matches_eager(self, tmp_path, con, config):
+        path = tmp_path / "orders.csv"
+        _orders(250).write_csv(path)
+
+        config.ingest = {"streaming": {"min_file_mb": 0, "chunk_rows": 40}}
+        r = process_file(con, path, config, batch_id=1)
+        assert r["status"] == "success" and r["rows"] == 250
+
+        streamed = con.execute("SELECT * EXCLUDE (loaded_at) FROM core.fact_order ORDER BY 1").pl()
+        con.execute("DELETE FROM core.fact_order")
+        con.execute("DELETE FROM raw.system_file_log")
+        con.execute("DELETE FROM raw.system_loaded_file")
+
+        config.ingest = {"streaming": {}}
+        process_file(con, path, config, batch_id=1)
+        eager = con.execute("SELECT * EXCLUDE (loaded_at) FROM core.fact_order ORDER BY 1").pl()
+        assert streamed.equals(eager)
+
+    def test_duplicate_across_chunks_rejected(self, tmp_path, con, config):
+        df = _orders(100)
+        df = pl.concat([df, df.slice(3, 1)])  # duplicate lands in the last chunk
+        path = tmp_path / "orders.csv"
+        df.write_csv(path)
+
+        config.ingest = {"streaming": {"min_file_mb": 0, "chunk_rows": 10}}
+        r = process_file(con, path, config, batch_id=1)
+        assert r["status"] == "dq_failed"
+        assert "duplicate" in r["error"]
+        assert con.execute("SELECT COUNT(*) FROM core.fact_order").fetchone()[0] == 0
+
+
+class TestFileHashCache:
+    """Unchanged inbox files are resolved from the (path, size, mtime) cache without reading."""
+
+    def test_cache_hit_skips_hashing(self, tmp_path, con, monkeypatch):
+        import hashlib
+        import os
+
+        from src import ingest
+
+        a, b, empty = tmp_path / "a.csv", tmp_path / "b.csv", tmp_path / "empty.csv"
+        a.write_bytes(b"x,y\n1,2\n")
+        b.write_bytes(b"x,y\n3,4\n")
+        empty.write_bytes(b"")
+        files = [a, b, empty]
+
+        first = resolve_file_hashes(con, files)
+        assert first == [hashlib.sha256(f.read_bytes()).hexdigest() for f in files]
+        assert compute_file_hash(a) == first[0]
+
+        def fail(path):
+            raise AssertionError(f"{path} should come from the cache")
+
+        monkeypatch.setattr(ingest, "compute_file_hash", fail)
+        assert resolve_file_hashes(con, files) == first
+        monkeypatch.undo()
+
+        b.write_bytes(b"x,y\n5,6\n")
+        os.utime(b, ns=(0, 123))
+        second = resolve_file_hashes(con, files)
+        assert second[0] == first[0]
+        assert second[1] == hashlib.sha256(b"x,y\n5,6\n").hexdigest()
+
+    def test_dry_run_skips_cache_and_removed_files_are_pruned(self, tmp_path, con, config, sample_order_df):
+        inbox = tmp_path / "inbox"
+        inbox.mkdir()
+        sample_order_df.write_csv(inbox / "a_orders.csv")
+        sample_order_df.head(1).write_csv(inbox / "b_orders.csv")
+        cached = "SELECT COUNT(*) FROM raw.system_file_hash_cache"
+
+        ingest_all(con, config, inbox_dir=inbox, batch_id=1, dry_run=True)
+        assert con.execute(cached).fetchone()[0] == 0
+
+        ingest_all(con, config, inbox_dir=inbox, batch_id=2)
+        assert con.execute(cached).fetchone()[0] == 2
+
+        (inbox / "a_orders.csv").unlink()
+        ingest_all(con, config, inbox_dir=inbox, batch_id=3)
+        paths = con.execute("SELECT file_path FROM raw.system_file_hash_cache").fetchall()
+        assert paths == [(str((inbox / "b_orders.csv").resolve()),)]
+
+        config.ingest["archive"] = {"dir": str(tmp_path / "archive"), "rejected_dir": str(tmp_path / "rejected")}
+        ingest_all(con, config, inbox_dir=inbox, batch_id=4, archive=True)
+        assert con.execute(cached).fetchone()[0] == 0
+
+
+class TestLoadedFileRegistry:
+    """Already-loaded files are resolved for the whole inbox in one lookup."""
+
+    def test_loaded_hashes_from_registry(self, tmp_path, con, config, sample_order_df, sample_shipment_df):
+        inbox = tmp_path / "inbox"
+        _write_inbox(inbox, sample_order_df, sample_shipment_df)
+        results = ingest_all(con, config, inbox_dir=inbox, batch_id=1)
+        loaded = {r["file"] for r in results if r["status"] == "success"}
+
+        files = sorted(inbox.glob("*.csv"))
+        hashes = resolve_file_hashes(con, files)
+        expected = {h for f, h in zip(files, hashes) if f.name in loaded}
+        assert get_loaded_hashes(con, hashes + [None, "unknown"]) == expected
+        assert get_loaded_hashes(con, []) == set()
+
+        rerun = ingest_all(con, config, inbox_dir=inbox, batch_id=2)
+        assert [r["status"] for r in rerun if r["file"] in loaded] == ["skipped"] * len(loaded)
+
+    def test_backfill_from_file_log(self, con):
+        from src.db import init_db
+
+        # A database from before the registry existed
+        con.execute("DROP TABLE raw.system_loaded_file")
+        con.execute(
+            "INSERT INTO raw.system_file_log (batch_id, file_name, file_hash, table_name, row_count, status) "
+            "VALUES (1, 'a.csv', 'h1', 'fact_order', 1, 'success'), (1, 'b.csv', 'h2', NULL, 0, 'error')"
+        )
+        init_db(con)
+        assert get_loaded_hashes(con, ["h1", "h2"]) == {"h1"}
+
+    def test_dry_run_does_not_register_files(self, tmp_path, con, config, sample_order_df):
+        from src.db import init_db
+
+        inbox = tmp_path / "inbox"
+        inbox.mkdir()
+        sample_order_df.write_csv(inbox / "orders.csv")
+
+        dry = ingest_all(con, config, inbox_dir=inbox, batch_id=1, dry_run=True)
+        assert [r["status"] for r in dry] == ["success"]
+        assert con.execute("SELECT COUNT(*) FROM raw.system_loaded_file").fetchone()[0] == 0
+
+        init_db(con)
+        results = ingest_all(con, config, inbox_dir=inbox, batch_id=2)
+        assert [r["status"] for r in results] == ["success"]
+        assert con.execute("SELECT COUNT(*) FROM core.fact_order").fetchone()[0] == sample_order_df.height
+
+
+class TestLogBuffer:
+    """Buffered file/DQ logs must write exactly what direct logging writes."""
+
+    def test_buffered_matches_direct(self, con):
+        from src.dq import DQResult
+
+        dq = [DQResult("null_check", "CRITICAL", True, "ok"), DQResult("type_coercion", "MEDIUM", False, "3 rows")]
+
+        def write(logs):
+            log_dq_results(con, 1, "a.csv", "fact_order", dq, logs)
+            log_file(con, 1, "a.csv", "h1", "fact_order", 3, "success", logs=logs)
+            log_file(con, 1, "b.csv", "", None, 0, "error", "boom", logs)
+
+        def snapshot():
+            files = con.execute(
+                "SELECT * EXCLUDE (processed_at) FROM raw.system_file_log ORDER BY rowid"
+            ).fetchall()
+            checks = con.execute(
+                "SELECT * EXCLUDE (checked_at) FROM raw.system_dq_report ORDER BY rowid"
+            ).fetchall()
+            loaded = con.execute("SELECT file_hash, batch_id, file_name FROM raw.system_loaded_file").fetchall()
+            for table in ("system_file_log", "system_dq_report", "system_loaded_file"):
+                con.execute(f"DELETE FROM raw.{table}")
+            return files, checks, loaded
+
+        write(None)
+        direct = snapshot()
+
+        logs = LogBuffer()
+        write(logs)
+        assert len(logs) == 4
+        assert con.execute("SELECT COUNT(*) FROM raw.system_file_log").fetchone()[0] == 0
+        logs.flush(con)
+        assert len(logs) == 0
+        assert snapshot() == direct
+        assert direct[2] == [("h1", 1, "a.csv")]
+
+
+class TestQuarantine:
+    """Quarantine mode loads the clean rows and parks row-level DQ failures."""
+
+    def test_offending_rows_quarantined(self, tmp_path, con, config):
+        path = _bad_orders(tmp_path)
+
+        assert process_file(con, path, config, batch_id=1)["status"] == "dq_failed"
+
+        r = process_file(con, path, config, batch_id=2, quarantine=True)
+        assert r["status"] == "success" and r["rows"] == 198
+        assert con.execute("SELECT COUNT(*) FROM core.fact_order").fetchone()[0] == 198
+
+        rows = con.execute(
+            "SELECT batch_id, row_index, rule, row_data FROM raw.quarantine_fact_order ORDER BY row_index"
+        ).fetchall()
+        assert [(b, i, rule) for b, i, rule, _ in rows] == [
+            (2, 3, "null_business_key_channel_order_id"),
+            (2, 7, "type_coercion_qty_ordered"),
+        ]
+        assert '"qty_ordered":"x"' in rows[1][3]
+
+        note = con.execute(
+            "SELECT error_msg FROM raw.system_file_log WHERE batch_id = 2 AND status = 'success'"
+        ).fetchone()[0]
+        assert note == "2 rows quarantined to raw.quarantine_fact_order"
+
+    def test_threshold_rejects_whole_file(self, tmp_path, con, config):
+        path = _bad_orders(tmp_path)
+        config.thresholds["quarantine"]["max_rows"] = {"default": 1}
+
+        r = process_file(con, path, config, batch_id=1, quarantine=True)
+        assert r["status"] == "dq_failed"
+        assert "Quarantine limit exceeded: 2 of 200 rows" in r["error"]
+        assert con.execute("SELECT COUNT(*) FROM raw.quarantine_fact_order").fetchone()[0] == 0
+
+    def test_missing_column_not_quarantinable(self, tmp_path, con, config):
+        path = tmp_path / "orders.csv"
+        _orders(10).drop("item_id").write_csv(path)
+
+        r = process_file(con, path, config, batch_id=1, quarantine=True)
+        assert r["status"] == "dq_failed"
+        assert "Missing required columns" in r["error"]
+
+
+class TestInboxFormats:
+    """Parquet, Arrow IPC and compressed CSVs load the same rows as plain CSV."""
+
+    def _load(self, con, path, config) -> pl.DataFrame:
+        r = process_file(con, path, config, batch_id=1)
+        assert r["status"] == "success", r
+        df = con.execute(
+            "SELECT * EXCLUDE (loaded_at, source_file_hash) FROM core.fact_order ORDER BY ALL"
+        ).pl()
+        con.execute("DELETE FROM core.fact_order")
+        return df
+
+    def test_formats_match_csv(self, tmp_path, con, config, sample_order_df):
+        import gzip
+
+        import pyarrow as pa
+
+        csv_path = tmp_path / "orders.csv"
+        sample_order_df.write_csv(csv_path)
+        expected = self._load(con, csv_path, config)
+
+        gz_path = tmp_path / "orders.csv.gz"
+        gz_path.write_bytes(gzip.compress(csv_path.read_bytes()))
+        zst_path = tmp_path / "orders.csv.zst"
+        with pa.CompressedOutputStream(str(zst_path), "zstd") as out:
+            out.write(csv_path.read_bytes())
+
+        typed = sample_order_df.with_columns(
+            pl.col("line_no").cast(pl.Int32),
+            pl.col("order_date").str.to_date(),
+            pl.col("qty_ordered").cast(pl.Float64),
+        )
+        parquet_path = tmp_path / "orders.parquet"
+        typed.write_parquet(parquet_path)
+        ipc_path = tmp_path / "orders.arrow"
+        typed.write_ipc(ipc_path)
+
+        for path in (gz_path, zst_path, parquet_path, ipc_path):
+            assert read_header(path) == sample_order_df.columns
+            assert self._load(con, path, config).equals(expected), path.name
+
+    def test_typed_columns_conformed(self, config):
+        from src.ingest import conform_typed_columns
+
+        df = pl.DataFrame({
+            "line_no": pl.Series([1], dtype=pl.Int32),
+            "order_date": pl.Series([datetime(2024, 1, 15, 9)], dtype=pl.Datetime),
+            "qty_ordered": pl.Series([2], dtype=pl.Int16),
+            "item_id": pl.Series([7], dtype=pl.Int64),
+        })
+        out = conform_typed_columns(df, "fact_order", config)
+        assert out.schema["line_no"] == pl.Int64
+        assert out.schema["order_date"] == pl.Date
+        assert out.schema["qty_ordered"] == pl.Float64
+        assert out["item_id"].to_list() == ["7"]
+
+        # Float for a BIGINT column goes through the string path (and fails DQ there)
+        out = conform_typed_columns(pl.DataFrame({"line_no": [1.5]}), "fact_order", config)
+        assert out["line_no"].to_list() == ["1.5"]
+
+    def test_inbox_picks_up_new_formats(self, tmp_path, sample_order_df):
+        from src.ingest import inbox_format
+
+        assert inbox_format(Path("a.CSV.GZ")) == "csv"
+        assert inbox_format(Path("a.parquet")) == "parquet"
+        assert inbox_format(Path("a.feather")) == "ipc"
+        assert inbox_format(Path("a.json.gz")) is None
+
+
+class TestExcelSheets:
+    """XLSX worksheets are read as strings and can fan out into logical files."""
+
+    def _workbook(self, path: Path, sample_order_df, sample_shipment_df) -> None:
+        from openpyxl import Workbook
+
+        wb = Workbook()
+        orders = wb.active
+        orders.title = "orders"
+        orders.append(sample_order_df.columns)
+        for row in sample_order_df.iter_rows():
+            orders.append([datetime(2024, 1, 15) if c == "order_date" else v
+                           for c, v in zip(sample_order_df.columns, row)])
+        orders.append([None] * sample_order_df.width)  # trailing blank row
+
+        ships = wb.create_sheet("shipments")
+        ships.append(sample_shipment_df.columns)
+        for row in sample_shipment_df.iter_rows():
+            ships.append([10.0 if c == "qty_shipped" else v for c, v in zip(sample_shipment_df.columns, row)])
+        wb.create_sheet("notes")
+        wb.save(path)
+
+    def test_read_first_sheet_as_strings(self, tmp_path, sample_order_df, sample_shipment_df):
+        from src.ingest import read_file
+
+        path = tmp_path / "book.xlsx"
+        self._workbook(path, sample_order_df, sample_shipment_df)
+
+        df = read_file(path)
+        assert df.columns == sample_order_df.columns
+        assert df["order_date"].to_list() == ["2024-01-15", "2024-01-15"]
+        assert df["line_no"].to_list() == ["1", "1"]
+        assert read_file(path, "shipments")["qty_shipped"].to_list() == ["10"]
+
+    def test_fan_out_per_sheet(self, tmp_path, con, config, sample_order_df, sample_shipment_df):
+        inbox = tmp_path / "inbox"
+        inbox.mkdir()
+        self._workbook(inbox / "book.xlsx", sample_order_df, sample_shipment_df)
+
+        first = ingest_all(con, config, inbox_dir=inbox, batch_id=1)
+        assert [(r["file"], r["status"], r["table"]) for r in first] == [("book.xlsx", "success", "fact_order")]
+
+        config.ingest = {"excel": {"sheets": "all"}}
+        results = ingest_all(con, config, inbox_dir=inbox, batch_id=2)
+        assert [(r["file"], r["status"], r["table"]) for r in results] == [
+            ("book.xlsx[orders]", "success", "fact_order"),
+            ("book.xlsx[shipments]", "success", "fact_shipment"),
+            ("book.xlsx[notes]", "skipped", None),
+        ]
+        assert con.execute("SELECT COUNT(*) FROM core.fact_shipment").fetchone()[0] == 1
+
+        rerun = ingest_all(con, config, inbox_dir=inbox, batch_id=3)
+        assert [r["error"] for r in rerun[:2]] == ["File already loaded (same hash)"] * 2
+
+    def test_workbook_with_failed_sheet_is_rejected(self, tmp_path, con, config, sample_order_df, sample_shipment_df):
+        from openpyxl import load_workbook
+
+        inbox = tmp_path / "inbox"
+        inbox.mkdir()
+        path = inbox / "book.xlsx"
+        self._workbook(path, sample_order_df, sample_shipment_df)
+        wb = load_workbook(path)
+        wb.create_sheet("unknown").append(["random_col"])
+        wb["unknown"].append(["x"])
+        wb.save(path)
+        config.ingest = {
+            "excel": {"sheets": "all"},
+            "archive": {"dir": str(tmp_path / "archive"), "rejected_dir": str(tmp_path / "rejected")},
+        }
+
+        results = ingest_all(con, config, inbox_dir=inbox, batch_id=1, archive=True)
+        assert [r["status"] for r in results] == ["success", "success", "skipped", "error"]
+        day = datetime.now(timezone.utc).date().isoformat()
+        assert {Path(r["archive_path"]) for r in results} == {tmp_path / "rejected" / day / "book.xlsx"}
+
+    def test_sheet_setting_scalar_is_one_name(self, tmp_path, config, sample_order_df, sample_shipment_df):
+        from src.ingest import select_sheets
+
+        path = tmp_path / "book.xlsx"
+        self._workbook(path, sample_order_df, sample_shipment_df)
+
+        config.ingest = {"excel": {"sheets": "shipments"}}
+        assert select_sheets(path, config) == ["shipments"]
+        # Not a substring match against the sheet names
+        config.ingest = {"excel": {"sheets": "orders_and_notes"}}
+        assert select_sheets(path, config) == ["orders_and_notes"]
+        config.ingest = {"excel": {"sheets": ["notes", "orders"]}}
+        assert select_sheets(path, config) == ["orders", "notes"]
+
+        config.ingest = {"excel": {"sheets": {"name": "orders"}}}
+        with pytest.raises(ValueError, match="excel.sheets"):
+            select_sheets(path, config)
+
+
+class TestCommitGroups:
+    """A file's writes commit atomically; a failure rolls back only that file."""
+
+    @pytest.mark.parametrize("files_per_commit", [1, 3])
+    def test_failed_file_rolls_back_alone(self, tmp_path, con, config, monkeypatch, files_per_commit):
+        from src import ingest
+
+        inbox = tmp_path / "inbox"
+        inbox.mkdir()
+        for prefix in ("A", "B", "C"):
+            pl.DataFrame({
+                "system": ["OMS"] * 2,
+                "channel_order_id": [f"{prefix}-0", f"{prefix}-1"],
+                "line_no": ["1", "1"],
+                "order_date": ["2024-01-15"] * 2,
+                "channel_store_id": ["STORE-A"] * 2,
+                "item_id": ["SKU-001"] * 2,
+                "qty_ordered": ["1", "2"],
+            }).write_csv(inbox / f"{prefix}.csv")
+
+        real_upsert = ingest.upsert_core
+
+        def failing_after_write(con, df, table_name, *args):
+            rows = real_upsert(con, df, table_name, *args)
+            if df["channel_order_id"][0] == "B-0":
+                raise RuntimeError("simulated crash after the upsert")
+            return rows
+
+        monkeypatch.setattr(ingest, "upsert_core", failing_after_write)
+        config.ingest = {"transactions": {"files_per_commit": files_per_commit}}
+        results = ingest_all(con, config, inbox_dir=inbox, batch_id=1)
+
+        assert [r["status"] for r in results] == ["success", "error", "success"]
+        orders = con.execute("SELECT channel_order_id FROM core.fact_order ORDER BY 1").fetchall()
+        assert [o for (o,) in orders] == ["A-0", "A-1", "C-0", "C-1"]
+        file_log = con.execute("SELECT file_name, status FROM raw.system_file_log ORDER BY rowid").fetchall()
+        assert file_log == [("A.csv", "success"), ("B.csv", "error"), ("C.csv", "success")]
+        assert con.execute("SELECT COUNT(*) FROM raw.system_dq_report WHERE file_name = 'A.csv'").fetchone()[0] > 0
+
+    def test_failed_bulk_flush_persists_nothing(self, tmp_path, con, config, monkeypatch, sample_shipment_df):
+        from src import ingest
+
+        inbox = tmp_path / "inbox"
+        inbox.mkdir()
+        _bad_orders(inbox)
+        sample_shipment_df.write_csv(inbox / "b_shipments.csv")
+
+        real_replace = ingest._replace_into_core_by_file
+
+        def failing_after_write(con, df, table_name, bk_cols):
+            counts = real_replace(con, df, table_name, bk_cols)
+            if table_name == "fact_order":
+                raise RuntimeError("simulated crash after the upsert")
+            return counts
+
+        monkeypatch.setattr(ingest, "_replace_into_core_by_file", failing_after_write)
+        results = ingest_all(con, config, inbox_dir=inbox, batch_id=1, bulk=True, quarantine=True)
+
+        assert [(r["file"], r["status"]) for r in results] == [("b_shipments.csv", "success"), ("orders.csv", "error")]
+        assert con.execute("SELECT COUNT(*) FROM core.fact_order").fetchone()[0] == 0
+        assert con.execute("SELECT COUNT(*) FROM raw.quarantine_fact_order").fetchone()[0] == 0
+        assert con.execute("SELECT COUNT(*) FROM core.fact_shipment").fetchone()[0] == sample_shipment_df.height
+        loaded = con.execute("SELECT file_name FROM raw.system_loaded_file").fetchall()
+        assert loaded == [("b_shipments.csv",)]
+        file_log = con.execute("SELECT file_name, status FROM raw.system_file_log ORDER BY file_name").fetchall()
+        assert file_log == [("b_shipments.csv", "success"), ("orders.csv", "error")]
+
+        monkeypatch.undo()
+        retry = ingest_all(con, config, inbox_dir=inbox, batch_id=2, bulk=True, quarantine=True)
+        assert [r["status"] for r in retry] == ["skipped", "success"]
+        assert con.execute("SELECT COUNT(*) FROM core.fact_order").fetchone()[0] == 198
+        assert con.execute("SELECT COUNT(*) FROM raw.quarantine_fact_order").fetchone()[0] == 2
+
+
+class TestCategoricalEncoding:
+    """Configured ID columns stay dictionary-encoded up to DuckDB, values unchanged."""
+
+    def test_prepared_frame_is_encoded(self, tmp_path, con, config, sample_order_df):
+        from src.ingest import prepare_file
+
+        inbox = tmp_path / "inbox"
+        inbox.mkdir()
+        sample_order_df.write_csv(inbox / "a.csv")
+        sample_order_df.with_columns(pl.col("qty_ordered").str.replace("0", "5")).write_csv(inbox / "b.csv")
+
+        prepared = prepare_file(inbox / "a.csv", config, batch_id=1)
+        assert prepared.df.schema["item_id"] == pl.Categorical
+        assert prepared.df.schema["source_file_hash"] == pl.Categorical
+        assert prepared.df.schema["channel_order_id"] == pl.Utf8
+
+        ingest_all(con, config, inbox_dir=inbox, batch_id=1, bulk=True)
+        rows = con.execute(
+            "SELECT channel_order_id, item_id, channel_store_id, qty_ordered FROM core.fact_order ORDER BY 1"
+        ).fetchall()
+        assert rows == [("ORD-001", "SKU-001", "STORE-A", 15.0), ("ORD-002", "SKU-002", "STORE-A", 25.0)]
+
+
+class TestSchemaMigrations:
+    """init_db adds missing columns in place and records each migration once."""
+
+    def test_missing_columns_added_once(self, con, config):
+        import dataclasses
+
+        from src.config import ColumnDef
+        from src.db import init_db
+
+        con.execute("INSERT INTO core.fact_order (channel_order_id, line_no, order_date, channel_store_id, item_id, "
+                    "qty_ordered, source_system, load_batch_id, source_file_hash) "
+                    "VALUES ('ORD-1', 1, DATE '2024-01-15', 'S', 'SKU', 1, 'OMS', 1, 'h')")
+        con.execute("ALTER TABLE mart.mart_pnl_cogs DROP COLUMN coverage_flag")
+        order_schema = config.schema["fact_order"]
+        config.schema["fact_order"] = dataclasses.replace(
+            order_schema, optional_columns=(*order_schema.optional_columns, ColumnDef("promo_code", "VARCHAR"))
+        )
+
+        init_db(con, config)
+        applied = con.execute(
+            "SELECT migration_id, column_type, source FROM raw.schema_migrations ORDER BY migration_id"
+        ).fetchall()
+        assert applied == [
+            ("add_column:core.fact_order.promo_code", "VARCHAR", "schema.yaml"),
+            ("add_column:mart.mart_pnl_cogs.coverage_flag", "VARCHAR", "ddl"),
+        ]
+        assert con.execute("SELECT channel_order_id, promo_code FROM core.fact_order").fetchall() == [("ORD-1", None)]
+
+        init_db(con, config)
+        assert con.execute("SELECT COUNT(*) FROM raw.schema_migrations").fetchone()[0] == 2
+
+
+class TestInboxWatcher:
+    """--watch picks files up once stable and rebuilds only the affected marts."""
+
+    def test_tracker_waits_for_stable_files(self, tmp_path):
+        import os
+
+        from src.watch import InboxTracker
+
+        inbox = tmp_path / "inbox"
+        inbox.mkdir()
+        path = inbox / "a_orders.csv"
+        path.write_text("a\n1\n")
+        (inbox / "notes.txt").write_text("ignored")
+        tracker = InboxTracker(inbox, stable_polls=2)
+
+        assert tracker.poll() == []
+        assert tracker.poll() == [path]
+        # Still being written: the changed size restarts the count
+        path.write_text("a\n1\n2\n")
+        assert tracker.poll() == []
+        assert tracker.poll() == [path]
+
+        tracker.mark_done([path])
+        assert tracker.poll() == []
+        # A rewrite of a handled file is offered again
+        st = path.stat()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        tracker.poll()
+        assert tracker.poll() == [path]
+
+    def test_affected_phases(self):
+        from src.watch import MART_PHASES, affected_phases
+
+        assert affected_phases(set()) == []
+        assert affected_phases(None) == [p.name for p in MART_PHASES]
+        assert affected_phases({"fact_exchange_rate"}) == ["allocation", "pnl", "reco", "coverage"]
+        # Storage charges allocate over inventory; constraint detection follows the SCM marts
+        assert affected_phases({"fact_inventory_snapshot"}) == ["scm", "allocation", "pnl", "reco", "constraint"]
+
+    def test_ingest_all_restricted_to_files(self, tmp_path, con, config, sample_order_df, sample_shipment_df):
+        inbox = tmp_path / "inbox"
+        _write_inbox(inbox, sample_order_df, sample_shipment_df)
+
+        results = ingest_all(con, config, batch_id=1, files=[inbox / "b_shipments.csv"])
+        assert [(r["file"], r["status"]) for r in results] == [("b_shipments.csv", "success")]
+        assert con.execute("SELECT COUNT(*) FROM core.fact_order").fetchone()[0] == 0
+
+
+class TestArchive:
+    """--archive empties the inbox after commit and records where each file went."""
+
+    def test_archive_moves_files_and_records_manifest(self, tmp_path, con, config, sample_order_df, sample_shipment_df):
+        from src.ingest import read_file
+
+        inbox = tmp_path / "inbox"
+        _write_inbox(inbox, sample_order_df, sample_shipment_df)
+        sample_order_df.head(0).write_csv(inbox / "f_empty.csv")
+        config.ingest["archive"] = {
+            "dir": str(tmp_path / "archive"), "rejected_dir": str(tmp_path / "rejected"), "compress": "zstd",
+        }
+        day = datetime.now(timezone.utc).date().isoformat()
+
+        results = ingest_all(con, config, inbox_dir=inbox, batch_id=1, archive=True)
+
+        assert list(inbox.iterdir()) == []
+        archived = {r["file"]: Path(r["archive_path"]) for r in results}
+        assert archived["a_orders.csv"] == tmp_path / "archive" / "fact_order" / day / "a_orders.csv.zst"
+        assert archived["c_orders_copy.csv"].parent == tmp_path / "archive" / "_duplicate" / day
+        assert archived["d_dup.csv"].parent == tmp_path / "rejected" / day
+        assert archived["e_unknown.csv"].parent == tmp_path / "rejected" / day
+        # Empty (header-only) files are unusable, not duplicates
+        assert archived["f_empty.csv"].parent == tmp_path / "rejected" / day
+        # Recompressed archives stay readable inbox files
+        assert read_file(archived["a_orders.csv"]).shape == sample_order_df.shape
+
+        manifest = dict(con.execute("SELECT file_name, archive_path FROM raw.system_file_log").fetchall())
+        assert manifest == {name: str(path) for name, path in archived.items()}
+
+        # A revised file under the same name does not overwrite the archived copy
+        sample_order_df.with_columns(pl.lit(99).alias("qty_ordered")).write_csv(inbox / "a_orders.csv")
+        results = ingest_all(con, config, inbox_dir=inbox, batch_id=2, archive=True)
+        assert Path(results[0]["archive_path"]).name == "a_orders.b2.csv.zst"
+
+    def test_unmovable_file_stays_in_inbox(self, tmp_path, con, config, sample_order_df, monkeypatch):
+        import src.ingest as ingest
+
+        inbox = tmp_path / "inbox"
+        inbox.mkdir()
+        sample_order_df.write_csv(inbox / "a_orders.csv")
+        sample_order_df.with_columns(pl.lit("ORD-9").alias("order_id")).write_csv(inbox / "b_orders.csv")
+        config.ingest["archive"] = {
+            "dir": str(tmp_path / "archive"), "rejected_dir": str(tmp_path / "rejected"), "compress": "zstd",
+        }
+        real_read = ingest._open_csv_stream
+
+        def failing_read(path):
+            if path.name == "b_orders.csv":
+                raise OSError("disk full")
+            return real_read(path)
+
+        monkeypatch.setattr(ingest, "_open_csv_stream", failing_read)
+        results = ingest_all(con, config, inbox_dir=inbox, batch_id=1, archive=True)
+
+        # The failed move leaves its source in the inbox and no partial archive behind
+        assert [p.name for p in inbox.iterdir()] == ["b_orders.csv"]
+        assert not list((tmp_path / "archive").rglob("*.tmp"))
+        assert "archive_path" not in results[1]
+        manifest = dict(con.execute("SELECT file_name, archive_path FROM raw.system_file_log").fetchall())
+        assert manifest == {"a_orders.csv": results[0]["archive_path"], "b_orders.csv": None}
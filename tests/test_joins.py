@@ -21,7 +21,7 @@ class TestVersionedJoins:
         cost_df = filter_columns(cost_df, "fact_cost_structure", config)
         cost_df = cast_columns(cost_df, "fact_cost_structure", config)
         cost_df = add_system_columns(cost_df, 1, "h1", "fact_cost_structure", config)
-        upsert_core(con, cost_df, "fact_cost_structure", config, 1, "h1")
+        upsert_core(con, cost_df, "fact_cost_structure", config)
 
         # Query with ROW_NUMBER pattern for a date in January -> should get 5000
         result = con.execute("""
@@ -51,7 +51,7 @@ class TestVersionedJoins:
         cost_df = filter_columns(cost_df, "fact_cost_structure", config)
         cost_df = cast_columns(cost_df, "fact_cost_structure", config)
         cost_df = add_system_columns(cost_df, 1, "h1", "fact_cost_structure", config)
-        upsert_core(con, cost_df, "fact_cost_structure", config, 1, "h1")
+        upsert_core(con, cost_df, "fact_cost_structure", config)
 
         result = con.execute("""
             SELECT * FROM (
@@ -79,7 +79,7 @@ class TestVersionedJoins:
         cost_df = filter_columns(cost_df, "fact_cost_structure", config)
         cost_df = cast_columns(cost_df, "fact_cost_structure", config)
         cost_df = add_system_columns(cost_df, 1, "h1", "fact_cost_structure", config)
-        upsert_core(con, cost_df, "fact_cost_structure", config, 1, "h1")
+        upsert_core(con, cost_df, "fact_cost_structure", config)
 
         result = con.execute("""
             SELECT * FROM (
@@ -0,0 +1,145 @@
+"""Tests for period pruning: predicates, file period ranges, clustering."""
+from datetime import date
+
+import polars as pl
+
+from src.ingest import process_file
+from src.periods import (
+    batch_periods,
+    cluster_core_facts,
+    period_bounds,
+    period_predicate,
+    periods_between,
+)
+
+
+class TestPeriodHelpers:
+    """Period arithmetic and the SQL filters built from it."""
+
+    def test_bounds_and_ranges_roll_over_year_end(self):
+        assert period_bounds("2024-12") == (date(2024, 12, 1), date(2025, 1, 1))
+        assert periods_between("2024-11", "2025-02") == ["2024-11", "2024-12", "2025-01", "2025-02"]
+
+    def test_date_predicate_merges_consecutive_months(self, config):
+        sql, params = period_predicate("fact_shipment", ["2024-03", "2024-01", "2024-02", "2024-06"], config)
+        assert sql == "((ship_date >= ? AND ship_date < ?) OR (ship_date >= ? AND ship_date < ?))"
+        assert params == [date(2024, 1, 1), date(2024, 4, 1), date(2024, 6, 1), date(2024, 7, 1)]
+
+    def test_period_column_predicate_and_no_filter(self, config):
+        assert period_predicate("fact_settlement", ["2024-02", "2024-01"], config, alias="s") == (
+            "s.period IN (?, ?)", ["2024-01", "2024-02"],
+        )
+        assert period_predicate("fact_shipment", [], config) == ("TRUE", [])
+
+    def test_include_null_only_for_nullable_event_columns(self, config):
+        sql, _ = period_predicate("fact_charge_actual", ["2024-01"], config, include_null=True)
+        assert sql == "(((invoice_date >= ? AND invoice_date < ?)) OR invoice_date IS NULL)"
+        sql, _ = period_predicate("fact_shipment", ["2024-01"], config, include_null=True)
+        assert sql == "((ship_date >= ? AND ship_date < ?))"
+
+
+class TestPeriodPruning:
+    """Loaded files record their period range; clustering keeps every row."""
+
+    def test_file_log_period_range_feeds_batch_periods(self, tmp_path, con, config, sample_shipment_df):
+        pl.concat([
+            sample_shipment_df,
+            sample_shipment_df.with_columns(
+                pl.lit("SHP-002").alias("shipment_id"), pl.lit("2024-03-02").alias("ship_date"),
+            ),
+        ]).write_csv(tmp_path / "shipments.csv")
+        process_file(con, tmp_path / "shipments.csv", config, batch_id=7)
+
+        assert batch_periods(con, [7]) == {"fact_shipment": ["2024-01", "2024-02", "2024-03"]}
+
+        sql, params = period_predicate("fact_shipment", ["2024-03"], config)
+        rows = con.execute(f"SELECT shipment_id FROM core.fact_shipment WHERE {sql}", params).fetchall()
+        assert rows == [("SHP-002",)]
+
+    def test_streamed_file_records_period_range(self, tmp_path, con, config, sample_shipment_df):
+        dates = ["2024-03-05", "2024-01-20", "2024-02-11", "2024-01-02"]
+        sample_shipment_df.select(pl.exclude("ship_date")).join(
+            pl.DataFrame({"ship_date": dates, "n": range(4)}), how="cross",
+        ).with_columns(
+            pl.format("SHP-{}", pl.col("n")).alias("shipment_id"),
+        ).drop("n").write_csv(tmp_path / "shipments.csv")
+
+        config.ingest = {"streaming": {"min_file_mb": 0, "chunk_rows": 1}}
+        assert process_file(con, tmp_path / "shipments.csv", config, batch_id=3)["status"] == "success"
+        assert batch_periods(con, [3]) == {"fact_shipment": ["2024-01", "2024-02", "2024-03"]}
+
+    def test_cluster_rewrites_in_event_date_order(self, tmp_path, con, config, sample_shipment_df):
+        dates = ["2024-03-05", "2024-01-20", "2024-02-11", "2024-01-02"]
+        sample_shipment_df.select(pl.exclude("ship_date")).join(
+            pl.DataFrame({"ship_date": dates, "n": range(4)}), how="cross",
+        ).with_columns(
+            pl.format("SHP-{}", pl.col("n")).alias("shipment_id"),
+        ).drop("n").write_csv(tmp_path / "shipments.csv")
+        process_file(con, tmp_path / "shipments.csv", config, batch_id=1)
+
+        assert cluster_core_facts(con, config, ["fact_shipment"]) == {"fact_shipment": 4}
+        ordered = [r[0] for r in con.execute("SELECT ship_date FROM core.fact_shipment").fetchall()]
+        assert ordered == sorted(date.fromisoformat(d) for d in dates)
+        # PK index still enforced after the rewrite: a revised re-export upserts in place
+        pl.read_csv(tmp_path / "shipments.csv").with_columns(pl.lit(20).alias("qty_shipped")).write_csv(
+            tmp_path / "shipments_v2.csv"
+        )
+        assert process_file(con, tmp_path / "shipments_v2.csv", config, batch_id=2)["status"] == "success"
+        assert con.execute("SELECT COUNT(*) FROM core.fact_shipment").fetchone()[0] == 4
+
+    def test_rollback_removes_rows_without_event_date(self, tmp_path, con, config, sample_charge_df):
+        from datetime import datetime
+
+        from run import rollback_batches
+
+        con.execute(
+            "INSERT INTO raw.system_batch_log (batch_id, started_at, status) VALUES (1, ?, 'success')",
+            [datetime.now()],
+        )
+        pl.concat([
+            sample_charge_df.with_columns(pl.lit("I1").alias("invoice_no"), pl.lit("2024-01-15").alias("invoice_date")),
+            sample_charge_df.with_columns(pl.lit("I2").alias("invoice_no"), pl.lit(None, pl.Utf8).alias("invoice_date")),
+        ]).write_csv(tmp_path / "charges.csv")
+        process_file(con, tmp_path / "charges.csv", config, batch_id=1)
+        assert batch_periods(con, [1]) == {"fact_charge_actual": ["2024-01"]}
+
+        rollback_batches(con, config, 1)
+
+        assert con.execute("SELECT invoice_no, invoice_date FROM core.fact_charge_actual").fetchall() == []
+
+    def test_daily_marts_rebuild_only_loaded_periods(self, tmp_path, con, config, sample_shipment_df):
+        from src.mart_scm import build_all_scm_marts
+
+        jan = sample_shipment_df.with_columns(pl.lit("2024-01-10").alias("ship_date"))
+        jan.write_csv(tmp_path / "jan.csv")
+        process_file(con, tmp_path / "jan.csv", config, batch_id=1)
+        build_all_scm_marts(con, config)
+        # A stale January row only survives when the scoped rebuild leaves January alone
+        con.execute("UPDATE mart.mart_shipment_daily SET qty_shipped = -1")
+
+        jan.with_columns(
+            pl.lit("SHP-002").alias("shipment_id"), pl.lit("2024-02-03").alias("ship_date"),
+        ).write_csv(tmp_path / "feb.csv")
+        process_file(con, tmp_path / "feb.csv", config, batch_id=2)
+        periods = batch_periods(con, [2], updates_unknown=True)
+        assert periods == {"fact_shipment": ["2024-02"]}
+        build_all_scm_marts(con, config, periods)
+
+        rows = con.execute(
+            "SELECT ship_date, qty_shipped FROM mart.mart_shipment_daily ORDER BY ship_date"
+        ).fetchall()
+        assert rows == [(date(2024, 1, 10), -1), (date(2024, 2, 3), jan["qty_shipped"].cast(pl.Float64).sum())]
+        # fact_return did not change: its daily mart is not rebuilt at all
+        assert con.execute("SELECT COUNT(*) FROM mart.mart_return_daily").fetchone()[0] == 0
+
+    def test_updated_rows_make_periods_unknown(self, tmp_path, con, config, sample_shipment_df):
+        sample_shipment_df.write_csv(tmp_path / "shipments.csv")
+        process_file(con, tmp_path / "shipments.csv", config, batch_id=1)
+        # The revision moves the row to March; its old month is not recorded
+        sample_shipment_df.with_columns(pl.lit("2024-03-02").alias("ship_date")).write_csv(
+            tmp_path / "shipments_v2.csv"
+        )
+        process_file(con, tmp_path / "shipments_v2.csv", config, batch_id=2)
+
+        assert batch_periods(con, [2]) == {"fact_shipment": ["2024-03"]}
+        assert batch_periods(con, [2], updates_unknown=True) == {"fact_shipment": None}